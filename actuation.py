@@ -0,0 +1,221 @@
+import json
+import math
+
+import numpy as np
+
+from lattice import fps, steps
+
+INTERPOLATIONS = ('hold', 'linear')
+
+
+def resolve_body(sim, target):
+    # 'left', 'right', 'force' (the force_rect) or an index into sim.rectangles
+    named = {'left': sim.left_actuator, 'right': sim.right_actuator, 'force': sim.force_rect}
+    if target in named:
+        rect = named[target]
+    elif isinstance(target, int) and -len(sim.rectangles) <= target < len(sim.rectangles):
+        rect = sim.rectangles[target]
+    else:
+        rect = None
+    if rect is None:
+        raise ValueError('unknown actuation target %r' % (target,))
+    return rect.body
+
+
+def sample(times, values, at, interpolation='hold'):
+    # Evaluate a schedule at the times `at` -> (values (len(at), d), started
+    # mask). Before the first time the value is zero; after the last one the
+    # last value holds.
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float).reshape(len(times), -1)
+    if interpolation == 'hold':
+        i = np.searchsorted(times, at, side='right') - 1
+        out = values[np.maximum(i, 0)]
+    else:
+        out = np.stack([np.interp(at, times, values[:, c]) for c in range(values.shape[1])], axis=1)
+    started = at >= times[0]
+    out[~started] = 0
+    return out, started
+
+
+def _check_schedule(kind, schedule, value_key):
+    times = schedule['times']
+    if len(times) == 0 or len(times) != len(schedule[value_key]):
+        raise ValueError('%s schedule needs as many %s as times' % (kind, value_key))
+    if any(t1 < t0 for t0, t1 in zip(times, times[1:])):
+        raise ValueError('%s schedule times must not decrease' % kind)
+    if schedule.get('interpolation', 'hold') not in INTERPOLATIONS:
+        raise ValueError('unknown interpolation %r' % schedule['interpolation'])
+
+
+class ActuationProgram:
+    # Force, position and hinge schedules as time series, in seconds from
+    # the moment the program is attached. Forces are in world coordinates
+    # and add to whatever else acts on the body; positions drive the body's
+    # velocity towards the scheduled point while the schedule runs; hinge
+    # entries lock (True) or free (False) a joint, indexed like the
+    # flattened sim.joints pairs.
+    def __init__(self, forces=(), positions=(), hinges=()):
+        self.forces = []
+        self.positions = []
+        self.hinges = []
+        for schedule in forces:
+            self.force(**schedule)
+        for schedule in positions:
+            self.position(**schedule)
+        for schedule in hinges:
+            self.hinge(**schedule)
+
+    def force(self, target, times, values, interpolation='hold'):
+        schedule = {'target': target, 'times': list(times), 'values': [tuple(v) for v in values],
+                    'interpolation': interpolation}
+        _check_schedule('force', schedule, 'values')
+        self.forces.append(schedule)
+        return self
+
+    def pulse(self, target, time, force, dt=1/fps/steps):
+        # a force lasting a single substep, like an actuator key press
+        return self.force(target, [time, time + dt], [force, (0, 0)])
+
+    def position(self, target, times, values, interpolation='linear'):
+        schedule = {'target': target, 'times': list(times), 'values': [tuple(v) for v in values],
+                    'interpolation': interpolation}
+        _check_schedule('position', schedule, 'values')
+        self.positions.append(schedule)
+        return self
+
+    def hinge(self, joint, times, locked):
+        schedule = {'joint': joint, 'times': list(times), 'locked': [bool(v) for v in locked]}
+        _check_schedule('hinge', schedule, 'locked')
+        self.hinges.append(schedule)
+        return self
+
+    @property
+    def duration(self):
+        return max([s['times'][-1] for s in self.forces + self.positions + self.hinges], default=0.0)
+
+    def to_dict(self):
+        return {'forces': self.forces, 'positions': self.positions, 'hinges': self.hinges}
+
+    @classmethod
+    def from_dict(cls, spec):
+        return cls(spec.get('forces', ()), spec.get('positions', ()), spec.get('hinges', ()))
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def compile(self, sim, dt=1/fps/steps):
+        # Every schedule sampled at the start of each substep (positions at
+        # its end, since that's where the body should arrive).
+        n = int(math.ceil(self.duration / dt - 1e-9)) + 1
+        # nudged so a schedule time that is a whole number of substeps falls
+        # on that substep despite rounding in k * dt
+        at = (np.arange(n) + 1e-6) * dt
+
+        force_bodies = [resolve_body(sim, s['target']) for s in self.forces]
+        forces = np.zeros((n, len(self.forces), 2))
+        for j, s in enumerate(self.forces):
+            forces[:, j], started = sample(s['times'], s['values'], at, s['interpolation'])
+
+        position_bodies = [resolve_body(sim, s['target']) for s in self.positions]
+        positions = np.zeros((n, len(self.positions), 2))
+        position_active = np.zeros((n, len(self.positions)), dtype=bool)
+        for j, s in enumerate(self.positions):
+            positions[:, j], started = sample(s['times'], s['values'], at + dt, s['interpolation'])
+            position_active[:, j] = started & (at < s['times'][-1])
+
+        joints = [joint for pair in sim.joints for joint in pair]
+        events = []
+        for s in self.hinges:
+            if not -len(joints) <= s['joint'] < len(joints):
+                raise ValueError('unknown hinge %r' % (s['joint'],))
+            for t, locked in zip(s['times'], s['locked']):
+                events.append((int(round(t / dt)), s['joint'], locked))
+        events.sort(key=lambda e: e[0])
+        return CompiledProgram(sim, dt, force_bodies, forces, position_bodies, positions, position_active,
+                               [joints[j] for _, j, _ in events], np.array([e[0] for e in events], dtype=np.int64),
+                               np.array([e[2] for e in events], dtype=bool))
+
+
+class CompiledProgram:
+    # The per-substep arrays of an ActuationProgram bound to one simulation.
+    # As an observer it applies row k before the k-th substep after attach(),
+    # picking the row from simulated time. That only works for substeps of
+    # exactly `dt`: a longer one would skip rows (a pulse lasts one row) and
+    # push for too long, so an AdaptiveStepper steps at `dt` until the
+    # program is done. Past the end the last forces keep holding.
+    def __init__(self, sim, dt, force_bodies, forces, position_bodies, positions, position_active,
+                 hinge_joints, hinge_steps, hinge_locked):
+        self.sim = sim
+        self.dt = dt
+        self.n_steps = len(forces)
+        self.force_bodies = force_bodies
+        # plain tuples, and only for the rows that push on something
+        active = np.abs(forces).sum(axis=(1, 2)) > 0 if len(force_bodies) else np.zeros(self.n_steps, dtype=bool)
+        self.force_rows = [[tuple(f) for f in row] if on else None for row, on in zip(forces.tolist(), active)]
+        self.position_bodies = position_bodies
+        self.positions = positions
+        self.position_active = position_active
+        self.any_position = position_active.any(axis=1) if len(position_bodies) else np.zeros(self.n_steps, dtype=bool)
+        self.hinge_joints = hinge_joints
+        self.hinge_steps = hinge_steps
+        self.hinge_locked = hinge_locked
+        self.next_event = 0
+        self.start_time = None
+
+    def attach(self):
+        self.start_time = self.sim.time
+        self.next_event = 0
+        self.sim.observers.append(self)
+        return self
+
+    def index(self):
+        return int((self.sim.time - self.start_time) / self.dt + 1e-6)
+
+    @property
+    def done(self):
+        return self.start_time is not None and self.index() >= self.n_steps
+
+    def before_step(self, sim):
+        k = self.index()
+        row = self.force_rows[min(k, self.n_steps - 1)]
+        if row is not None:
+            for body, force in zip(self.force_bodies, row):
+                body.force += force
+
+        if k < self.n_steps and self.any_position[k]:
+            for j in np.flatnonzero(self.position_active[k]):
+                body = self.position_bodies[j]
+                x, y = body.position
+                tx, ty = self.positions[k, j]
+                body.velocity = ((tx - x) / self.dt, (ty - y) / self.dt)
+
+        while self.next_event < len(self.hinge_steps) and self.hinge_steps[self.next_event] <= k:
+            joint = self.hinge_joints[self.next_event]
+            if joint.is_constrained() != self.hinge_locked[self.next_event]:
+                joint.switch_constrain()
+            self.next_event += 1
+
+    def after_step(self, sim):
+        pass
+
+    def close(self):
+        if self in self.sim.observers:
+            self.sim.observers.remove(self)
+
+
+def run_program(sim, program, duration=None, dt=1/fps/steps):
+    # Batch-speed run: compile, then step back to back until the program (or
+    # `duration` seconds) is over. Returns the number of substeps taken.
+    compiled = program.compile(sim, dt).attach()
+    n = int(math.ceil((program.duration if duration is None else duration) / dt - 1e-9))
+    for i in range(n):
+        sim.step(dt)
+    compiled.close()
+    return n
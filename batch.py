@@ -0,0 +1,589 @@
+import argparse
+import time
+
+import numpy as np
+
+from lattice import *
+from checkpoint import capture_state, restore_state
+from geometry import box_corners, local_box_corners
+
+# Chipmunk's defaults for pymunk.Space and constraints
+ERROR_BIAS = (1 - 0.1) ** 60
+COLLISION_BIAS = (1 - 0.1) ** 60
+COLLISION_SLOP = 0.1
+
+
+def _colour(pairs, dynamic):
+    # Order constraints into groups in which no dynamic body appears twice,
+    # so each group can be solved in one vectorized Gauss-Seidel pass.
+    # Constraints against static bodies get groups of their own, which keeps
+    # the body indices of a chain's groups evenly spaced (see _as_slice).
+    # -> (permutation, list of slices into the permuted order)
+    groups = []
+    used = []
+    kinds = []
+    for i, (a, b) in enumerate(pairs):
+        bodies = {body for body in (a, b) if dynamic[body]}
+        kind = len(bodies)
+        for group, seen, other in zip(groups, used, kinds):
+            if kind == other and not bodies & seen:
+                group.append(i)
+                seen |= bodies
+                break
+        else:
+            groups.append([i])
+            used.append(set(bodies))
+            kinds.append(kind)
+    order = np.array([i for group in groups for i in group], dtype=np.intp)
+    bounds = np.cumsum([0] + [len(group) for group in groups])
+    return order, [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def _as_slice(indices):
+    # Evenly spaced indices as a slice, so that body rows are read and
+    # updated in place through a view rather than gathered and scattered.
+    indices = np.asarray(indices)
+    if len(indices) == 1:
+        return slice(int(indices[0]), int(indices[0]) + 1)
+    step = int(indices[1] - indices[0])
+    if step > 0 and (np.diff(indices) == step).all():
+        return slice(int(indices[0]), int(indices[-1]) + 1, step)
+    return indices
+
+
+class _Group:
+    # The rows of one colour group and the bodies they act on, as
+    # (rows, 3, count) velocity blocks for a and b. Where the body indices
+    # form slices these are views, updated in place; otherwise they are
+    # gathered and scattered back around a pass. When every b is the body
+    # after its a, as along a chain, both come as one (rows, 6, count) view
+    # (a's then b's velocity), which halves the work per row.
+    def __init__(self, batch, rows, a, b):
+        self.rows = rows
+        self.a = _as_slice(a)
+        self.b = _as_slice(b)
+        self.a_moves = bool(batch.dynamic[a].any())
+        self.b_moves = bool(batch.dynamic[b].any())
+        self.views = isinstance(self.a, slice) and isinstance(self.b, slice)
+        self.pairs = None
+        if self.views and (len(a) == 1 or self.a.step == 2) and (np.asarray(b) == np.asarray(a) + 1).all():
+            self.pairs = slice(int(a[0]), int(a[-1]) + 2)
+
+    def gather(self, velocity):
+        if self.pairs is not None:
+            return velocity[self.pairs].reshape(-1, 6, velocity.shape[2])
+        return velocity[self.a], velocity[self.b]
+
+    def scatter(self, velocity, blocks):
+        if not self.views:
+            velocity[self.a], velocity[self.b] = blocks
+
+
+class BatchLattice:
+    # `count` copies of a lattice of SlideJointed rectangles (the topology of
+    # `template`, a lattice.Simulation) stepped in lockstep by a vectorized
+    # version of Chipmunk's solver: the same integration order, accumulated
+    # and warm-started impulses, error bias, slop and friction, with every
+    # lattice solved by the same NumPy operation.
+    #
+    # The solver keeps each body's (x, y, angle) velocity together, so a
+    # constraint row is a Jacobian of three coefficients per body, built for
+    # every row and lattice at once in the prestep and premultiplied by the
+    # effective mass (for the velocity error) and by the inverse mass and
+    # moment (for the response). An iteration over one colour group is then
+    # an einsum for the velocity error of all its rows in all lattices and a
+    # broadcast add for the response. The groups themselves have to be
+    # visited in turn, as Gauss-Seidel does: that is what makes a locked
+    # chain as stiff as in pymunk after the same number of iterations.
+    #
+    # The state arrays have the lattice index first: position (count, n, 2),
+    # angle (count, n), velocity, angular_velocity and force (count, n, 2),
+    # with the bodies in the order of template.rectangles followed by the
+    # static template.blocks. They are views of body-major storage, which is
+    # what keeps the per-lattice cost low; write into them, don't rebind them.
+    # Hinge limits are per lattice in joint_max (count, n_joints), indexed
+    # like the flattened sim.joints pairs.
+    #
+    # Contacts are fixed corner-against-face pairs found in the template pose
+    # (neighbouring cells, actuators and their blocks); bodies that aren't
+    # close in the template never collide.
+    def __init__(self, template, count, iterations=None, dtype=np.float32, contact_margin=10):
+        self.count = count
+        self.iterations = template.space.iterations if iterations is None else iterations
+        self.dtype = dtype
+        self.gravity = tuple(template.space.gravity)
+        self.damping = template.space.damping
+        self.substep = template.substep
+        self.time = template.time
+        self.dt = 1/fps/steps
+        self.previous_dt = 0.0
+        self.hinge_changes = 0
+        self.observers = []
+
+        rects = list(template.rectangles) + list(template.blocks)
+        n = len(rects)
+        self.n_cells = len(template.rectangles)
+        index = {id(rect.body): i for i, rect in enumerate(rects)}
+        self.sizes = np.array([(rect.width, rect.height) for rect in rects], dtype=float).reshape(-1, 2)
+        self.dynamic = np.array([rect.body.body_type == rect.body.DYNAMIC for rect in rects], dtype=bool)
+        self.inv_mass = np.array([1 / rect.body.mass if dynamic else 0.0
+                                  for rect, dynamic in zip(rects, self.dynamic)], dtype=dtype)
+        self.inv_moment = np.array([1 / rect.body.moment if dynamic else 0.0
+                                    for rect, dynamic in zip(rects, self.dynamic)], dtype=dtype)
+        self.shape_friction = np.array([rect.shape.friction for rect in rects], dtype=float)
+        self.force_index = index[id(template.force_rect.body)] if template.force_rect else None
+
+        # body-major storage: (body, x/y/angle, lattice). Poses are always
+        # double precision: single precision only resolves 1e-4 px at the
+        # far end of the lattice, which sensitive lattices amplify to pixels
+        # within seconds. Offsets between bodies go to `dtype` for the solve.
+        self._pose = np.zeros((n, 3, count))
+        self._velocity = np.zeros((n, 3, count), dtype=dtype)
+        self._force = np.zeros((n, 2, count), dtype=dtype)
+        # Chipmunk's split-impulse velocities, cleared when positions move
+        self._bias_velocity = np.zeros((n, 3, count), dtype=dtype)
+        self.position = self._pose[:, :2].transpose(2, 0, 1)
+        self.angle = self._pose[:, 2].T
+        self.velocity = self._velocity[:, :2].transpose(2, 0, 1)
+        self.angular_velocity = self._velocity[:, 2].T
+        # cleared after every step, like pymunk's body.force
+        self.force = self._force.transpose(2, 0, 1)
+        self.force_flag = np.zeros(count, dtype=np.int64)
+        self.counter = np.zeros(count, dtype=np.int64)
+        # response of a body's velocity to a unit impulse: (1/m, 1/m, 1/I)
+        self._response = np.stack([self.inv_mass, self.inv_mass, self.inv_moment], axis=1)
+
+        joints = [joint for pair in template.joints for joint in pair]
+        self.free_max = np.array([j.free_max for j in joints], dtype=float)
+        self.joint_max = np.zeros((count, len(joints)))
+        order, self._joint_groups = _colour([(index[id(j.joint.a)], index[id(j.joint.b)]) for j in joints],
+                                            self.dynamic)
+        self._joint_order = order
+        joints = [joints[i] for i in order]
+        self._joint_a = np.array([index[id(j.joint.a)] for j in joints], dtype=np.intp)
+        self._joint_b = np.array([index[id(j.joint.b)] for j in joints], dtype=np.intp)
+        self._anchor_a = np.array([tuple(j.joint.anchor_a) for j in joints], dtype=dtype).reshape(-1, 2)
+        self._anchor_b = np.array([tuple(j.joint.anchor_b) for j in joints], dtype=dtype).reshape(-1, 2)
+        self._joint_min = np.array([j.joint.min for j in joints], dtype=dtype)[:, None]
+        self._joint_groups = [_Group(self, rows, self._joint_a[rows], self._joint_b[rows]) for rows in self._joint_groups]
+        self._joint_impulse = np.zeros((len(joints), count), dtype=dtype)
+
+        for k in range(count):
+            self.load(k, capture_state(template))
+        self.position[:, self.n_cells:] = np.array([tuple(rect.body.position) for rect in template.blocks],
+                                                   dtype=float).reshape(-1, 2)
+        self.angle[:, self.n_cells:] = np.array([rect.body.angle for rect in template.blocks], dtype=float)
+        self._build_contacts(contact_margin)
+
+    def _build_contacts(self, margin):
+        # One contact per corner of box b lying within `margin` of box a
+        # (a < b) in the template pose, against the face of a it is nearest.
+        pose = self.position[0].astype(float), self.angle[0].astype(float)
+        corners = box_corners(pose[0], pose[1], local_box_corners(self.sizes))
+        half = self.sizes / 2
+        low, high = corners.min(axis=1), corners.max(axis=1)
+        box, point, local, normal = [], [], [], []
+        for a in range(len(self.sizes)):
+            for b in range(a + 1, len(self.sizes)):
+                if not (self.dynamic[a] or self.dynamic[b]):
+                    continue
+                if not ((low[a] <= high[b] + margin).all() and (low[b] <= high[a] + margin).all()):
+                    continue
+                cos, sin = np.cos(pose[1][a]), np.sin(pose[1][a])
+                offset = corners[b] - pose[0][a]
+                qx = offset[:, 0] * cos + offset[:, 1] * sin
+                qy = -offset[:, 0] * sin + offset[:, 1] * cos
+                centre = pose[0][b] - pose[0][a]
+                # on a tie (a corner exactly on a's corner) the face towards
+                # b's centre
+                along_x = np.abs(centre[0] * cos + centre[1] * sin) / half[a, 0] >= \
+                    np.abs(-centre[0] * sin + centre[1] * cos) / half[a, 1]
+                sx, sy = np.abs(qx) - half[a, 0], np.abs(qy) - half[a, 1]
+                near = (sx <= margin) & (sy <= margin)
+                for c in np.flatnonzero(near):
+                    x_face = sx[c] > sy[c] + 1e-9 or (abs(sx[c] - sy[c]) <= 1e-9 and along_x)
+                    box.append(a)
+                    point.append(b)
+                    local.append(local_box_corners(self.sizes[b])[0][c])
+                    normal.append((np.sign(qx[c]), 0.0) if x_face else (0.0, np.sign(qy[c])))
+        order, self._contact_groups = _colour(list(zip(box, point)), self.dynamic)
+        self._contact_box = np.array(box, dtype=np.intp)[order]
+        self._contact_point = np.array(point, dtype=np.intp)[order]
+        self._contact_local = np.array(local, dtype=self.dtype).reshape(-1, 2)[order]
+        self._contact_normal = np.array(normal, dtype=self.dtype).reshape(-1, 2)[order]
+        along = np.abs(self._contact_normal[:, 0]) > 0
+        self._contact_depth = np.where(along, half[self._contact_box, 0],
+                                       half[self._contact_box, 1]).astype(self.dtype)[:, None]
+        self._contact_span = np.where(along, half[self._contact_box, 1],
+                                      half[self._contact_box, 0]).astype(self.dtype)[:, None]
+        self._contact_friction = (self.shape_friction[self._contact_box] *
+                                  self.shape_friction[self._contact_point]).astype(self.dtype)[:, None]
+        self._contact_groups = [_Group(self, rows, self._contact_box[rows], self._contact_point[rows])
+                                for rows in self._contact_groups]
+        m = len(box)
+        # accumulated (normal, tangent) impulse of every contact
+        self._contact_impulse = np.zeros((m, 2, self.count), dtype=self.dtype)
+        self._bias_impulse = np.zeros((m, self.count), dtype=self.dtype)
+
+    # state exchange with pymunk simulations
+
+    def load(self, k, state):
+        # Lattice k from a checkpoint.capture_state() dict of a simulation
+        # with the template's topology. Chipmunk's cached impulses aren't
+        # part of the state, so the first step after a load starts cold.
+        n = self.n_cells
+        self.position[k, :n] = state['position']
+        self.angle[k, :n] = state['angle']
+        self.velocity[k, :n] = state['velocity']
+        self.angular_velocity[k, :n] = state['angular_velocity']
+        self.force[k, :n] = state['force']
+        self.joint_max[k] = state['joint_max']
+        if self.force_index is not None:
+            self.force_flag[k] = state['force_flag'][self.force_index]
+            self.counter[k] = state['counter'][self.force_index]
+        self.hinge_changes += 1
+
+    def state(self, k):
+        # Lattice k as a capture_state() dict, for checkpoint.restore_state.
+        n = self.n_cells
+        force_flag = np.zeros(n, dtype=np.int64)
+        counter = np.zeros(n, dtype=np.int64)
+        if self.force_index is not None:
+            force_flag[self.force_index] = self.force_flag[k]
+            counter[self.force_index] = self.counter[k]
+        return {
+            'substep': np.array(self.substep, dtype=np.int64),
+            'time': np.array(self.time, dtype=np.float64),
+            'position': self.position[k, :n].astype(np.float64),
+            'angle': self.angle[k, :n].astype(np.float64),
+            'velocity': self.velocity[k, :n].astype(np.float64),
+            'angular_velocity': self.angular_velocity[k, :n].astype(np.float64),
+            'force': self.force[k, :n].astype(np.float64),
+            'torque': np.zeros(n),
+            'force_flag': force_flag,
+            'counter': counter,
+            'joint_max': self.joint_max[k].copy(),
+        }
+
+    def store(self, k, sim):
+        # Copy lattice k into a pymunk simulation of the same topology, e.g.
+        # to draw it or to carry on stepping it with pymunk.
+        restore_state(sim, self.state(k))
+
+    # the lattice.SlideJoint interface, per lattice
+
+    def is_constrained(self, k, joint):
+        return self.joint_max[k, joint] == 0
+
+    def switch_constrain(self, k, joint):
+        self.joint_max[k, joint] = self.free_max[joint] if self.is_constrained(k, joint) else 0
+        self.hinge_changes += 1
+
+    def set_locked(self, locked):
+        # locked: (count, n_joints) booleans, or one row for every lattice
+        self.joint_max[:] = np.where(np.asarray(locked, dtype=bool), 0.0, self.free_max)
+        self.hinge_changes += 1
+
+    def locked(self):
+        return self.joint_max == 0
+
+    # stepping, in the order of cpSpaceStep
+
+    def step(self, dt=1/fps/steps):
+        self.dt = dt
+        if self.force_index is not None:
+            self._force[self.force_index, 1] += np.where(
+                self.force_flag == 1, self.counter * -50.0,
+                np.where(self.force_flag == 2, (10 - self.counter) * 50.0, 0.0))
+        for observer in self.observers:
+            observer.before_step(self)
+
+        self._velocity += self._bias_velocity
+        self._pose += self._velocity * dt
+        self._velocity -= self._bias_velocity
+        self._bias_velocity[:] = 0
+
+        cos, sin = np.cos(self._pose[:, 2]).astype(self.dtype), np.sin(self._pose[:, 2]).astype(self.dtype)
+        joints = self._prestep_joints(dt, cos, sin)
+        contacts = self._prestep_contacts(dt, cos, sin)
+
+        damping = self.dtype(self.damping ** dt)
+        self._velocity *= damping
+        self._velocity[:, :2] += (np.array(self.gravity, dtype=self.dtype)[:, None] * self.dynamic[:, None, None] +
+                                  self._force * self.inv_mass[:, None, None]) * self.dtype(dt)
+        self._force[:] = 0
+
+        coef = dt / self.previous_dt if self.previous_dt else 0.0
+        if coef:
+            self._warm_start(joints, self._joint_groups, self._joint_impulse * self.dtype(coef))
+            self._warm_start(contacts, self._contact_groups, self._contact_impulse * self.dtype(coef))
+        # the split-impulse pass only does anything once a contact is in
+        # deeper than the slop
+        bias = bool(contacts['bias'].any())
+        # groups with no touching contact or joint at a limit in any lattice
+        # would only add zeros
+        contact_groups = [g for g, active in zip(self._contact_groups, contacts['active']) if active]
+        joint_groups = [g for g, active in zip(self._joint_groups, joints['active']) if active]
+        for i in range(self.iterations):
+            for group in contact_groups:
+                self._solve_contacts(contacts, group, bias)
+            for group in joint_groups:
+                self._solve_joints(joints, group)
+        self.previous_dt = dt
+
+        self.substep += 1
+        self.time += dt
+        for observer in self.observers:
+            observer.after_step(self)
+
+    def _arms(self, bodies, local, cos, sin):
+        lx, ly = local[:, 0:1], local[:, 1:2]
+        c, s = cos[bodies], sin[bodies]
+        return lx * c - ly * s, lx * s + ly * c
+
+    def _jacobian(self, a, b, r1x, r1y, r2x, r2y, nx, ny, mass_out, g, h):
+        # Rows of the velocity along n at r2 on b relative to r1 on a. Fills
+        # mass_out with 1/k, the effective mass of the pair along n; g with
+        # the (rows, 6, count) Jacobians for a's then b's (vx, vy, w) times
+        # that mass, and h with them times each body's response to a unit
+        # impulse. Every row has a dynamic body, so k > 0.
+        c1 = r1x * ny - r1y * nx
+        c2 = r2x * ny - r2y * nx
+        response_a, response_b = self._response[a], self._response[b]
+        k = response_a[:, 2:] * c1 * c1
+        k += response_b[:, 2:] * c2 * c2
+        k += (response_a[:, 0] + response_b[:, 0])[:, None]
+        np.divide(1, k, out=mass_out)
+        np.multiply(nx, mass_out, out=g[:, 3])
+        np.multiply(ny, mass_out, out=g[:, 4])
+        np.multiply(c2, mass_out, out=g[:, 5])
+        np.negative(g[:, 3], out=g[:, 0])
+        np.negative(g[:, 4], out=g[:, 1])
+        np.multiply(c1, mass_out, out=g[:, 2])
+        np.negative(g[:, 2], out=g[:, 2])
+        np.multiply(nx, -response_a[:, 0:1], out=h[:, 0])
+        np.multiply(ny, -response_a[:, 0:1], out=h[:, 1])
+        np.multiply(c1, -response_a[:, 2:], out=h[:, 2])
+        np.multiply(nx, response_b[:, 0:1], out=h[:, 3])
+        np.multiply(ny, response_b[:, 0:1], out=h[:, 4])
+        np.multiply(c2, response_b[:, 2:], out=h[:, 5])
+
+    def _prestep_joints(self, dt, cos, sin):
+        a, b = self._joint_a, self._joint_b
+        r1x, r1y = self._arms(a, self._anchor_a, cos, sin)
+        r2x, r2y = self._arms(b, self._anchor_b, cos, sin)
+        px, py = self._pose[:, 0], self._pose[:, 1]
+        dx = (px[b] - px[a]).astype(self.dtype) + r2x - r1x
+        dy = (py[b] - py[a]).astype(self.dtype) + r2y - r1y
+        distance = np.hypot(dx, dy)
+        limit = self.joint_max.T[self._joint_order].astype(self.dtype)
+        over = distance > limit
+        under = distance < self._joint_min
+        error = np.where(over, distance - limit, np.where(under, self._joint_min - distance, 0))
+        direction = np.where(over, 1.0, np.where(under, -1.0, 0.0)).astype(self.dtype) / (distance + 1e-30)
+        # like cpSlideJoint, a joint within its limits forgets its impulse
+        active = over | under
+        self._joint_impulse *= active
+        c = {name: np.empty((len(a), 6, self.count), dtype=self.dtype) for name in ('g', 'h')}
+        mass = np.empty(distance.shape, dtype=self.dtype)
+        self._jacobian(a, b, r1x, r1y, r2x, r2y, dx * direction, dy * direction, mass, c['g'], c['h'])
+        c['bias_mass'] = -(1 - ERROR_BIAS ** dt) * error / dt * mass
+        c['active'] = [bool(active[group.rows].any()) for group in self._joint_groups]
+        return c
+
+    def _prestep_contacts(self, dt, cos, sin):
+        a, b = self._contact_box, self._contact_point
+        r2x, r2y = self._arms(b, self._contact_local, cos, sin)
+        nx, ny = self._arms(a, self._contact_normal, cos, sin)
+        px, py = self._pose[:, 0], self._pose[:, 1]
+        ox = (px[b] - px[a]).astype(self.dtype) + r2x
+        oy = (py[b] - py[a]).astype(self.dtype) + r2y
+        distance = ox * nx + oy * ny - self._contact_depth
+        across = np.abs(-ox * ny + oy * nx)
+        touching = (distance <= 0) & (distance >= -2 * self._contact_depth) & \
+            (across <= self._contact_span + COLLISION_SLOP)
+        # contacts that come apart lose their impulses, as their arbiter would
+        self._contact_impulse *= touching[:, None]
+        self._bias_impulse[:] = 0
+        r1x = ox - nx * distance
+        r1y = oy - ny * distance
+        nx = nx * touching
+        ny = ny * touching
+        # normal and tangent rows side by side: (rows, 2, 6, count)
+        c = {name: np.empty((len(a), 2, 6, self.count), dtype=self.dtype) for name in ('g', 'h')}
+        mass = np.empty((2,) + distance.shape, dtype=self.dtype)
+        for i, (tx, ty) in enumerate(((nx, ny), (-ny, nx))):
+            self._jacobian(a, b, r1x, r1y, r2x, r2y, tx, ty, mass[i], c['g'][:, i], c['h'][:, i])
+        c['bias'] = -(1 - COLLISION_BIAS ** dt) * np.minimum(0, distance + COLLISION_SLOP) / dt * touching
+        c['bias_mass'] = c['bias'] * mass[0]
+        c['active'] = [bool(touching[group.rows].any()) for group in self._contact_groups]
+        return c
+
+    def _error(self, c, group, blocks):
+        # velocity error of every row of the group, times its effective mass
+        g = c['g'][group.rows]
+        spec = 'rkc,rkc->rc' if g.ndim == 3 else 'rdkc,rkc->rdc'
+        if group.pairs is not None:
+            return np.einsum(spec, g, blocks)
+        va, vb = blocks
+        error = np.einsum(spec, g[..., 3:, :], vb) if group.b_moves else 0
+        if group.a_moves:
+            error = error + np.einsum(spec, g[..., :3, :], va)
+        return error
+
+    def _respond(self, c, group, blocks, impulse):
+        # -impulse on a at r1, +impulse on b at r2; an impulse with a
+        # (normal, tangent) axis is summed over it
+        h = c['h'][group.rows]
+        spec = 'rkc,rc->rkc' if impulse.ndim == 2 else 'rdkc,rdc->rkc'
+        if group.pairs is not None:
+            blocks += np.einsum(spec, h, impulse)
+            return
+        va, vb = blocks
+        if group.a_moves:
+            va += np.einsum(spec, h[..., :3, :], impulse)
+        if group.b_moves:
+            vb += np.einsum(spec, h[..., 3:, :], impulse)
+
+    def _warm_start(self, c, groups, impulses):
+        # one colour group at a time, each has every dynamic body at most once
+        for group in groups:
+            blocks = group.gather(self._velocity)
+            self._respond(c, group, blocks, impulses[group.rows])
+            group.scatter(self._velocity, blocks)
+
+    def _solve_joints(self, c, group):
+        rows = group.rows
+        blocks = group.gather(self._velocity)
+        old = self._joint_impulse[rows]
+        # max_force is infinite, so only the sign is clamped
+        impulse = np.minimum(old + c['bias_mass'][rows] - self._error(c, group, blocks), 0)
+        j = impulse - old
+        old[...] = impulse
+        self._respond(c, group, blocks, j)
+        group.scatter(self._velocity, blocks)
+
+    def _solve_contacts(self, c, group, bias):
+        rows = group.rows
+        if bias:
+            normal = {'g': c['g'][:, 0], 'h': c['h'][:, 0]}
+            blocks = group.gather(self._bias_velocity)
+            old = self._bias_impulse[rows]
+            impulse = np.maximum(old + c['bias_mass'][rows] - self._error(normal, group, blocks), 0)
+            j = impulse - old
+            old[...] = impulse
+            self._respond(normal, group, blocks, j)
+            group.scatter(self._bias_velocity, blocks)
+
+        blocks = group.gather(self._velocity)
+        old = self._contact_impulse[rows]
+        impulse = old - self._error(c, group, blocks)
+        np.maximum(impulse[:, 0], 0, out=impulse[:, 0])
+        limit = self._contact_friction[rows] * impulse[:, 0]
+        np.minimum(impulse[:, 1], limit, out=impulse[:, 1])
+        np.negative(limit, out=limit)
+        np.maximum(impulse[:, 1], limit, out=impulse[:, 1])
+        j = impulse - old
+        old[...] = impulse
+        self._respond(c, group, blocks, j)
+        group.scatter(self._velocity, blocks)
+
+    def joint_impulses(self):
+        # (count, n_joints) impulse of every SlideJoint in the latest step,
+        # like pymunk's abs(constraint.impulse)
+        impulses = np.empty((self.count, len(self._joint_order)))
+        impulses[:, self._joint_order] = np.abs(self._joint_impulse.T)
+        return impulses
+
+    def corners(self):
+        # (count, n_cells, 4, 2) cell corners, BOT_LEFT..TOP_RIGHT
+        n = self.n_cells
+        local = np.broadcast_to(local_box_corners(self.sizes[:n]), (self.count, n, 4, 2)).reshape(-1, 4, 2)
+        return box_corners(self.position[:, :n].reshape(-1, 2), self.angle[:, :n].ravel(),
+                           local).reshape(self.count, n, 4, 2)
+
+    def lattice_state(self, k):
+        # headless.lattice_state of lattice k
+        n = self.n_cells
+        cells = [{'position': tuple(self.position[k, i].tolist()), 'angle': float(self.angle[k, i]),
+                  'velocity': tuple(self.velocity[k, i].tolist()),
+                  'angular_velocity': float(self.angular_velocity[k, i])}
+                 for i in range(n)]
+        locked = self.locked()[k]
+        hinges = list(zip(locked[0::2].tolist(), locked[1::2].tolist()))
+        return {'cells': cells, 'joints': hinges, 'corners': self.corners()[k].tolist()}
+
+
+def build_batch_lattice(count, iterations=None, dtype=np.float32, **design):
+    # `count` copies of build_horizontal_lattice(**design) at its start pose
+    return BatchLattice(build_horizontal_lattice(**design), count, iterations=iterations, dtype=dtype)
+
+
+def run_batch(duration=10, fps=fps, steps=steps, batch=None, callback=None):
+    # run_headless for a BatchLattice: every lattice advances together and
+    # callback(batch) runs after every substep.
+    if batch is None:
+        batch = build_batch_lattice(1)
+    dt = 1 / fps / steps
+    n = int(round(duration * fps)) * steps
+    first_time = batch.time
+    start = time.perf_counter()
+    for i in range(n):
+        batch.step(dt)
+        if callback is not None:
+            callback(batch)
+    wall_time = time.perf_counter() - start
+    simulated_time = batch.time - first_time
+    return {
+        'lattices': batch.count,
+        'substeps': n,
+        'dt': dt,
+        'simulated_time': simulated_time,
+        'wall_time': wall_time,
+        'lattice_substeps_per_sec': n * batch.count / wall_time if wall_time > 0 else float('inf'),
+        'realtime_factor': simulated_time * batch.count / wall_time if wall_time > 0 else float('inf'),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Step many horizontal lattices in lockstep with NumPy.')
+    parser.add_argument('count', type=int, nargs='?', default=1000, help='number of lattices')
+    parser.add_argument('--duration', type=float, default=5, help='simulated seconds')
+    parser.add_argument('--fps', type=int, default=fps)
+    parser.add_argument('--steps', type=int, default=steps)
+    parser.add_argument('--iterations', type=int, help='solver iterations per substep (default: as pymunk)')
+    parser.add_argument('--float64', action='store_true', help='double precision state, as pymunk')
+    parser.add_argument('--random-hinges', action='store_true', help='lock or free every inner hinge at random')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help='also run the first N lattices with pymunk and compare')
+    args = parser.parse_args()
+
+    batch = build_batch_lattice(args.count, args.iterations, np.float64 if args.float64 else np.float32)
+    if args.random_hinges:
+        rng = np.random.default_rng(args.seed)
+        locked = rng.random(batch.joint_max.shape) < 0.5
+        # the actuators' hinges stay as built
+        locked[:, [0, 1, -2, -1]] = batch.locked()[:, [0, 1, -2, -1]]
+        batch.set_locked(locked)
+    initial = [batch.state(k) for k in range(min(args.check, args.count))]
+
+    stats = run_batch(args.duration, args.fps, args.steps, batch=batch)
+    for key, value in stats.items():
+        print(key, value)
+
+    if initial:
+        from headless import run_headless
+        wall_time = 0.0
+        differences = []
+        for k, state in enumerate(initial):
+            sim = build_horizontal_lattice()
+            restore_state(sim, state)
+            result, run = run_headless(args.duration, args.fps, args.steps, sim=sim)
+            wall_time += run['wall_time']
+            differences.append(np.abs(batch.corners()[k] - np.array(result['corners'])).max())
+        pymunk_rate = stats['substeps'] * len(initial) / wall_time
+        print('pymunk_lattice_substeps_per_sec', pymunk_rate)
+        print('speedup', stats['lattice_substeps_per_sec'] / pymunk_rate)
+        print('max_corner_difference', max(differences))
+        print('median_corner_difference', float(np.median(differences)))
@@ -0,0 +1,382 @@
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import pymunk
+
+from lattice import *
+from generator import build_grid_lattice
+
+# Each result records which direction is an improvement so --compare can
+# tell a regression from a speed-up.
+HIGHER = 'higher'
+LOWER = 'lower'
+
+
+def chain(cells):
+    # horizontal_mode-style chain with `cells` rectangles including the two actuators
+    return build_horizontal_lattice(rectangle_widths=[50] * max(cells - 2, 1))
+
+
+def grid(cells):
+    side = max(int(round(cells ** 0.5)), 2)
+    return build_grid_lattice(side, side)
+
+
+LATTICES = {'chain': chain, 'grid': grid}
+
+# What headless runs and sweep, configuration and optimiser workers import.
+# None of these may load pygame; that is left to the viewer modules
+# (run_app, renderer, capture, replay).
+CORE_MODULES = ('lattice', 'geometry', 'headless', 'checkpoint', 'quiescence', 'stepping', 'equilibrium',
+                'configurations', 'sweep', 'optimise', 'batch', 'telemetry', 'scene', 'session', 'actuation',
+                'recorder', 'generator')
+
+# Startup budgets in ms, checked by --startup and test_startup.py: a cold
+# import of any core module, and per start method a pool worker that
+# imports sweep, as the sweep, configuration and optimiser workers do. A
+# forked worker inherits the imports (about 25 ms); spawn and forkserver
+# start a fresh interpreter and import numpy and pymunk again (about 210 ms).
+IMPORT_BUDGET = 150
+WORKER_BUDGETS = {'fork': 50, 'forkserver': 300, 'spawn': 300}
+
+
+def result(name, params, value, unit, better):
+    return {'name': name, 'params': params, 'value': value, 'unit': unit, 'better': better}
+
+
+def time_steps(sim, dt, budget):
+    # Warm up, then step until at least `budget` seconds have passed.
+    for i in range(10):
+        sim.step(dt)
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < budget:
+        for i in range(20):
+            sim.step(dt)
+        count += 20
+        elapsed = time.perf_counter() - start
+    return count / elapsed
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def bench_construction(kind, cells):
+    gc.collect()
+    start = time.perf_counter()
+    sim = LATTICES[kind](cells)
+    elapsed = time.perf_counter() - start
+    n = len(sim.rectangles)
+    return [result('construction', {'lattice': kind, 'cells': n}, elapsed, 's', LOWER),
+            result('construction_per_cell', {'lattice': kind, 'cells': n}, elapsed / n * 1e6, 'us', LOWER)]
+
+
+def bench_memory(kind, cells):
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    sim = LATTICES[kind](cells)
+    python_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    rss_after = rss_bytes()
+    n = len(sim.rectangles)
+    results = [result('python_memory_per_cell', {'lattice': kind, 'cells': n}, python_bytes / n, 'B', LOWER)]
+    if rss_before is not None:
+        results.append(result('rss_per_cell', {'lattice': kind, 'cells': n}, (rss_after - rss_before) / n, 'B', LOWER))
+    return results
+
+
+def bench_steps(kind, cells, substeps, budget):
+    sim = LATTICES[kind](cells)
+    rate = time_steps(sim, 1 / fps / substeps, budget)
+    return [result('step_throughput', {'lattice': kind, 'cells': len(sim.rectangles), 'steps': substeps}, rate,
+                   'substeps/s', HIGHER)]
+
+
+def bench_iterations(kind, cells, iterations, budget):
+    sim = LATTICES[kind](cells)
+    sim.space.iterations = iterations
+    rate = time_steps(sim, 1 / fps / steps, budget)
+    return [result('step_throughput', {'lattice': kind, 'cells': len(sim.rectangles), 'iterations': iterations}, rate,
+                   'substeps/s', HIGHER)]
+
+
+def bench_telemetry(kind, cells, budget):
+    # stepping with telemetry.JointTelemetry sampling every substep; compare
+    # with the plain step_throughput of the same lattice
+    from telemetry import JointTelemetry
+    sim = LATTICES[kind](cells)
+    JointTelemetry(sim)
+    rate = time_steps(sim, 1 / fps / steps, budget)
+    return [result('step_throughput', {'lattice': kind, 'cells': len(sim.rectangles), 'telemetry': True}, rate,
+                   'substeps/s', HIGHER)]
+
+
+def bench_broadphase(kind, cells, budget):
+    results = []
+    for broadphase in ('bbtree', 'spatial_hash'):
+        sim = LATTICES[kind](cells)
+        if broadphase == 'spatial_hash':
+            # cells are 50px wide; chipmunk recommends roughly the shape size
+            # and a table a few times the shape count
+            sim.space.use_spatial_hash(50, max(len(sim.space.shapes) * 4, 1000))
+        rate = time_steps(sim, 1 / fps / steps, budget)
+        results.append(result('step_throughput', {'lattice': kind, 'cells': len(sim.rectangles), 'broadphase': broadphase},
+                              rate, 'substeps/s', HIGHER))
+    return results
+
+
+def bench_adaptive(budget):
+    # headless.run_headless of the horizontal_mode chain, resting and pushed
+    # by force_rect, with fixed substeps and with stepping.AdaptiveStepper;
+    # the win is in wall clock, so this reports simulated seconds per second
+    from headless import run_headless
+    from stepping import AdaptiveStepper
+    results = []
+    for load in ('rest', 'pushed'):
+        for stepping in ('fixed', 'adaptive'):
+            simulated = wall = 0.0
+            while wall < budget:
+                sim = build_horizontal_lattice()
+                if load == 'pushed':
+                    sim.force_rect.forceFlag = 1
+                    sim.force_rect.counter = 10
+                stepper = AdaptiveStepper(sim) if stepping == 'adaptive' else None
+                state, stats = run_headless(10, sim=sim, stepper=stepper)
+                simulated += stats['simulated_time']
+                wall += stats['wall_time']
+            results.append(result('realtime_factor', {'lattice': 'chain', 'load': load, 'stepping': stepping},
+                                  simulated / wall, 'x', HIGHER))
+    return results
+
+
+def bench_batch(budget):
+    # horizontal_mode chains stepped together by batch.BatchLattice, against
+    # the same chain in pymunk, in lattice substeps per second
+    import numpy as np
+    from batch import build_batch_lattice
+    results = [result('batch_throughput', {'engine': 'pymunk', 'lattices': 1},
+                      time_steps(build_horizontal_lattice(), 1 / fps / steps, budget), 'lattice substeps/s', HIGHER)]
+    for count in (1, 100, 1000, 4000):
+        for dtype in (np.float64, np.float32):
+            batch = build_batch_lattice(count, dtype=dtype)
+            rate = time_steps(batch, 1 / fps / steps, budget) * count
+            results.append(result('batch_throughput', {'engine': 'batch', 'lattices': count, 'dtype': dtype.__name__},
+                                  rate, 'lattice substeps/s', HIGHER))
+    return results
+
+
+def cold_import(module):
+    # Import `module` in a fresh interpreter -> (seconds, whether pygame
+    # was loaded along the way)
+    code = ('import sys, time\nstart = time.perf_counter()\nimport %s\n'
+            'print(time.perf_counter() - start, "pygame" in sys.modules)' % module)
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[-2]), out[-1] == 'True'
+
+
+def worker_startup(method=None, module='sweep'):
+    # Seconds from creating a one-process Pool to its first result, in a
+    # fresh interpreter that has already imported `module`. A forked worker
+    # inherits it; spawn and forkserver workers import it again, as sweep.py's
+    # workers re-import sweep.
+    code = ('import importlib, multiprocessing, os, time\nimportlib.import_module(%r)\n'
+            'start = time.perf_counter()\n'
+            'with multiprocessing.get_context(%r).Pool(1, importlib.import_module, (%r,)) as pool:\n'
+            '    pool.apply(os.getpid)\n'
+            'print(time.perf_counter() - start)' % (module, method, module))
+    env = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')
+    out = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                         capture_output=True, text=True, check=True).stdout.split()
+    return float(out[-1])
+
+
+def bench_startup():
+    results = []
+    for module in CORE_MODULES:
+        seconds, pygame_loaded = cold_import(module)
+        results.append(result('import_time', {'module': module, 'pygame': pygame_loaded}, seconds * 1e3, 'ms',
+                              LOWER))
+    for method in multiprocessing.get_all_start_methods():
+        results.append(result('worker_startup', {'start_method': method, 'module': 'sweep'},
+                              worker_startup(method) * 1e3, 'ms', LOWER))
+    return results
+
+
+def check_startup(results, import_budget=IMPORT_BUDGET, worker_budgets=WORKER_BUDGETS):
+    # -> failure messages: core modules that load pygame or import slower
+    # than import_budget ms, and workers slower than the worker_budgets
+    # entry (ms) for their start method
+    failures = []
+    for r in results:
+        if r['name'] == 'import_time':
+            if r['params']['pygame']:
+                failures.append('%s imports pygame' % r['params']['module'])
+            if r['value'] > import_budget:
+                failures.append('%s takes %.0f ms to import (budget %.0f ms)' % (r['params']['module'], r['value'],
+                                                                               import_budget))
+        elif r['name'] == 'worker_startup':
+            method = r['params']['start_method']
+            if r['value'] > worker_budgets[method]:
+                failures.append('a %s worker takes %.0f ms to start (budget %.0f ms)' % (method, r['value'],
+                                                                                      worker_budgets[method]))
+    return failures
+
+
+def bench_draw(kind, cells, budget):
+    try:
+        import pygame
+        import pymunk.pygame_util
+    except ImportError:
+        return []
+    from geometry import LatticeGeometry
+    from renderer import LatticeRenderer
+
+    sim = LATTICES[kind](cells)
+    surface = pygame.Surface(size)
+    draw_options = pymunk.pygame_util.DrawOptions(surface)
+    geometry = LatticeGeometry(sim.rectangles)
+    renderer = LatticeRenderer(surface, sim)
+    renderer.fit()
+
+    def debug_draw():
+        surface.fill((220, 220, 220))
+        sim.space.debug_draw(draw_options)
+
+    def polygons():
+        surface.fill((220, 220, 220))
+        for polygon in geometry.update()[:, [0, 1, 3, 2]]:
+            pygame.draw.polygon(surface, (70, 130, 180), polygon)
+
+    def lattice_renderer():
+        # whole lattice fitted to the screen, repainted every frame
+        renderer.full_redraw = True
+        renderer.draw(update_display=False)
+
+    results = []
+    for name, draw in (('debug_draw', debug_draw), ('geometry_polygons', polygons), ('renderer', lattice_renderer)):
+        draw()
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < budget:
+            draw()
+            count += 1
+        elapsed = (time.perf_counter() - start) / count
+        results.append(result('draw_time', {'lattice': kind, 'cells': len(sim.rectangles), 'method': name},
+                              elapsed * 1e3, 'ms', LOWER))
+    return results
+
+
+def run_suite(sizes, budget, draw=True):
+    results = []
+    for kind in LATTICES:
+        for cells in sizes:
+            results += bench_construction(kind, cells)
+            results += bench_memory(kind, cells)
+            results += bench_steps(kind, cells, steps, budget)
+            if draw:
+                results += bench_draw(kind, cells, budget)
+        cells = sizes[len(sizes) // 2]
+        for substeps in (1, 5, 20):
+            results += bench_steps(kind, cells, substeps, budget)
+        for iterations in (5, 20):
+            results += bench_iterations(kind, cells, iterations, budget)
+        results += bench_broadphase(kind, cells, budget)
+        results += bench_telemetry(kind, cells, budget)
+        print('finished', kind, file=sys.stderr)
+    results += bench_adaptive(budget)
+    results += bench_batch(budget)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'pymunk': pymunk.version,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'fps': fps,
+            'steps': steps,
+        },
+        'results': results,
+    }
+
+
+def result_key(r):
+    return r['name'] + ' ' + json.dumps(r['params'], sort_keys=True)
+
+
+def compare(current, baseline, tolerance):
+    # Returns the list of regressions: results that got worse by more than
+    # `tolerance` (a fraction) relative to the baseline.
+    old = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for r in current['results']:
+        key = result_key(r)
+        if key not in old or old[key]['value'] == 0:
+            continue
+        ratio = r['value'] / old[key]['value']
+        worse = ratio < 1 - tolerance if r['better'] == HIGHER else ratio > 1 + tolerance
+        print('%-8s %-90s %12.4g -> %12.4g %s (x%.2f)' % ('REGRESS' if worse else 'ok', key, old[key]['value'],
+                                                         r['value'], r['unit'], ratio))
+        if worse:
+            regressions.append(r)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark lattice construction, stepping and drawing.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256, 1024], help='cell counts')
+    parser.add_argument('--budget', type=float, default=0.5, help='seconds spent on each timing')
+    parser.add_argument('--no-draw', action='store_true', help='skip the pygame drawing benchmarks')
+    parser.add_argument('--out', help='write results as JSON to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='compare against a saved results file')
+    parser.add_argument('--tolerance', type=float, default=0.15, help='allowed relative slowdown for --compare')
+    parser.add_argument('--startup', action='store_true',
+                        help='only check that the physics modules import without pygame and within the budgets')
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET,
+                        help='ms allowed per cold import for --startup')
+    parser.add_argument('--worker-budget', nargs=2, action='append', default=[], metavar=('METHOD', 'MS'),
+                        help='ms allowed to start a pool worker that imports sweep with this start method, for '
+                             '--startup (default %s)' % ', '.join('%s %d' % item for item in WORKER_BUDGETS.items()))
+    args = parser.parse_args()
+
+    if args.startup:
+        results = bench_startup()
+        for r in results:
+            print('%-15s %-55s %7.1f ms' % (r['name'], json.dumps(r['params'], sort_keys=True), r['value']))
+        budgets = dict(WORKER_BUDGETS, **{method: float(ms) for method, ms in args.worker_budget})
+        failures = check_startup(results, args.import_budget, budgets)
+        for failure in failures:
+            print('OVER BUDGET', failure)
+        sys.exit(1 if failures else 0)
+
+    current = run_suite(args.sizes, args.budget, draw=not args.no_draw)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=1)
+    else:
+        json.dump(current, sys.stdout, indent=1)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(len(regressions), 'regression(s) beyond %d%%' % (args.tolerance * 100))
+            sys.exit(1)
@@ -0,0 +1,128 @@
+import json
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pygame
+
+from lattice import fps, steps, size
+
+FORMATS = ('png', 'raw')
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def encode_png(pixels, width, height, level=1):
+    # rgb24 bytes -> PNG bytes. Done with zlib rather than pygame.image.save
+    # because zlib releases the GIL while compressing, so encoder threads
+    # really run alongside the simulation.
+    rows = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width * 3)
+    filtered = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+    filtered[:, 1:] = rows
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) +
+            _png_chunk(b'IDAT', zlib.compress(filtered.tobytes(), level)) + _png_chunk(b'IEND', b''))
+
+
+class FrameCapture:
+    # Renders every `every`th substep to an offscreen surface and hands a
+    # copy of the pixels to encoder threads through a bounded queue, so the
+    # simulation only pays for the draw and one buffer copy. `png` writes a
+    # numbered frame_000000.png sequence, `raw` appends rgb24 frames to one
+    # frames.rgb stream (see meta.json for the ffmpeg rawvideo parameters).
+    # A full queue makes the simulation wait rather than drop frames; those
+    # waits are counted in `stalls`.
+    def __init__(self, sim, path, every=steps, format='png', frame_size=size, draw=None, view=None,
+                 workers=2, queue_size=64):
+        if format not in FORMATS:
+            raise ValueError('unknown capture format %r, expected one of %s' % (format, ', '.join(FORMATS)))
+        self.sim = sim
+        self.path = path
+        self.every = every
+        self.format = format
+        self.frame_size = tuple(frame_size)
+        self.frames = 0
+        self.stalls = 0
+        self.surface = pygame.Surface(self.frame_size)
+        if draw is None:
+            from renderer import LatticeRenderer
+            renderer = LatticeRenderer(self.surface, sim)
+            if view is None:
+                renderer.fit()
+            else:
+                renderer.set_view(*view)
+            draw = lambda surface: renderer.draw(update_display=False)
+        self.draw = draw
+
+        os.makedirs(path, exist_ok=True)
+        self.meta = {
+            'format': format,
+            'width': self.frame_size[0],
+            'height': self.frame_size[1],
+            'pixel_format': 'rgb24',
+            'every': every,
+            'frame_rate': fps * steps / every,
+            'frames': 0,
+        }
+        self._write_meta()
+
+        self.stream = open(os.path.join(path, 'frames.rgb'), 'wb') if format == 'raw' else None
+        # the raw stream has to be written in order, so it gets one thread
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writers = [threading.Thread(target=self._write_loop, daemon=True)
+                        for i in range(1 if format == 'raw' else workers)]
+        for writer in self.writers:
+            writer.start()
+        sim.observers.append(self)
+
+    def _write_meta(self):
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def _write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            index, pixels = item
+            if self.stream is not None:
+                self.stream.write(pixels)
+            else:
+                with open(os.path.join(self.path, 'frame_%06d.png' % index), 'wb') as f:
+                    f.write(encode_png(pixels, *self.frame_size))
+
+    def before_step(self, sim):
+        pass
+
+    def after_step(self, sim):
+        if sim.substep % self.every == 0:
+            self.capture()
+
+    def capture(self):
+        self.draw(self.surface)
+        item = (self.frames, pygame.image.tostring(self.surface, 'RGB'))
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.stalls += 1
+            self.queue.put(item)
+        self.frames += 1
+
+    def close(self):
+        if self in self.sim.observers:
+            self.sim.observers.remove(self)
+        for writer in self.writers:
+            self.queue.put(None)
+        for writer in self.writers:
+            writer.join()
+        if self.stream is not None:
+            self.stream.close()
+        self.meta['frames'] = self.frames
+        self._write_meta()
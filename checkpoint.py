@@ -0,0 +1,115 @@
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+
+
+def capture_state(sim):
+    bodies = [rect.body for rect in sim.rectangles]
+    constraints = [joint.joint for pair in sim.joints for joint in pair]
+    return {
+        'substep': np.array(sim.substep, dtype=np.int64),
+        'time': np.array(sim.time, dtype=np.float64),
+        'position': np.array([tuple(body.position) for body in bodies], dtype=np.float64).reshape(-1, 2),
+        'angle': np.array([body.angle for body in bodies], dtype=np.float64),
+        'velocity': np.array([tuple(body.velocity) for body in bodies], dtype=np.float64).reshape(-1, 2),
+        'angular_velocity': np.array([body.angular_velocity for body in bodies], dtype=np.float64),
+        # forces applied between steps (e.g. actuator key presses) that the
+        # next space.step has not consumed yet
+        'force': np.array([tuple(body.force) for body in bodies], dtype=np.float64).reshape(-1, 2),
+        'torque': np.array([body.torque for body in bodies], dtype=np.float64),
+        'force_flag': np.array([rect.forceFlag for rect in sim.rectangles], dtype=np.int64),
+        'counter': np.array([rect.counter for rect in sim.rectangles], dtype=np.int64),
+        'joint_max': np.array([c.max for c in constraints], dtype=np.float64),
+    }
+
+
+def restore_state(sim, state):
+    rectangles = sim.rectangles
+    constraints = [joint.joint for pair in sim.joints for joint in pair]
+    if len(rectangles) != len(state['angle']) or len(constraints) != len(state['joint_max']):
+        raise ValueError('checkpoint was taken from a lattice with a different topology')
+
+    for i, rect in enumerate(rectangles):
+        body = rect.body
+        body.position = tuple(state['position'][i])
+        body.angle = float(state['angle'][i])
+        body.velocity = tuple(state['velocity'][i])
+        body.angular_velocity = float(state['angular_velocity'][i])
+        body.force = tuple(state['force'][i])
+        body.torque = float(state['torque'][i])
+        rect.forceFlag = int(state['force_flag'][i])
+        rect.counter = int(state['counter'][i])
+    for c, value in zip(constraints, state['joint_max'].tolist()):
+        c.max = value
+    sim.hinge_changes += 1
+    sim.substep = int(state['substep'])
+    sim.time = float(state['time'])
+
+
+class Checkpoint:
+    # The captured state plus a pickled copy of the whole Simulation taken at
+    # the same moment, so the checkpoint can be restored onto a live
+    # simulation or turned into a brand new one (in this or another process).
+    # Neither continues bit for bit like the original run: Chipmunk's
+    # warm-starting caches (contact and joint impulses from the last step)
+    # are not part of the pickle and pymunk can't set them, so the first
+    # steps after a restore solve from scratch and the poses drift apart
+    # by around 1e-3 px within a few hundred substeps, more in chaotic
+    # motion.
+    def __init__(self, state, blueprint):
+        self.state = state
+        self.blueprint = blueprint
+
+    @classmethod
+    def take(cls, sim):
+        return cls(capture_state(sim), pickle.dumps(sim, protocol=pickle.HIGHEST_PROTOCOL))
+
+    @property
+    def substep(self):
+        return int(self.state['substep'])
+
+    @property
+    def time(self):
+        return float(self.state['time'])
+
+    def restore(self, sim):
+        restore_state(sim, self.state)
+        return sim
+
+    def instantiate(self):
+        # Forks built from the same blueprint start from identical solver
+        # state, so they only diverge where their continuations differ, but
+        # not from the state of the original, still running simulation.
+        return self.restore(pickle.loads(self.blueprint))
+
+    def save(self, path):
+        arrays = dict(self.state)
+        arrays['blueprint'] = np.frombuffer(self.blueprint, dtype=np.uint8)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            state = {name: data[name] for name in data.files if name != 'blueprint'}
+            blueprint = data['blueprint'].tobytes()
+        return cls(state, blueprint)
+
+
+def _run_fork(args):
+    checkpoint, continuation, i = args
+    return continuation(checkpoint.instantiate(), i)
+
+
+def fork(checkpoint, n, continuation, workers=None):
+    # Runs continuation(sim, i) for i in range(n), each on its own copy of
+    # the checkpointed simulation. continuation must be picklable (a module
+    # level function) when workers != 1.
+    jobs = [(checkpoint, continuation, i) for i in range(n)]
+    if workers == 1:
+        return [_run_fork(job) for job in jobs]
+    with multiprocessing.Pool(workers or min(n, os.cpu_count())) as pool:
+        return pool.map(_run_fork, jobs)
@@ -0,0 +1,192 @@
+import argparse
+import collections
+import importlib
+import os
+import time
+
+import numpy as np
+
+from lattice import *
+from equilibrium import solve
+from headless import run_headless
+from quiescence import QuiescenceMonitor
+from sweep import DESIGN_PARAMS, design_key
+
+# Per-entry arrays kept for an equilibrium, on top of the scalar metrics.
+POSE_FIELDS = ('position', 'angle')
+
+# Part of every store key. Bump it whenever a solver's stopping criterion
+# changes, so equilibria cached under the old one are solved again.
+SOLVER_VERSION = 2
+
+
+def flat_joints(sim):
+    return [joint for pair in sim.joints for joint in pair]
+
+
+def hinge_mask(sim):
+    # Locked hinges as a packed bit vector over the flattened sim.joints
+    # pairs (bit i set = joint i locked), as hex.
+    locked = np.array([joint.is_constrained() for joint in flat_joints(sim)], dtype=bool)
+    return np.packbits(locked, bitorder='little').tobytes().hex()
+
+
+def mask_bits(mask, n_joints):
+    bits = np.unpackbits(np.frombuffer(bytes.fromhex(mask), dtype=np.uint8), bitorder='little')
+    return bits[:n_joints].astype(bool)
+
+
+def bits_mask(bits):
+    return np.packbits(np.asarray(bits, dtype=bool), bitorder='little').tobytes().hex()
+
+
+def apply_mask(sim, mask):
+    joints = flat_joints(sim)
+    for joint, locked in zip(joints, mask_bits(mask, len(joints))):
+        if joint.is_constrained() != locked:
+            joint.switch_constrain()
+
+
+def settle(sim, max_time=30, **monitor_args):
+    # Run until the QuiescenceMonitor calls the lattice settled (or max_time
+    # simulated seconds pass) -> (pose arrays, metrics).
+    monitor = QuiescenceMonitor(sim, **monitor_args)
+    state, stats = run_headless(max_time, sim=sim, monitor=monitor)
+    monitor.close()
+    bodies = [rect.body for rect in sim.rectangles]
+    pose = {
+        'position': np.array([tuple(body.position) for body in bodies], dtype=float).reshape(-1, 2),
+        'angle': np.array([body.angle for body in bodies], dtype=float),
+    }
+    metrics = {
+        'settled': bool(monitor.settled),
+        'settled_at': monitor.settled_at if monitor.settled else float('nan'),
+        'drift': monitor.drift,
+        'simulated_time': stats['simulated_time'],
+        'wall_time': stats['wall_time'],
+        'left_actuator_x': sim.left_actuator.body.position.x if sim.left_actuator else float('nan'),
+        'right_actuator_x': sim.right_actuator.body.position.x if sim.right_actuator else float('nan'),
+    }
+    return pose, metrics
+
+
+def solver_by_name(name):
+    # 'module.function', as in ConfigurationStore.solver_name -> the solver
+    module, function = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module), function)
+
+
+def build_design(design, mask=None, actuation=None):
+    # Horizontal lattice for a sweep-style design dict, with its hinges set
+    # from `mask` and force_rect actuation from `actuation`.
+    sim = build_horizontal_lattice(**{k: design[k] for k in DESIGN_PARAMS if k in design})
+    if mask is not None:
+        apply_mask(sim, mask)
+    actuation = actuation or {}
+    sim.force_rect.forceFlag = actuation.get('force_flag', 0)
+    sim.force_rect.counter = actuation.get('counter', 0)
+    if 'program' in actuation:
+        from actuation import ActuationProgram
+        ActuationProgram.from_dict(actuation['program']).compile(sim).attach()
+    return sim
+
+
+class ConfigurationStore:
+    # Equilibrium pose and metrics per (design, hinge mask, actuation). The
+    # newest `capacity` entries stay in memory (least recently used goes
+    # first); with a path every entry is also written to path/<key>.npz, so
+    # a later run or another process finds it on disk. Each configuration is
+    # simulated at most once per store. The solver's name, max_time and
+    # SOLVER_VERSION are part of the key, so results from different solvers
+    # or stopping criteria never mix.
+    def __init__(self, path=None, capacity=1024, max_time=None, solver=None):
+        self.path = path
+        self.capacity = capacity
+        # None leaves the solver's own default
+        self.max_time = max_time
+        # solver(sim, max_time=...) -> (pose, metrics); equilibrium.solve
+        # unless replaced, e.g. by settle() for an undamped run
+        self.solver = solver or solve
+        self.solver_name = '%s.%s' % (self.solver.__module__, self.solver.__name__)
+        self.memory = collections.OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def key(self, design, mask, actuation=None):
+        settings = {'actuation': actuation or {}, 'solver': self.solver_name, 'max_time': self.max_time,
+                    'version': SOLVER_VERSION}
+        return '%s-%s-%s' % (design_key(design), mask, design_key(settings))
+
+    def _file(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return entry
+        if self.path is not None and os.path.exists(self._file(key)):
+            with np.load(self._file(key)) as data:
+                pose = {name: data[name] for name in POSE_FIELDS}
+                metrics = {name[7:]: data[name].item() for name in data.files if name.startswith('metric_')}
+            entry = (pose, metrics)
+            self._remember(key, entry)
+            self.disk_hits += 1
+            return entry
+        return None
+
+    def put(self, key, pose, metrics):
+        self._remember(key, (pose, metrics))
+        if self.path is not None:
+            arrays = dict(pose)
+            arrays.update({'metric_' + name: np.array(value) for name, value in metrics.items() if np.ndim(value) == 0})
+            tmp = self._file(key) + '.tmp.npz'
+            np.savez(tmp, **arrays)
+            os.replace(tmp, self._file(key))
+
+    def evaluate(self, design, mask, actuation=None):
+        # -> (pose, metrics) for the configuration, simulating it on a miss.
+        key = self.key(design, mask, actuation)
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        self.misses += 1
+        limits = {} if self.max_time is None else {'max_time': self.max_time}
+        pose, metrics = self.solver(build_design(design, mask, actuation), **limits)
+        self.put(key, pose, metrics)
+        return pose, metrics
+
+    def stats(self):
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'in_memory': len(self.memory)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Settle hinge configurations of the horizontal lattice, with caching.')
+    parser.add_argument('store', help='cache directory')
+    parser.add_argument('masks', nargs='*', help='hex hinge masks; default is the lattice as built')
+    parser.add_argument('--force-flag', type=int, default=0)
+    parser.add_argument('--counter', type=int, default=0)
+    parser.add_argument('--max-time', type=float, default=None,
+                        help='simulated seconds before giving up on settling; default 300, or 30 with --dynamic')
+    parser.add_argument('--dynamic', action='store_true',
+                        help='settle without damping until nothing moves (settle) instead of equilibrium.solve')
+    args = parser.parse_args()
+
+    store = ConfigurationStore(args.store, max_time=args.max_time, solver=settle if args.dynamic else None)
+    actuation = {'force_flag': args.force_flag, 'counter': args.counter}
+    for mask in args.masks or [hinge_mask(build_horizontal_lattice())]:
+        start = time.perf_counter()
+        pose, metrics = store.evaluate({}, mask, actuation)
+        settled = metrics['converged'] if 'converged' in metrics else metrics['settled']
+        print(mask, 'settled' if settled else 'not settled', 'lookup %.3fs' % (time.perf_counter() - start))
+    print(store.stats())
@@ -0,0 +1,87 @@
+import time
+
+import numpy as np
+
+from geometry import body_poses, pose_drift
+from lattice import fps, steps
+from stepping import JointErrorProbe
+
+
+def relax(sim, damping=0.3, dt=1/fps/steps, drift_tol=0.1, drift_floor=0.03, violation_tol=0.5, window=0.05,
+          settle_window=0.8, max_window=5.0, max_time=300, iterations=None):
+    # Quasi-static settle: step with velocity damping (space.damping is the
+    # fraction of velocity kept per second) until no point of any body has
+    # moved more than drift_tol px per simulated second (plus drift_floor px
+    # of solver jitter) over a window, and no SlideJoint is off its limits
+    # by more than violation_tol px. Instantaneous speed is no use as the
+    # test here: damping keeps velocities small while the lattice is still
+    # creeping a long way under gravity and the actuator force, so only the
+    # distance actually covered shows whether it has arrived. Damping too
+    # heavy makes that creep slower, not shorter, hence the light default.
+    # Windows start at `window` seconds, double after each quiet one and
+    # halve after each that isn't (up to max_window); the lattice has
+    # arrived once an unbroken run of quiet windows reaches one of
+    # settle_window seconds. A lattice already at rest is done after about
+    # 1.5 simulated seconds, a slow creep still fails the longer windows.
+    # The space's damping and iterations are put back afterwards.
+    # Returns diagnostics; the settled pose is left in sim.
+    space = sim.space
+    saved = space.damping, space.iterations
+    space.damping = damping
+    if iterations is not None:
+        space.iterations = iterations
+
+    bodies = [rect.body for rect in sim.rectangles if rect.body.body_type == rect.body.DYNAMIC]
+    half_diagonals = np.array([np.hypot(rect.width, rect.height) / 2 for rect in sim.rectangles
+                               if rect.body.body_type == rect.body.DYNAMIC])
+    probe = JointErrorProbe(sim)
+    history = []
+    converged = False
+    taken = 0
+    min_steps = max(int(round(window / dt)), 1)
+    settle_steps = max(int(round(settle_window / dt)), min_steps)
+    max_steps_per_window = max(int(round(max_window / dt)), settle_steps)
+    per_window = min_steps
+    max_steps = int(round(max_time / dt))
+    drift = violation = float('inf')
+    pose = body_poses(bodies)
+    start = time.perf_counter()
+    try:
+        while taken < max_steps:
+            n = min(per_window, max_steps - taken)
+            for i in range(n):
+                sim.step(dt)
+            taken += n
+            previous, pose = pose, body_poses(bodies)
+            drift = float(pose_drift(previous, pose, half_diagonals).max()) if bodies else 0.0
+            violation = probe.measure()[0]
+            history.append((taken * dt, drift, violation))
+            if drift < drift_tol * n * dt + drift_floor and violation < violation_tol:
+                if n >= settle_steps:
+                    converged = True
+                    break
+                per_window = min(per_window * 2, max_steps_per_window)
+            else:
+                per_window = max(per_window // 2, min_steps)
+    finally:
+        space.damping, space.iterations = saved
+    return {
+        'converged': converged,
+        'substeps': taken,
+        'simulated_time': taken * dt,
+        'wall_time': time.perf_counter() - start,
+        'drift': drift,
+        'violation': violation,
+        'history': np.array(history, dtype=float).reshape(-1, 3),
+    }
+
+
+def solve(sim, max_time=300, **relax_args):
+    # ConfigurationStore solver: relax() to equilibrium -> (pose, metrics).
+    diagnostics = relax(sim, max_time=max_time, **relax_args)
+    bodies = [rect.body for rect in sim.rectangles]
+    pose = {
+        'position': np.array([tuple(body.position) for body in bodies], dtype=float).reshape(-1, 2),
+        'angle': np.array([body.angle for body in bodies], dtype=float),
+    }
+    return pose, diagnostics
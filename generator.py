@@ -0,0 +1,129 @@
+import argparse
+import gc
+import time
+
+import numpy as np
+
+from lattice import *
+
+HORIZONTAL = 0
+VERTICAL = 1
+
+# rows:    every row is an independent horizontal_mode-style chain
+# grid:    horizontal and vertical neighbours are all linked
+# checker: grid, with the locked hinge of each pair alternating by (row + col) parity
+PATTERNS = ('rows', 'grid', 'checker')
+
+
+class LatticeTopology:
+    def __init__(self, rows, cols, pair_cells, pair_axis, pair_locked):
+        self.rows = rows
+        self.cols = cols
+        # (n_pairs, 2) cell indices, row-major cell numbering
+        self.pair_cells = pair_cells
+        # HORIZONTAL or VERTICAL per pair
+        self.pair_axis = pair_axis
+        # which hinge of the pair (0 or 1) starts locked
+        self.pair_locked = pair_locked
+
+    def cell_index(self, row, col):
+        return row * self.cols + col
+
+
+def grid_topology(rows, cols, pattern='grid'):
+    if pattern not in PATTERNS:
+        raise ValueError('unknown pattern %r, expected one of %s' % (pattern, ', '.join(PATTERNS)))
+
+    index = np.arange(rows * cols, dtype=np.int32).reshape(rows, cols)
+    horizontal = np.stack([index[:, :-1].ravel(), index[:, 1:].ravel()], axis=1)
+    pairs = [horizontal]
+    axes = [np.full(len(horizontal), HORIZONTAL, dtype=np.int8)]
+    if pattern != 'rows':
+        vertical = np.stack([index[:-1, :].ravel(), index[1:, :].ravel()], axis=1)
+        pairs.append(vertical)
+        axes.append(np.full(len(vertical), VERTICAL, dtype=np.int8))
+
+    pair_cells = np.concatenate(pairs).reshape(-1, 2)
+    pair_axis = np.concatenate(axes)
+    if pattern == 'checker':
+        row, col = np.divmod(pair_cells[:, 0], cols)
+        pair_locked = ((row + col) % 2).astype(np.int8)
+    else:
+        pair_locked = np.zeros(len(pair_cells), dtype=np.int8)
+    return LatticeTopology(rows, cols, pair_cells, pair_axis, pair_locked)
+
+
+def build_grid_lattice(rows, cols, cell_width=50, cell_height=50, pattern='grid', density=0.0001, joint_max=50,
+                       origin=(100, 100), sim=None):
+    # Everything is created detached and handed to the space in a single
+    # space.add call; the joint wiring comes from the topology arrays. The
+    # cyclic collector is paused since it would otherwise rescan the tens of
+    # thousands of new objects over and over.
+    if sim is None:
+        sim = Simulation()
+    topology = grid_topology(rows, cols, pattern)
+
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        rectangles, joints = _build_cells(sim, topology, cell_width, cell_height, density, joint_max, origin)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    sim.rectangles.extend(rectangles)
+    sim.joints.extend(joints)
+    sim.topology = topology
+    middle = (rows // 2) * cols
+    sim.left_actuator = rectangles[middle]
+    sim.right_actuator = rectangles[middle + cols - 1]
+    return sim
+
+
+def _build_cells(sim, topology, cell_width, cell_height, density, joint_max, origin):
+    rows, cols = topology.rows, topology.cols
+
+    w, h = cell_width, cell_height
+    ox, oy = origin
+    rectangles = [Rectangle(sim, (ox + c * w, oy + r * h), size = (w, h), density = density, add = False)
+                  for r in range(rows) for c in range(cols)]
+
+    # Anchor offsets on the first and second cell of a pair, for both
+    # hinges, mirroring horizontal_mode: the bottom hinge sits 5px below
+    # the shared corner and the "valley" hinge 5px above the opposite one.
+    anchors = {
+        HORIZONTAL: (((w / 2, h / 2 + 5), (-w / 2, h / 2 + 5), BOT_RIGHT),
+                     ((w / 2, -h / 2 - 5), (-w / 2, -h / 2 - 5), TOP_RIGHT)),
+        VERTICAL: (((-w / 2 - 5, h / 2), (-w / 2 - 5, -h / 2), BOT_LEFT),
+                   ((w / 2 + 5, h / 2), (w / 2 + 5, -h / 2), BOT_RIGHT)),
+    }
+
+    joints = []
+    constraints = []
+    for (i, j), axis, locked in zip(topology.pair_cells.tolist(), topology.pair_axis.tolist(), topology.pair_locked.tolist()):
+        left_rect = rectangles[i]
+        right_rect = rectangles[j]
+        pair = []
+        for k, (a, a2, corner) in enumerate(anchors[axis]):
+            joint = SlideJoint(sim, left_rect.body, right_rect.body, a = a, a2 = a2, min = 0,
+                               max = 0 if k == locked else joint_max, left_rect = left_rect, right_rect = right_rect,
+                               free_max = joint_max, corner = corner, add = False)
+            pair.append(joint)
+            constraints.append(joint.joint)
+        joints.append(tuple(pair))
+
+    sim.space.add(*[rect.body for rect in rectangles], *[rect.shape for rect in rectangles], *constraints)
+    return rectangles, joints
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time the construction of a 2D lattice sheet.')
+    parser.add_argument('rows', type=int)
+    parser.add_argument('cols', type=int)
+    parser.add_argument('--pattern', choices=PATTERNS, default='grid')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sim = build_grid_lattice(args.rows, args.cols, pattern=args.pattern)
+    elapsed = time.perf_counter() - start
+    print('%d cells, %d joints built in %.3fs' % (len(sim.rectangles), 2 * len(sim.joints), elapsed))
@@ -0,0 +1,75 @@
+import numpy as np
+
+# Local corner directions in the order of the BOT_LEFT..TOP_RIGHT constants
+# (y grows downwards, so "bottom" is +half height).
+CORNER_SIGNS = np.array([(-1, 1), (1, 1), (-1, -1), (1, -1)], dtype=float)
+
+
+def box_corners(positions, angles, local_corners, out=None):
+    # positions (n, 2), angles (n,), local_corners (n, 4, 2) -> (n, 4, 2)
+    if out is None:
+        out = np.empty(local_corners.shape)
+    cos = np.cos(angles)[:, None]
+    sin = np.sin(angles)[:, None]
+    lx = local_corners[:, :, 0]
+    ly = local_corners[:, :, 1]
+    out[:, :, 0] = positions[:, 0:1] + lx * cos - ly * sin
+    out[:, :, 1] = positions[:, 1:2] + lx * sin + ly * cos
+    return out
+
+
+def body_poses(bodies):
+    # -> (positions (n, 2), angles (n,)) read out of pymunk
+    positions = np.array([tuple(body.position) for body in bodies], dtype=float).reshape(-1, 2)
+    angles = np.array([body.angle for body in bodies], dtype=float)
+    return positions, angles
+
+
+def pose_drift(before, after, half_diagonals):
+    # furthest any point of each body moved between two body_poses():
+    # centre displacement + |rotation| * half diagonal
+    moved = after[0] - before[0]
+    return np.hypot(moved[:, 0], moved[:, 1]) + np.abs(after[1] - before[1]) * half_diagonals
+
+
+def local_box_corners(sizes):
+    half_extents = np.asarray(sizes, dtype=float).reshape(-1, 2) / 2
+    return half_extents[:, None, :] * CORNER_SIGNS[None, :, :]
+
+
+class LatticeGeometry:
+    def __init__(self, rectangles):
+        self.rectangles = list(rectangles)
+        self.bodies = [rect.body for rect in self.rectangles]
+        self.index = {id(rect): i for i, rect in enumerate(self.rectangles)}
+
+        n = len(self.rectangles)
+        self.local_corners = local_box_corners([(rect.width, rect.height) for rect in self.rectangles])
+        self.positions = np.zeros((n, 2))
+        self.angles = np.zeros(n)
+        self.corners = np.zeros((n, 4, 2))
+
+    def read_poses(self):
+        # Just the positions and angles, for callers that don't need corners.
+        if self.bodies:
+            self.positions[:] = [tuple(body.position) for body in self.bodies]
+            self.angles[:] = [body.angle for body in self.bodies]
+
+    def update(self):
+        # Pull the poses out of pymunk once, then every corner of every cell
+        # in one vectorized pass.
+        if not self.bodies:
+            return self.corners
+        self.read_poses()
+        return box_corners(self.positions, self.angles, self.local_corners, out=self.corners)
+
+    def blend(self, positions, angles, alpha):
+        # Corners of the pose `alpha` of the way from (positions, angles) to
+        # the current one, for drawing between physics substeps.
+        self.update()
+        self.positions += (1 - alpha) * (positions - self.positions)
+        self.angles += (1 - alpha) * (angles - self.angles)
+        return box_corners(self.positions, self.angles, self.local_corners, out=self.corners)
+
+    def corner(self, rect, corner):
+        return self.corners[self.index[id(rect)], corner - 1]
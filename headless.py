@@ -0,0 +1,126 @@
+import argparse
+import time
+
+from lattice import *
+from geometry import LatticeGeometry
+
+
+def lattice_state(sim):
+    cells = []
+    for rect in sim.rectangles:
+        body = rect.body
+        cells.append({
+            'position': tuple(body.position),
+            'angle': body.angle,
+            'velocity': tuple(body.velocity),
+            'angular_velocity': body.angular_velocity,
+        })
+    hinges = [(joint1.is_constrained(), joint2.is_constrained()) for joint1, joint2 in sim.joints]
+    corners = LatticeGeometry(sim.rectangles).update()
+    return {'cells': cells, 'joints': hinges, 'corners': corners.tolist()}
+
+
+def run_headless(duration=10, fps=fps, steps=steps, sim=None, callback=None, stepper=None, monitor=None):
+    # Same lattice and per-substep actuation as run_app.horizontal_mode, but
+    # stepped back to back without pygame, drawing or the frame clock. With
+    # a stepping.AdaptiveStepper the substeps are sized by the stepper and
+    # callback runs once per frame instead of once per substep. With a
+    # quiescence.QuiescenceMonitor the run stops after the first frame in
+    # which the lattice has settled, so duration becomes an upper bound.
+    if sim is None:
+        sim = build_horizontal_lattice()
+
+    dt = 1 / fps / steps
+    frames = int(round(duration * fps))
+    first_substep = sim.substep
+    first_time = sim.time
+
+    start = time.perf_counter()
+    for frame in range(frames):
+        if stepper is None:
+            for i in range(steps):
+                sim.step(dt)
+                if callback is not None:
+                    callback(sim)
+        else:
+            stepper.advance(1 / fps)
+            if callback is not None:
+                callback(sim)
+        if monitor is not None and monitor.settled:
+            break
+    wall_time = time.perf_counter() - start
+
+    total_steps = sim.substep - first_substep
+    simulated_time = sim.time - first_time
+    stats = {
+        'substeps': total_steps,
+        'dt': simulated_time / total_steps if total_steps else dt,
+        'simulated_time': simulated_time,
+        'wall_time': wall_time,
+        'substeps_per_sec': total_steps / wall_time if wall_time > 0 else float('inf'),
+        'realtime_factor': simulated_time / wall_time if wall_time > 0 else float('inf'),
+    }
+    if stepper is not None:
+        stats['adaptive'] = stepper.stats()
+    if monitor is not None:
+        stats['settled'] = monitor.settled
+        stats['settled_at'] = monitor.settled_at
+    return lattice_state(sim), stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the horizontal lattice without a display.')
+    parser.add_argument('duration', type=float, nargs='?', default=10, help='simulated seconds')
+    parser.add_argument('--fps', type=int, default=fps)
+    parser.add_argument('--steps', type=int, default=steps)
+    parser.add_argument('--record', metavar='DIR', help='stream the trajectory to DIR')
+    parser.add_argument('--every', type=int, default=steps, help='record every N substeps')
+    parser.add_argument('--scene', metavar='FILE', help='run a scene file (see scene.py) instead of horizontal_mode')
+    parser.add_argument('--program', metavar='FILE', help='apply an actuation program (JSON) from t=0')
+    parser.add_argument('--capture', metavar='DIR', help='render frames offscreen and write them to DIR')
+    parser.add_argument('--capture-every', type=int, default=steps, help='capture every N substeps')
+    parser.add_argument('--capture-format', choices=('png', 'raw'), default='png',
+                        help='numbered PNG files or one raw rgb24 stream')
+    parser.add_argument('--adaptive', action='store_true', help='size substeps by joint error and motion')
+    parser.add_argument('--until-settled', action='store_true',
+                        help='stop as soon as the lattice comes to rest; duration becomes the limit')
+    args = parser.parse_args()
+
+    if args.scene:
+        from scene import load_scene
+        sim = load_scene(args.scene)
+    else:
+        sim = build_horizontal_lattice()
+    recorder = None
+    if args.record:
+        from recorder import TrajectoryRecorder
+        recorder = TrajectoryRecorder(sim, args.record, every=args.every)
+
+    if args.program:
+        from actuation import ActuationProgram
+        ActuationProgram.load(args.program).compile(sim, 1 / args.fps / args.steps).attach()
+
+    capture = None
+    if args.capture:
+        from capture import FrameCapture
+        capture = FrameCapture(sim, args.capture, every=args.capture_every, format=args.capture_format)
+
+    stepper = None
+    if args.adaptive:
+        from stepping import AdaptiveStepper
+        stepper = AdaptiveStepper(sim)
+
+    monitor = None
+    if args.until_settled:
+        from quiescence import QuiescenceMonitor
+        monitor = QuiescenceMonitor(sim)
+
+    state, stats = run_headless(args.duration, args.fps, args.steps, sim=sim, stepper=stepper, monitor=monitor)
+    if recorder is not None:
+        recorder.close()
+    if capture is not None:
+        capture.close()
+        stats['captured_frames'] = capture.frames
+        stats['capture_stalls'] = capture.stalls
+    for key, value in stats.items():
+        print(key, value)
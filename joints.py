@@ -8,8 +8,8 @@ from pygame.locals import *
 
 import math
 
-space = pymunk.Space()
-b0 = space.static_body
+from lattice import Simulation
+from capture import FrameCapture
 
 size = w, h = 800, 800
 fps = 30
@@ -20,67 +20,67 @@ GRAY = (220, 220, 220)
 WHITE = (255, 255, 255)
 
 class PinJoint:
-    def __init__(self, b, b2, a=(0, 0), a2=(0, 0)):
+    def __init__(self, sim, b, b2, a=(0, 0), a2=(0, 0)):
         joint = pymunk.constraints.PinJoint(b, b2, a, a2)
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class PivotJoint:
-    def __init__(self, b, b2, a=(0, 0), a2=(0, 0), collide=True):
+    def __init__(self, sim, b, b2, a=(0, 0), a2=(0, 0), collide=True):
         joint = pymunk.constraints.PinJoint(b, b2, a, a2)
         joint.collide_bodies = collide
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class SlideJoint:
-    def __init__(self, b, b2, a=(0, 0), a2=(0, 0), min=0, max=0, collide=True):
+    def __init__(self, sim, b, b2, a=(0, 0), a2=(0, 0), min=0, max=0, collide=True):
         joint = pymunk.constraints.SlideJoint(b, b2, a, a2, min, max)
         joint.collide_bodies = collide
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class GrooveJoint:
-    def __init__(self, a, b, groove_a, groove_b, anchor_b):
+    def __init__(self, sim, a, b, groove_a, groove_b, anchor_b):
         joint = pymunk.constraints.GrooveJoint(
             a, b, groove_a, groove_b, anchor_b)
         joint.collide_bodies = False
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class DampedRotarySpring:
-    def __init__(self, b, b2, angle, stiffness, damping):
+    def __init__(self, sim, b, b2, angle, stiffness, damping):
         joint = pymunk.constraints.DampedRotarySpring(
             b, b2, angle, stiffness, damping)
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class RotaryLimitJoint:
-    def __init__(self, b, b2, min, max, collide=True):
+    def __init__(self, sim, b, b2, min, max, collide=True):
         joint = pymunk.constraints.RotaryLimitJoint(b, b2, min, max)
         joint.collide_bodies = collide
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class RatchetJoint:
-    def __init__(self, b, b2, phase, ratchet):
+    def __init__(self, sim, b, b2, phase, ratchet):
         joint = pymunk.constraints.GearJoint(b, b2, phase, ratchet)
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class SimpleMotor:
-    def __init__(self, b, b2, rate):
+    def __init__(self, sim, b, b2, rate):
         joint = pymunk.constraints.SimpleMotor(b, b2, rate)
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class GearJoint:
-    def __init__(self, b, b2, phase, ratio):
+    def __init__(self, sim, b, b2, phase, ratio):
         joint = pymunk.constraints.GearJoint(b, b2, phase, ratio)
-        space.add(joint)
+        sim.space.add(joint)
 
 
 class Segment:
-    def __init__(self, p0, v, radius=10):
+    def __init__(self, sim, p0, v, radius=10):
         self.body = pymunk.Body()
         self.body.position = p0
         shape = pymunk.Segment(self.body, (0, 0), v, radius)
@@ -88,35 +88,35 @@ class Segment:
         shape.elasticity = 0.5
         shape.filter = pymunk.ShapeFilter(group=1)
         shape.color = (0, 255, 0, 0)
-        space.add(self.body, shape)
+        sim.space.add(self.body, shape)
 
 
 class Circle:
-    def __init__(self, pos, radius=20):
+    def __init__(self, sim, pos, radius=20):
         self.body = pymunk.Body()
         self.body.position = pos
         shape = pymunk.Circle(self.body, radius)
         shape.density = 0.01
         shape.friction = 0.5
         shape.elasticity = 1
-        space.add(self.body, shape)
+        sim.space.add(self.body, shape)
 
 
 class Box:
-    def __init__(self, p0=(0, 0), p1=(w, h), d=4):
+    def __init__(self, sim, p0=(0, 0), p1=(w, h), d=4):
         x0, y0 = p0
         x1, y1 = p1
         pts = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
         for i in range(4):
             segment = pymunk.Segment(
-                space.static_body, pts[i], pts[(i+1) % 4], d)
+                sim.static_body, pts[i], pts[(i+1) % 4], d)
             segment.elasticity = 1
             segment.friction = 0.5
-            space.add(segment)
+            sim.space.add(segment)
 
 
 class Poly:
-    def __init__(self, pos, vertices):
+    def __init__(self, sim, pos, vertices):
         self.body = pymunk.Body(1, 100)
         self.body.position = pos
 
@@ -125,11 +125,11 @@ class Poly:
         shape.density = 0.01
         shape.elasticity = 0.5
         shape.color = (255, 0, 0, 0)
-        space.add(self.body, shape)
+        sim.space.add(self.body, shape)
 
 
 class Rectangle:
-    def __init__(self, pos, size=(100, 50), body_static = False):
+    def __init__(self, sim, pos, size=(100, 50), body_static = False):
         if body_static:
             self.body = pymunk.Body(body_type = pymunk.Body.STATIC)
         else:
@@ -140,17 +140,19 @@ class Rectangle:
         shape.density = 0.1
         shape.elasticity = 1
         shape.friction = 1
-        space.add(self.body, shape)
+        sim.space.add(self.body, shape)
 
 
 class App:
-    def __init__(self):
+    def __init__(self, sim):
         pygame.init()
         self.clock = pygame.time.Clock()
         self.screen = pygame.display.set_mode(size)
         self.draw_options = DrawOptions(self.screen)
         self.running = True
         self.images = []
+        self.sim = sim
+        self.capture = None
 
     def run(self):
         while self.running:
@@ -161,8 +163,10 @@ class App:
             self.clock.tick(fps)
 
             for i in range(steps):
-                space.step(1/fps/steps)
+                self.sim.step(1/fps/steps)
 
+        if self.capture is not None:
+            self.capture.close()
         pygame.quit()
 
     def do_event(self, event):
@@ -175,38 +179,55 @@ class App:
                 self.running = False
 
             elif event.key == K_p:
-                pygame.image.save(self.screen, 'joint.png')
+                self.toggle_capture()
             
             elif event.key == K_RIGHT:
                 orig_x, orig_y = self.rect.body.position
                 self.rect.body.position = (orig_x + 10, orig_y)
-                space.reindex_shapes_for_body(self.rect.body)
+                self.sim.space.reindex_shapes_for_body(self.rect.body)
             
             elif event.key == K_LEFT:
                 orig_x, orig_y = self.rect.body.position
                 if orig_x - 10 > 250:
                     self.rect.body.position = (orig_x - 10, orig_y)
-                    space.reindex_shapes_for_body(self.rect.body)
+                    self.sim.space.reindex_shapes_for_body(self.rect.body)
 
 
+    def toggle_capture(self):
+        # this scene isn't a lattice, so frames go through debug_draw
+        if self.capture is None:
+            self.capture = FrameCapture(self.sim, 'joint_frames', every=steps, frame_size=size, draw=self.draw_frame)
+            print('capturing frames to joint_frames')
+        else:
+            self.capture.close()
+            print('captured', self.capture.frames, 'frames')
+            self.capture = None
+
+    def draw_frame(self, surface):
+        surface.fill(GRAY)
+        self.sim.space.debug_draw(DrawOptions(surface))
+
     def draw(self):
         self.screen.fill(GRAY)
-        space.debug_draw(self.draw_options)
+        self.sim.space.debug_draw(self.draw_options)
         pygame.display.update()
 
 
 if __name__ == '__main__':
-    Box()
+    sim = Simulation(gravity=(0, 0))
+    b0 = sim.static_body
+
+    Box(sim)
     p1 = Vec2d(300, 400)
-    r1 = Rectangle(p1)
+    r1 = Rectangle(sim, p1)
     v1 = (-50, 30)
-    SlideJoint(r1.body, b0, v1, p1 + v1)
+    SlideJoint(sim, r1.body, b0, v1, p1 + v1)
     # SimpleMotor(r1.body, b0, -5)
     p2 = Vec2d(400, 400)
-    r2 = Rectangle(p2)
+    r2 = Rectangle(sim, p2)
     v2 = (50, 30)
     # SimpleMotor(r2.body, b0, 5)
-    SlideJoint(r1.body, r2.body, v2, v1)
+    SlideJoint(sim, r1.body, r2.body, v2, v1)
     # PivotJoint(r1.body, r2.body, v2, v1)
     # PivotJoint(r1.body, r2.body, (50,-30), (-50, -30))
     # SimpleMotor(r2.body, r1.body, 5)
@@ -223,15 +244,15 @@ if __name__ == '__main__':
     # PivotJoint(arm.body, arm2.body, v, (0, 0))
     # DampedRotarySpring(arm.body, arm2.body, 0, 10000000, 10000)
 
-    r = Rectangle( (500, 450), body_static = True)
+    r = Rectangle(sim, (500, 450), body_static = True)
 
     # PivotJoint(r2.body, r.body, v2, Vec2d(-50, -25), True)
-    SlideJoint(r2.body, r.body, v2, Vec2d(-50, -25))
+    SlideJoint(sim, r2.body, r.body, v2, Vec2d(-50, -25))
     # joint = pymunk.DampedSpring(a=r1.body, b=r2.body, 
     #         anchor_a=(50,-30), anchor_b=(-50,-30), 
     #         rest_length=0, stiffness=800, damping=10)
     # space.add(joint)
     
-    a = App()
+    a = App(sim)
     a.rect = r
     a.run()
@@ -0,0 +1,269 @@
+import pymunk
+from pymunk.vec2d import Vec2d
+import pymunk.constraints
+
+size = screen_width, screen_height = 1500, 800
+fps = 30
+steps = 10
+
+BOT_LEFT = 1
+BOT_RIGHT = 2
+TOP_LEFT = 3
+TOP_RIGHT = 4
+
+
+class Simulation:
+    def __init__(self, gravity=(0, 10)):
+        self.space = pymunk.Space()
+        self.space.gravity = gravity
+        self.static_body = self.space.static_body
+        self.rectangles = []
+        self.joints = []
+        self.blocks = []
+        self.left_actuator = None
+        self.right_actuator = None
+        self.force_rect = None
+        self.topology = None
+        self.substep = 0
+        self.time = 0.0
+        # dt of the latest (or upcoming, inside before_step) substep
+        self.dt = 1/fps/steps
+        # bumped whenever a hinge is locked/unlocked, so steppers can notice
+        # without rescanning every joint
+        self.hinge_changes = 0
+        # objects with before_step(sim) / after_step(sim), e.g. recorders
+        self.observers = []
+
+    def __getstate__(self):
+        # observers hold threads and open files, so they don't travel with
+        # pickled copies of the simulation
+        state = self.__dict__.copy()
+        state['observers'] = []
+        return state
+
+    def actuators(self):
+        return [rect for rect in (self.left_actuator, self.right_actuator, self.force_rect) if rect is not None]
+
+    def step(self, dt=1/fps/steps):
+        self.dt = dt
+        if self.force_rect is not None:
+            apply_actuation(self.force_rect)
+        for observer in self.observers:
+            observer.before_step(self)
+        self.space.step(dt)
+        self.substep += 1
+        self.time += dt
+        for observer in self.observers:
+            observer.after_step(self)
+
+
+class PinJoint:
+    def __init__(self, sim, b, b2, a=(0, 0), a2=(0, 0)):
+        joint = pymunk.constraints.PinJoint(b, b2, a, a2)
+        sim.space.add(joint)
+
+
+class SlideJoint:
+    def __init__(self, sim, b, b2, a=(0, 0), a2=(0, 0), min=0, max=0, collide=True, left_rect = None, right_rect = None, free_max = 50, corner = BOT_RIGHT, add = True):
+        self.joint = pymunk.constraints.SlideJoint(b, b2, a, a2, min, max)
+        self.sim = sim
+        self.left_rect = left_rect
+        self.right_rect = right_rect
+        self.free_max = free_max
+        # corner of left_rect where the hinge marker is drawn
+        self.corner = corner
+        if not collide:
+            self.joint.collide_bodies = collide
+        self.max_force = 100000
+        if add:
+            sim.space.add(self.joint)
+
+    def is_constrained(self):
+        return self.joint.max == 0
+    
+    def switch_constrain(self):
+        if self.is_constrained():
+            self.joint._set_max(self.free_max)
+        else:
+            self.joint._set_max(0)
+        self.sim.hinge_changes += 1
+
+
+
+class GrooveJoint:
+    def __init__(self, sim, a, b, groove_a, groove_b, anchor_b):
+        joint = pymunk.constraints.GrooveJoint(
+            a, b, groove_a, groove_b, anchor_b)
+        joint.collide_bodies = False
+        sim.space.add(joint)
+
+
+class DampedRotarySpring:
+    def __init__(self, sim, b, b2, angle, stiffness, damping):
+        joint = pymunk.constraints.DampedRotarySpring(
+            b, b2, angle, stiffness, damping)
+        sim.space.add(joint)
+
+
+class RotaryLimitJoint:
+    def __init__(self, sim, b, b2, min, max, collide=True):
+        joint = pymunk.constraints.RotaryLimitJoint(b, b2, min, max)
+        joint.collide_bodies = collide
+        sim.space.add(joint)
+
+
+class RatchetJoint:
+    def __init__(self, sim, b, b2, phase, ratchet):
+        joint = pymunk.constraints.GearJoint(b, b2, phase, ratchet)
+        sim.space.add(joint)
+
+
+class SimpleMotor:
+    def __init__(self, sim, b, b2, rate):
+        joint = pymunk.constraints.SimpleMotor(b, b2, rate)
+        sim.space.add(joint)
+
+
+class GearJoint:
+    def __init__(self, sim, b, b2, phase, ratio):
+        joint = pymunk.constraints.GearJoint(b, b2, phase, ratio)
+        sim.space.add(joint)
+
+
+class Segment:
+    def __init__(self, sim, p0, v, radius=10):
+        self.body = pymunk.Body()
+        self.body.position = p0
+        shape = pymunk.Segment(self.body, (0, 0), v, radius)
+        shape.density = 0.1
+        shape.elasticity = 0
+        shape.filter = pymunk.ShapeFilter(group=1)
+        shape.color = (0, 255, 0, 0)
+        sim.space.add(self.body, shape)
+
+
+class Circle:
+    def __init__(self, sim, pos, radius=20):
+        self.body = pymunk.Body()
+        self.body.position = pos
+        shape = pymunk.Circle(self.body, radius)
+        shape.density = 0.01
+        shape.friction = 0.5
+        shape.elasticity = 1
+        sim.space.add(self.body, shape)
+
+
+class Box:
+    def __init__(self, sim, p0=(0, 0), p1=(screen_width, screen_height), d=4):
+        x0, y0 = p0
+        x1, y1 = p1
+        pts = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+        for i in range(4):
+            segment = pymunk.Segment(
+                sim.static_body, pts[i], pts[(i+1) % 4], d)
+            segment.elasticity = 1
+            segment.friction = 0.5
+            sim.space.add(segment)
+
+
+class Poly:
+    def __init__(self, sim, pos, vertices):
+        self.body = pymunk.Body(1, 100)
+        self.body.position = pos
+
+        shape = pymunk.Poly(self.body, vertices)
+        shape.filter = pymunk.ShapeFilter(group=1)
+        shape.density = 0.01
+        shape.elasticity = 0.5
+        shape.color = (255, 0, 0, 0)
+        sim.space.add(self.body, shape)
+
+
+class Rectangle:
+    def __init__(self, sim, pos, size=(100, 50), density = 0.0001, body_static = False, add = True):
+        if body_static:
+            self.body = pymunk.Body(body_type = pymunk.Body.STATIC)
+        else:
+            self.body = pymunk.Body()
+        self.body.position = pos
+        self.width = size[0]
+        self.height = size[1]
+        self.forceFlag = 0
+        self.counter = 0
+        shape = pymunk.Poly.create_box(self.body, size)
+        shape.density = density
+        shape.elasticity = 0
+        shape.friction = 1
+        self.shape = shape
+        if add:
+            sim.space.add(self.body, shape)
+
+
+def apply_actuation(rect):
+    if rect.forceFlag == 1:
+        rect.body.force += ( (0, rect.counter * -50) )
+    if rect.forceFlag == 2:
+        rect.body.force += ( (0,  (10 - rect.counter) * 50) )
+
+
+def build_horizontal_lattice(sim=None, rectangle_widths=None, rectangle_height=50, actuator_width=500, density=0.0001, joint_max=50):
+    if sim is None:
+        sim = Simulation()
+
+    rectangles = sim.rectangles
+    joints = sim.joints
+
+    # rectangle_widths = [50, 200, 50, 200]
+    # rectangle_widths = [200, 50, 200, 50]
+    if rectangle_widths is None:
+        rectangle_widths = [50 for i in range(14)]
+    rectangle_widths = list(rectangle_widths)
+    rectangle_widths.append(actuator_width)
+    rectangle_widths.insert(0, actuator_width)
+
+    starting_x = 10
+    starting_y = 400
+
+    start_rect_center = Vec2d(starting_x, starting_y)
+    left_actuator = Rectangle(sim, start_rect_center, size = (rectangle_widths[0], rectangle_height), density = density)
+
+    up_block = Rectangle(sim, left_actuator.body.position + (50, -(rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
+    down_block = Rectangle(sim, left_actuator.body.position + (50, (rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
+
+    sim.blocks += [up_block, down_block]
+    rectangles.append(left_actuator)
+
+    for i in range(len(rectangle_widths) - 1):
+        left_rect = rectangles[-1]
+        left_rect_center = left_rect.body.position
+        left_rect_right_bot = (left_rect.width // 2, left_rect.height // 2 + 5)
+
+        right_rect_center = left_rect_center + (left_rect.width // 2 + rectangle_widths[i + 1] // 2, 0)
+        right_rect = Rectangle(sim, right_rect_center, size = (rectangle_widths[i + 1], rectangle_height), density = density)
+        right_rect_bot_left = Vec2d(-right_rect.width // 2, right_rect.height // 2 + 5)
+
+        valley = Vec2d(0, - rectangle_height - 10)
+        joint1 = SlideJoint(sim, left_rect.body, right_rect.body, a = left_rect_right_bot, a2 = right_rect_bot_left, left_rect = left_rect, right_rect = right_rect, free_max = joint_max, corner = BOT_RIGHT)
+        joint2 = SlideJoint(sim, left_rect.body, right_rect.body, a = left_rect_right_bot + valley, a2 = right_rect_bot_left + valley, min = 0, max = joint_max, left_rect = left_rect, right_rect = right_rect, free_max = joint_max, corner = TOP_RIGHT)
+        joints.append( (joint1, joint2) )
+        rectangles.append(right_rect)
+
+    right_actuator = rectangles[-1]
+
+    up_block = Rectangle(sim, right_actuator.body.position + (50, -(rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
+    down_block = Rectangle(sim, right_actuator.body.position + (50, (rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
+    sim.blocks += [up_block, down_block]
+
+    (right_actuator_left_joint, right_actuator_right_joint) =  joints[-1]
+    (left_actuator_left_joint, left_actuator_right_joint) = joints[0]
+
+    left_actuator_left_joint.switch_constrain()
+    left_actuator_right_joint.switch_constrain()
+
+    right_actuator_left_joint.switch_constrain()
+    right_actuator_right_joint.switch_constrain()
+
+    sim.left_actuator = left_actuator
+    sim.right_actuator = right_actuator
+    sim.force_rect = rectangles[-2]
+    return sim
@@ -0,0 +1,382 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from configurations import ConfigurationStore, bits_mask, build_design, flat_joints, hinge_mask, mask_bits, settle
+
+# one ConfigurationStore per worker process and store settings, so its
+# in-memory LRU survives from one candidate to the next
+_stores = {}
+
+
+def _store(path, quasi_static, max_time):
+    key = (path, quasi_static, max_time)
+    if key not in _stores:
+        solver = None if quasi_static else settle
+        _stores[key] = ConfigurationStore(path, max_time=max_time, solver=solver)
+    return _stores[key]
+
+
+def evaluate_candidate(job):
+    # Worker: equilibrium cell positions of one (design, mask, actuation).
+    path, quasi_static, max_time, key, design, mask, actuation = job
+    pose, metrics = _store(path, quasi_static, max_time).evaluate(design, mask, actuation)
+    settled = metrics['converged'] if 'converged' in metrics else metrics['settled']
+    return key, pose['position'], bool(settled)
+
+
+def shape_error(position, target):
+    # RMS distance in px between the cell centres and the target ones
+    position = np.asarray(position, dtype=float).reshape(-1, 2)
+    target = np.asarray(target, dtype=float).reshape(-1, 2)
+    if position.shape != target.shape:
+        raise ValueError('target has %d cells, the lattice has %d' % (len(target), len(position)))
+    return float(np.sqrt(((position - target) ** 2).sum(axis=1).mean()))
+
+
+def write_target(sim, path):
+    # The current cell centres of a simulation as an optimise.py target.
+    _write_json(path, {'position': [tuple(rect.body.position) for rect in sim.rectangles]})
+
+
+def load_target(path, quasi_static=False, max_time=30):
+    # Target cell centres from a write_target file, or the equilibrium of a
+    # configuration file such as best.json.
+    with open(path) as f:
+        data = json.load(f)
+    if 'position' in data:
+        return np.array(data['position'], dtype=float)
+    if 'mask' in data:
+        return target_for_mask(data['mask'], data.get('design'), data.get('actuation'), quasi_static, max_time)
+    raise ValueError("%s has neither 'position' nor a configuration 'mask'" % path)
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class HingeOptimiser:
+    # Genetic search for the hinges to lock (and optionally the cell widths)
+    # whose equilibrium comes closest to a target shape. An individual is
+    # {'bits': locked flags of the searchable hinges, 'widths': cell widths
+    # or None}; the actuator hinges stay as built. Fitness is shape_error of
+    # the equilibrium pose, lower is better.
+    #
+    # Equilibria come from a ConfigurationStore in out_dir/store, shared by
+    # every worker process through its files, and fitness is memoised per
+    # store key, so no configuration is simulated twice across generations,
+    # workers or resumed runs. The population is checkpointed to
+    # out_dir/state.json after every generation, and an existing checkpoint
+    # is resumed when it was started with the same settings.
+    #
+    # Equilibria are found by a dynamic settle unless quasi_static selects
+    # equilibrium.relax. Before evolving, run() checks that the random first
+    # generation scores at least min_spread px on median: if random hinges
+    # already land on the target, the settle is not separating
+    # configurations (too short, or no actuation) and the search would
+    # only be chasing noise.
+    def __init__(self, target, out_dir, design=None, actuation=None, population=32, widths=None,
+                 elite=2, tournament=3, crossover=0.9, mutation=None, seed=0, workers=None,
+                 quasi_static=False, max_time=30, min_spread=1.0):
+        self.target = np.asarray(target, dtype=float).reshape(-1, 2)
+        self.out_dir = out_dir
+        self.design = dict(design or {})
+        self.actuation = dict(actuation or {})
+        self.population_size = population
+        # (lowest, highest) cell width, or None to keep the design's widths
+        self.widths = tuple(widths) if widths is not None else None
+        self.elite = elite
+        self.tournament = tournament
+        self.crossover = crossover
+        self.workers = workers or os.cpu_count()
+        self.quasi_static = quasi_static
+        self.max_time = max_time
+        self.min_spread = min_spread
+        self.store_path = os.path.join(out_dir, 'store')
+        os.makedirs(self.store_path, exist_ok=True)
+        self.store = _store(self.store_path, quasi_static, max_time)
+
+        template = build_design(self.design)
+        joints = flat_joints(template)
+        fixed = set()
+        for pair in (template.joints[0], template.joints[-1]):
+            fixed.update(joints.index(joint) for joint in pair)
+        self.n_joints = len(joints)
+        self.searchable = [i for i in range(self.n_joints) if i not in fixed]
+        self.base_bits = mask_bits(hinge_mask(template), self.n_joints)
+        self.n_cells = len(template.rectangles) - 2
+        n_genes = len(self.searchable) + (self.n_cells if self.widths else 0)
+        self.mutation = mutation if mutation is not None else 1 / n_genes
+
+        self.settings = {
+            'target': self.target.tolist(), 'design': self.design, 'actuation': self.actuation,
+            'widths': list(self.widths) if self.widths else None, 'quasi_static': quasi_static,
+            'max_time': max_time,
+        }
+        self.rng = np.random.default_rng(seed)
+        self.generation = 0
+        self.population = []
+        self.scores = []
+        # store key -> {'fitness', 'settled'}
+        self.cache = {}
+        self.history = []
+        self.evaluations = 0
+        self.cache_hits = 0
+        self.load()
+
+    # individuals
+
+    def random_individual(self):
+        individual = {'bits': self.rng.random(len(self.searchable)) < 0.5, 'widths': None}
+        if self.widths:
+            individual['widths'] = self.rng.integers(self.widths[0], self.widths[1] + 1, self.n_cells)
+        return self._normalise(individual)
+
+    def _normalise(self, individual):
+        bits = [bool(b) for b in individual['bits']]
+        widths = individual.get('widths')
+        if widths is not None:
+            widths = [int(w) for w in np.clip(np.rint(widths), self.widths[0], self.widths[1])]
+        return {'bits': bits, 'widths': widths}
+
+    def decode(self, individual):
+        # -> (design, mask) to build or look up
+        bits = self.base_bits.copy()
+        bits[self.searchable] = individual['bits']
+        design = dict(self.design)
+        if individual['widths'] is not None:
+            design['rectangle_widths'] = individual['widths']
+        return design, bits_mask(bits)
+
+    def key(self, individual):
+        design, mask = self.decode(individual)
+        return self.store.key(design, mask, self.actuation)
+
+    # evaluation
+
+    def evaluate(self, individuals, pool=None):
+        # Fitness of every individual. Each distinct configuration is looked
+        # up once: in the memo, then on disk, then simulated in the pool.
+        keys = [self.key(individual) for individual in individuals]
+        jobs = {}
+        for key, individual in zip(keys, individuals):
+            if key in self.cache or key in jobs:
+                self.cache_hits += 1
+                continue
+            design, mask = self.decode(individual)
+            entry = self.store.get(key)
+            if entry is not None:
+                pose, metrics = entry
+                settled = metrics['converged'] if 'converged' in metrics else metrics['settled']
+                self._remember(key, pose['position'], settled)
+                self.cache_hits += 1
+                continue
+            jobs[key] = (self.store_path, self.quasi_static, self.max_time, key, design, mask, self.actuation)
+
+        if jobs:
+            if pool is None:
+                results = map(evaluate_candidate, jobs.values())
+            else:
+                results = pool.imap_unordered(evaluate_candidate, list(jobs.values()))
+            for key, position, settled in results:
+                self._remember(key, position, settled)
+                self.evaluations += 1
+        return [self.cache[key]['fitness'] for key in keys]
+
+    def _remember(self, key, position, settled):
+        self.cache[key] = {'fitness': shape_error(position, self.target), 'settled': bool(settled)}
+
+    # genetic operators
+
+    def _pick(self):
+        contenders = self.rng.integers(0, len(self.population), self.tournament)
+        return self.population[min(contenders, key=lambda i: self.scores[i])]
+
+    def _offspring(self):
+        first, second = self._pick(), self._pick()
+        bits = np.array(first['bits'])
+        widths = None if first['widths'] is None else np.array(first['widths'], dtype=float)
+        if self.rng.random() < self.crossover:
+            take = self.rng.random(len(bits)) < 0.5
+            bits[take] = np.array(second['bits'])[take]
+            if widths is not None:
+                mix = self.rng.random(len(widths))
+                widths = mix * widths + (1 - mix) * np.array(second['widths'], dtype=float)
+        bits ^= self.rng.random(len(bits)) < self.mutation
+        if widths is not None:
+            jitter = self.rng.random(len(widths)) < self.mutation
+            widths += jitter * self.rng.normal(0, (self.widths[1] - self.widths[0]) / 10, len(widths))
+        return self._normalise({'bits': bits, 'widths': widths})
+
+    def next_generation(self):
+        ranked = np.argsort(self.scores, kind='stable')
+        population = [self.population[i] for i in ranked[:self.elite]]
+        while len(population) < self.population_size:
+            population.append(self._offspring())
+        return population
+
+    # checkpoints
+
+    def state_path(self):
+        return os.path.join(self.out_dir, 'state.json')
+
+    def save(self):
+        _write_json(self.state_path(), {
+            'settings': self.settings,
+            'generation': self.generation,
+            'population': self.population,
+            'scores': self.scores,
+            'cache': self.cache,
+            'history': self.history,
+            'rng': self.rng.bit_generator.state,
+        })
+
+    def load(self):
+        if not os.path.exists(self.state_path()):
+            return False
+        with open(self.state_path()) as f:
+            state = json.load(f)
+        if state['settings'] != json.loads(json.dumps(self.settings)):
+            raise ValueError('%s was started with different settings; use another directory' % self.state_path())
+        self.generation = state['generation']
+        self.population = state['population']
+        self.scores = state['scores']
+        self.cache = state['cache']
+        self.history = state['history']
+        self.rng.bit_generator.state = state['rng']
+        return True
+
+    # the search
+
+    def best(self):
+        # -> (individual, fitness) of the best configuration seen so far
+        i = int(np.argmin(self.scores))
+        return self.population[i], self.scores[i]
+
+    def write_best(self):
+        # out_dir/best.json, loadable with App.load_configuration, which
+        # settles it with the same solver and max_time it was scored with
+        individual, fitness = self.best()
+        design, mask = self.decode(individual)
+        path = os.path.join(self.out_dir, 'best.json')
+        _write_json(path, {'design': design, 'mask': mask, 'actuation': self.actuation, 'fitness': fitness,
+                           'generation': self.generation, 'settled': self.cache[self.key(individual)]['settled'],
+                           'solver': self.store.solver_name, 'max_time': self.store.max_time})
+        return path
+
+    def run(self, generations, tolerance=0.0, callback=None):
+        # Evolve until `generations` have been evaluated in total (counting
+        # resumed ones) or the best shape error is at most tolerance px.
+        with multiprocessing.Pool(self.workers) if self.workers > 1 else _NoPool() as pool:
+            if not self.population:
+                self.population = [self.random_individual() for i in range(self.population_size)]
+                self.scores = self.evaluate(self.population, pool)
+                spread = float(np.median(self.scores))
+                if spread < self.min_spread:
+                    raise ValueError('random hinge configurations already come within %.2f px of the target '
+                                     '(median), so the search has nothing to tell apart; use a longer '
+                                     'max_time or an actuation that deforms the lattice' % spread)
+                self._finish_generation(callback)
+            while self.generation < generations and self.best()[1] > tolerance:
+                population = self.next_generation()
+                scores = self.evaluate(population, pool)
+                self.population, self.scores = population, scores
+                self._finish_generation(callback)
+        return self.best()
+
+    def _finish_generation(self, callback):
+        self.generation += 1
+        self.history.append({'generation': self.generation, 'best': min(self.scores),
+                             'mean': float(np.mean(self.scores)), 'configurations': len(self.cache)})
+        self.save()
+        self.write_best()
+        if callback is not None:
+            callback(self)
+
+
+class _NoPool:
+    # stands in for a Pool when evaluating in this process
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+def target_for_mask(mask, design=None, actuation=None, quasi_static=False, max_time=30):
+    # Equilibrium cell centres of a known configuration, e.g. to check that
+    # the search finds it again.
+    sim = build_design(design or {}, mask, actuation)
+    if quasi_static:
+        from equilibrium import relax
+        relax(sim, max_time=max_time)
+    else:
+        from configurations import settle
+        settle(sim, max_time)
+    return np.array([tuple(rect.body.position) for rect in sim.rectangles], dtype=float)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Search for hinge configurations that reach a target shape.')
+    parser.add_argument('out_dir', help='checkpoint, equilibrium cache and best.json go here')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--target', metavar='FILE',
+                        help="JSON with the target cell centres under 'position', or a configuration like best.json")
+    target.add_argument('--target-mask', metavar='HEX', help='use the equilibrium of this hinge mask as target')
+    parser.add_argument('--design', metavar='FILE', help='JSON design dict (sweep.py parameters)')
+    parser.add_argument('--force-flag', type=int, default=0)
+    parser.add_argument('--counter', type=int, default=0)
+    parser.add_argument('--generations', type=int, default=50, help='total, counting resumed generations')
+    parser.add_argument('--population', type=int, default=32)
+    parser.add_argument('--widths', type=int, nargs=2, metavar=('MIN', 'MAX'),
+                        help='also search the cell widths within MIN..MAX px')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='stop once the shape error is this small (px)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quasi-static', action='store_true',
+                        help='judge candidates by equilibrium.relax instead of a full undamped settle')
+    parser.add_argument('--max-time', type=float, default=None,
+                        help='simulated seconds allowed per candidate; default 30, or 300 with --quasi-static')
+    parser.add_argument('--min-spread', type=float, default=1.0,
+                        help='refuse to search if random configurations score below this on median (px)')
+    args = parser.parse_args()
+
+    design = {}
+    if args.design:
+        with open(args.design) as f:
+            design = json.load(f)
+    actuation = {'force_flag': args.force_flag, 'counter': args.counter}
+    max_time = args.max_time or (300 if args.quasi_static else 30)
+    if args.target:
+        goal = load_target(args.target, args.quasi_static, max_time)
+    else:
+        goal = target_for_mask(args.target_mask, design, actuation, args.quasi_static, max_time)
+
+    optimiser = HingeOptimiser(goal, args.out_dir, design, actuation, population=args.population,
+                               widths=args.widths, seed=args.seed, workers=args.workers,
+                               quasi_static=args.quasi_static, max_time=max_time,
+                               min_spread=args.min_spread)
+    if optimiser.generation:
+        print('resuming at generation', optimiser.generation)
+
+    def report(optimiser):
+        last = optimiser.history[-1]
+        print('generation %d best %.2f px mean %.2f px, %d configurations, %d simulated, %.1fs' % (
+            last['generation'], last['best'], last['mean'], last['configurations'], optimiser.evaluations,
+            time.perf_counter() - start))
+
+    start = time.perf_counter()
+    try:
+        individual, fitness = optimiser.run(args.generations, args.tolerance, callback=report)
+    except ValueError as error:
+        raise SystemExit(error)
+    design, mask = optimiser.decode(individual)
+    print('best', mask, design, '%.2f px' % fitness)
+    print('python run_app.py --configuration', os.path.join(args.out_dir, 'best.json'))
@@ -0,0 +1,95 @@
+import numpy as np
+
+NO_CELL = np.iinfo(np.int64).min
+
+
+class HingePicker:
+    # Uniform grid over the world position of every SlideJoint's anchor on
+    # its first body. Positions come from a LatticeGeometry so update() is
+    # one vectorized pass; only hinges that crossed a cell boundary are
+    # re-bucketed.
+    def __init__(self, geometry, joints, cell_size=20):
+        self.geometry = geometry
+        self.cell_size = cell_size
+        body_index = {id(body): i for i, body in enumerate(geometry.bodies)}
+        self.joints = [joint for joint in joints if id(joint.joint.a) in body_index]
+
+        n = len(self.joints)
+        self.owner = np.array([body_index[id(joint.joint.a)] for joint in self.joints], dtype=np.intp)
+        self.anchors = np.array([tuple(joint.joint.anchor_a) for joint in self.joints], dtype=float).reshape(n, 2)
+        self.points = np.zeros((n, 2))
+        self.keys = np.full((n, 2), NO_CELL, dtype=np.int64)
+        self.cells = {}
+
+    def update(self):
+        g = self.geometry
+        angles = g.angles[self.owner]
+        cos = np.cos(angles)
+        sin = np.sin(angles)
+        ax = self.anchors[:, 0]
+        ay = self.anchors[:, 1]
+        self.points[:, 0] = g.positions[self.owner, 0] + ax * cos - ay * sin
+        self.points[:, 1] = g.positions[self.owner, 1] + ax * sin + ay * cos
+
+        keys = np.floor(self.points / self.cell_size).astype(np.int64)
+        for k in np.flatnonzero((keys != self.keys).any(axis=1)):
+            old = tuple(self.keys[k])
+            if old in self.cells:
+                self.cells[old].discard(k)
+                if not self.cells[old]:
+                    del self.cells[old]
+            new = tuple(keys[k])
+            self.cells.setdefault(new, set()).add(k)
+            self.keys[k] = keys[k]
+
+    def _candidates(self, x0, y0, x1, y1):
+        cx0, cy0 = int(np.floor(x0 / self.cell_size)), int(np.floor(y0 / self.cell_size))
+        cx1, cy1 = int(np.floor(x1 / self.cell_size)), int(np.floor(y1 / self.cell_size))
+        found = []
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.cells):
+            # Region covers more cells than are occupied: walk the occupied ones.
+            for (cx, cy), ids in self.cells.items():
+                if cx0 <= cx <= cx1 and cy0 <= cy <= cy1:
+                    found.extend(ids)
+        else:
+            for cx in range(cx0, cx1 + 1):
+                for cy in range(cy0, cy1 + 1):
+                    found.extend(self.cells.get((cx, cy), ()))
+        return np.array(found, dtype=np.intp)
+
+    def pick(self, pos, radius=20):
+        x, y = pos
+        ids = self._candidates(x - radius, y - radius, x + radius, y + radius)
+        if len(ids) == 0:
+            return None
+        d2 = ((self.points[ids] - (x, y)) ** 2).sum(axis=1)
+        best = int(np.argmin(d2))
+        if d2[best] >= radius * radius:
+            return None
+        return self.joints[ids[best]]
+
+    def in_box(self, p0, p1):
+        x0, x1 = sorted((p0[0], p1[0]))
+        y0, y1 = sorted((p0[1], p1[1]))
+        ids = self._candidates(x0, y0, x1, y1)
+        pts = self.points[ids]
+        inside = (pts[:, 0] >= x0) & (pts[:, 0] <= x1) & (pts[:, 1] >= y0) & (pts[:, 1] <= y1)
+        return [self.joints[k] for k in ids[inside]]
+
+    def in_lasso(self, polygon):
+        poly = np.asarray(polygon, dtype=float)
+        if len(poly) < 3:
+            return []
+        (x0, y0), (x1, y1) = poly.min(axis=0), poly.max(axis=0)
+        ids = self._candidates(x0, y0, x1, y1)
+        px = self.points[ids, 0][:, None]
+        py = self.points[ids, 1][:, None]
+
+        # Even-odd ray casting against every polygon edge at once.
+        ex0, ey0 = poly[:, 0], poly[:, 1]
+        ex1, ey1 = np.roll(ex0, -1), np.roll(ey0, -1)
+        straddles = (ey0 > py) != (ey1 > py)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cross_x = ex0 + (py - ey0) * (ex1 - ex0) / (ey1 - ey0)
+        inside = (straddles & (px < cross_x)).sum(axis=1) % 2 == 1
+        return [self.joints[k] for k in ids[inside]]
@@ -0,0 +1,87 @@
+import collections
+import csv
+import time
+
+import numpy as np
+
+PHASES = ('events', 'draw', 'tick', 'step')
+
+
+class FrameProfiler:
+    # Times the phases of each App.run frame. Keeps the last `window` frames
+    # per phase for rolling stats, optionally streams every frame to CSV, and
+    # calls user hooks around each phase so external profilers (cProfile,
+    # py-spy markers, tracers) can attach to just the step or draw work.
+    def __init__(self, window=300, phases=PHASES):
+        self.phases = phases
+        self.window = window
+        self.history = {phase: collections.deque(maxlen=window) for phase in phases}
+        self.frame_times = collections.deque(maxlen=window)
+        self.substeps = collections.deque(maxlen=window)
+        self.hooks = {phase: [] for phase in phases}
+        self.current = {}
+        self.frame = 0
+        self.frame_start = time.perf_counter()
+        self._started = {}
+        self.csv_file = None
+        self.csv_writer = None
+
+    def add_hook(self, phase, before=None, after=None):
+        self.hooks[phase].append((before, after))
+
+    def begin(self, phase):
+        for before, after in self.hooks[phase]:
+            if before is not None:
+                before(phase)
+        self._started[phase] = time.perf_counter()
+
+    def end(self, phase):
+        elapsed = time.perf_counter() - self._started.pop(phase)
+        self.current[phase] = self.current.get(phase, 0.0) + elapsed
+        for before, after in self.hooks[phase]:
+            if after is not None:
+                after(phase)
+
+    def end_frame(self, substeps=0):
+        now = time.perf_counter()
+        total = now - self.frame_start
+        self.frame_start = now
+        for phase in self.phases:
+            self.history[phase].append(self.current.get(phase, 0.0))
+        self.frame_times.append(total)
+        self.substeps.append(substeps)
+        if self.csv_writer is not None:
+            self.csv_writer.writerow([self.frame, total * 1e3, substeps] +
+                                     [self.current.get(phase, 0.0) * 1e3 for phase in self.phases])
+        self.current = {}
+        self.frame += 1
+
+    def start_csv(self, path):
+        self.stop_csv()
+        self.csv_file = open(path, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(['frame', 'total_ms', 'substeps'] + [phase + '_ms' for phase in self.phases])
+
+    def stop_csv(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+        self.csv_file = None
+        self.csv_writer = None
+
+    def histogram(self, phase, bins=20):
+        # (counts, edges in ms) over the rolling window
+        return np.histogram(np.array(self.history[phase]) * 1e3, bins=bins)
+
+    def summary(self):
+        frames = np.array(self.frame_times)
+        wall = frames.sum()
+        stats = {
+            'fps': len(frames) / wall if wall > 0 else 0.0,
+            'substeps_per_sec': sum(self.substeps) / wall if wall > 0 else 0.0,
+            'frame_ms': frames.mean() * 1e3 if len(frames) else 0.0,
+        }
+        for phase in self.phases:
+            values = np.array(self.history[phase]) * 1e3
+            stats[phase + '_ms'] = values.mean() if len(values) else 0.0
+            stats[phase + '_p95_ms'] = np.percentile(values, 95) if len(values) else 0.0
+        return stats
@@ -1,26 +1,39 @@
-import pygame
 import pymunk
-import pymunk.pygame_util
-import math
-from run_app import b0, App, Segment, DampedRotarySpring, PivotJoint, RotaryLimitJoint, SimpleMotor, Vec2d
 
-pygame.init()
-space = pymunk.Space()
+# pygame is only imported by run(), so create_boundaries and friends can be
+# used (and this file imported) without a display.
+
 
 def draw(space, window, draw_options):
+    import pygame
     window.fill("white")
     space.debug_draw(draw_options)
     pygame.display.update()
 
-width, height = 800, 800
-window = pygame.display.set_mode((width, height))
 
 def create_boundaries(space, width, height):
-    
-
-
-
-def run (window, width, height):
+    # static walls 20px thick along the window edges
+    walls = [
+        ((width / 2, height - 10), (width, 20)),
+        ((width / 2, 10), (width, 20)),
+        ((10, height / 2), (20, height)),
+        ((width - 10, height / 2), (20, height)),
+    ]
+    for position, size in walls:
+        body = pymunk.Body(body_type=pymunk.Body.STATIC)
+        body.position = position
+        shape = pymunk.Poly.create_box(body, size)
+        shape.elasticity = 0.4
+        shape.friction = 0.5
+        space.add(body, shape)
+
+
+def run(width=800, height=800):
+    import pygame
+    import pymunk.pygame_util
+
+    pygame.init()
+    window = pygame.display.set_mode((width, height))
     run = True
     clock = pygame.time.Clock()
     fps = 60
@@ -29,6 +42,7 @@ def run (window, width, height):
 
     space = pymunk.Space()
     space.gravity = (0, 981)
+    create_boundaries(space, width, height)
 
     draw_options = pymunk.pygame_util.DrawOptions(window)
 
@@ -37,11 +51,12 @@ def run (window, width, height):
             if event.type == pygame.QUIT:
                 run = False
                 break
-        
+
         draw(space, window, draw_options)
         space.step(dt)
         clock.tick(fps)
     pygame.quit()
 
+
 if __name__ == "__main__":
-    run(window, width, height)
\ No newline at end of file
+    run()
@@ -0,0 +1,128 @@
+import numpy as np
+
+from actuation import CompiledProgram
+from geometry import body_poses, pose_drift
+from lattice import steps
+
+
+class QuiescenceMonitor:
+    # Watches how far the lattice rectangles move (checked every
+    # `check_every` substeps as a simulation observer) and reports the
+    # lattice as settled once no point of any cell has moved more than
+    # drift_tol px over a window of `settle_time` simulated seconds. Speed
+    # at one instant is no use here: a lattice pushed by force_rect creeps
+    # slowly enough to look idle while still covering tens of pixels a
+    # minute, hence the drift over a window, as in equilibrium.relax. It is
+    # never settled while force_rect is pushing or an actuation program is
+    # running. While settled, should_step() tells callers they can skip
+    # space.step entirely, until a hinge toggle, an actuator force, a change
+    # to the force_rect actuation or an explicit wake() says otherwise.
+    # With use_sleeping, pymunk may also put cells slower than idle_speed to
+    # sleep in the meantime.
+    def __init__(self, sim, idle_speed=0.5, settle_time=1.0, drift_tol=0.1, check_every=steps,
+                 use_sleeping=True):
+        self.sim = sim
+        self.rectangles = [rect for rect in sim.rectangles if rect.body.body_type == rect.body.DYNAMIC]
+        self.bodies = [rect.body for rect in self.rectangles]
+        self.actuator_bodies = [rect.body for rect in sim.actuators()]
+        self.half_diagonals = np.array([np.hypot(rect.width, rect.height) / 2 for rect in self.rectangles])
+        self.settle_time = settle_time
+        self.drift_tol = drift_tol
+        self.check_every = check_every
+        self.use_sleeping = use_sleeping
+        # close() puts these back, so the space doesn't keep sleeping
+        # bodies after the monitor is gone
+        self._saved_sleep = (sim.space.sleep_time_threshold, sim.space.idle_speed_threshold)
+        if use_sleeping:
+            sim.space.sleep_time_threshold = settle_time
+            sim.space.idle_speed_threshold = idle_speed
+
+        # furthest any point moved over the last complete window
+        self.drift = float('inf')
+        self.settled = False
+        self.settled_at = None
+        self.skipped_frames = 0
+        self._since_check = 0
+        self._window_start = sim.time
+        self._window_pose = body_poses(self.bodies)
+        self._watch = None
+        # called with no arguments whenever wake() runs, e.g. to log it
+        self.on_wake = None
+        sim.observers.append(self)
+
+    def before_step(self, sim):
+        pass
+
+    def after_step(self, sim):
+        self._since_check += 1
+        if self._since_check >= self.check_every:
+            self._since_check = 0
+            self.check()
+
+    def driven(self):
+        # force_rect pushing or an actuation program with rows left
+        rect = self.sim.force_rect
+        if rect is not None and rect.forceFlag != 0:
+            return True
+        return any(isinstance(observer, CompiledProgram) and not observer.done for observer in self.sim.observers)
+
+    def restart_window(self):
+        self._window_start = self.sim.time
+        self._window_pose = body_poses(self.bodies)
+
+    def check(self):
+        if self.settled:
+            return True
+        if self.driven():
+            self.drift = float('inf')
+            self.restart_window()
+            return False
+        if self.sim.time - self._window_start < self.settle_time - 1e-9:
+            return False
+        pose = body_poses(self.bodies)
+        self.drift = float(pose_drift(self._window_pose, pose, self.half_diagonals).max()) if self.bodies else 0.0
+        self._window_start = self.sim.time
+        self._window_pose = pose
+        if self.drift < self.drift_tol:
+            self.settled = True
+            self.settled_at = self.sim.time
+            self._watch = self._snapshot()
+        return self.settled
+
+    def _snapshot(self):
+        rect = self.sim.force_rect
+        return (self.sim.hinge_changes, rect.forceFlag if rect else None, rect.counter if rect else None)
+
+    def disturbed(self):
+        if self._snapshot() != self._watch:
+            return True
+        return any(body.force.x or body.force.y or body.torque for body in self.actuator_bodies)
+
+    def wake(self):
+        if self.on_wake is not None:
+            self.on_wake()
+        self.settled = False
+        self.settled_at = None
+        self.drift = float('inf')
+        self._since_check = 0
+        self.restart_window()
+        if self.use_sleeping:
+            for body in self.bodies:
+                if body.is_sleeping:
+                    body.activate()
+
+    def should_step(self):
+        if self.settled and self.disturbed():
+            self.wake()
+        if self.settled:
+            self.skipped_frames += 1
+        return not self.settled
+
+    def close(self):
+        if self in self.sim.observers:
+            self.sim.observers.remove(self)
+        if self.use_sleeping:
+            self.sim.space.sleep_time_threshold, self.sim.space.idle_speed_threshold = self._saved_sleep
+            for body in self.bodies:
+                if body.is_sleeping:
+                    body.activate()
@@ -0,0 +1,163 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+# Per-frame fields: name -> (dtype, shape given the lattice counts)
+FIELDS = {
+    'substep': ('int64', lambda n_bodies, n_joints, n_actuators: ()),
+    'time': ('float64', lambda n_bodies, n_joints, n_actuators: ()),
+    'position': ('float64', lambda n_bodies, n_joints, n_actuators: (n_bodies, 2)),
+    'angle': ('float64', lambda n_bodies, n_joints, n_actuators: (n_bodies,)),
+    'velocity': ('float64', lambda n_bodies, n_joints, n_actuators: (n_bodies, 2)),
+    'angular_velocity': ('float64', lambda n_bodies, n_joints, n_actuators: (n_bodies,)),
+    'constrained': ('uint8', lambda n_bodies, n_joints, n_actuators: (n_joints,)),
+    'impulse': ('float64', lambda n_bodies, n_joints, n_actuators: (n_joints,)),
+    'actuator_force': ('float64', lambda n_bodies, n_joints, n_actuators: (n_actuators, 2)),
+}
+
+
+def lattice_layout(sim):
+    # Static description of the lattice, enough to redraw it from poses.
+    index = {id(rect): i for i, rect in enumerate(sim.rectangles)}
+    joints = [joint for pair in sim.joints for joint in pair]
+    return {
+        'sizes': [(rect.width, rect.height) for rect in sim.rectangles],
+        'blocks': [{'position': tuple(block.body.position), 'angle': block.body.angle, 'size': (block.width, block.height)}
+                   for block in sim.blocks],
+        'joint_cells': [(index[id(joint.left_rect)], index[id(joint.right_rect)]) for joint in joints],
+        'joint_corners': [joint.corner for joint in joints],
+        'actuators': [index[id(rect)] for rect in sim.actuators()],
+    }
+
+
+class TrajectoryRecorder:
+    # Samples the lattice every `every` substeps and streams each field to
+    # an append-only raw file under `path`. Sampling only copies the values
+    # into fresh arrays; the file writes happen on a background thread so
+    # sim.step never waits on disk unless the queue backs up.
+    def __init__(self, sim, path, every=1, queue_size=256):
+        self.sim = sim
+        self.path = path
+        self.every = every
+        self.frames = 0
+        self.bodies = [rect.body for rect in sim.rectangles]
+        self.joints = [joint for pair in sim.joints for joint in pair]
+        self.constraints = [joint.joint for joint in self.joints]
+        self.actuator_bodies = [rect.body for rect in sim.actuators()]
+        self.forces = np.zeros((len(self.actuator_bodies), 2))
+
+        os.makedirs(path, exist_ok=True)
+        counts = (len(self.bodies), len(self.joints), len(self.actuator_bodies))
+        self.meta = {
+            'every': every,
+            'frames': 0,
+            'n_bodies': counts[0],
+            'n_joints': counts[1],
+            'n_actuators': counts[2],
+            'fields': {name: [dtype, list(shape(*counts))] for name, (dtype, shape) in FIELDS.items()},
+            'layout': lattice_layout(sim),
+        }
+        self._write_meta()
+
+        self.files = {name: open(os.path.join(path, name + '.dat'), 'wb') for name in FIELDS}
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+        sim.observers.append(self)
+
+    def _write_meta(self):
+        tmp = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.meta, f)
+        os.replace(tmp, os.path.join(self.path, 'meta.json'))
+
+    def _write_loop(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            for name, value in frame.items():
+                self.files[name].write(value.tobytes())
+
+    def before_step(self, sim):
+        # body.force is cleared by space.step, so actuator forces have to be
+        # read before the step that samples them.
+        if (sim.substep + 1) % self.every == 0:
+            self.forces = np.array([tuple(body.force) for body in self.actuator_bodies], dtype=float).reshape(-1, 2)
+
+    def after_step(self, sim):
+        if sim.substep % self.every == 0:
+            self.sample(sim)
+
+    def sample(self, sim):
+        bodies = self.bodies
+        frame = {
+            'substep': np.array(sim.substep, dtype=np.int64),
+            'time': np.array(sim.time, dtype=np.float64),
+            'position': np.array([tuple(body.position) for body in bodies], dtype=np.float64),
+            'angle': np.array([body.angle for body in bodies], dtype=np.float64),
+            'velocity': np.array([tuple(body.velocity) for body in bodies], dtype=np.float64),
+            'angular_velocity': np.array([body.angular_velocity for body in bodies], dtype=np.float64),
+            'constrained': np.array([c.max == 0 for c in self.constraints], dtype=np.uint8),
+            'impulse': np.array([c.impulse for c in self.constraints], dtype=np.float64),
+            'actuator_force': self.forces,
+        }
+        self.queue.put(frame)
+        self.frames += 1
+
+    def close(self):
+        if self in self.sim.observers:
+            self.sim.observers.remove(self)
+        self.queue.put(None)
+        self.writer.join()
+        for f in self.files.values():
+            f.close()
+        self.meta['frames'] = self.frames
+        self._write_meta()
+
+
+class Trajectory:
+    # Read side: every field is an np.memmap over the raw file, so slicing
+    # reads straight from the page cache. The frame count comes from the
+    # file sizes, which also covers recordings cut short by a crash.
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.layout = self.meta['layout']
+        self.every = self.meta['every']
+
+        frames = None
+        specs = {}
+        for name, (dtype, shape) in self.meta['fields'].items():
+            dtype = np.dtype(dtype)
+            frame_bytes = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+            size = os.path.getsize(os.path.join(path, name + '.dat'))
+            count = size // frame_bytes if frame_bytes else 0
+            frames = count if frames is None else min(frames, count)
+            specs[name] = (dtype, tuple(shape))
+        self.frames = frames or 0
+
+        self.fields = {}
+        for name, (dtype, shape) in specs.items():
+            if self.frames == 0 or 0 in shape:
+                self.fields[name] = np.zeros((self.frames,) + shape, dtype=dtype)
+            else:
+                self.fields[name] = np.memmap(os.path.join(path, name + '.dat'), dtype=dtype, mode='r',
+                                              shape=(self.frames,) + shape)
+
+    def __len__(self):
+        return self.frames
+
+    def __getattr__(self, name):
+        fields = self.__dict__.get('fields', {})
+        if name in fields:
+            return fields[name]
+        raise AttributeError(name)
+
+
+def open_trajectory(path):
+    return Trajectory(path)
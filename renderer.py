@@ -0,0 +1,249 @@
+import gc
+
+import numpy as np
+
+import pygame
+import pymunk
+
+from geometry import LatticeGeometry
+
+GRAY = (220, 220, 220)
+BLACK = (0, 0, 0)
+CELL = (70, 130, 180)
+STATIC = (110, 110, 110)
+
+# BOT_LEFT, BOT_RIGHT, TOP_RIGHT, TOP_LEFT: corner order for drawing polygons
+POLYGON_ORDER = [0, 1, 3, 2]
+
+# Level of detail by on-screen cell size (shortest side, px)
+LOD_POINTS = 4
+LOD_FILL = 12
+
+# Past this many dirty rectangles a full redraw is cheaper than patching.
+MAX_DIRTY_RECTS = 64
+
+
+class LatticeRenderer:
+    # Draws the lattice from LatticeGeometry's corner arrays instead of
+    # space.debug_draw. Static shapes are rendered once into a background
+    # surface, each frame only the cells that moved (plus whatever overlaps
+    # the area they vacated) are redrawn, and only those screen rectangles
+    # are pushed to the display. Small cells fall back to outline-less
+    # polygons and then to single pixels written through surfarray.
+    def __init__(self, screen, sim, geometry=None, scale=1.0, offset=(0, 0)):
+        self.screen = screen
+        self.sim = sim
+        self.geometry = geometry or LatticeGeometry(sim.rectangles)
+        self.scale = scale
+        self.offset = np.array(offset, dtype=float)
+        self.marker_radius = 10
+
+        index = self.geometry.index
+        flat_joints = [joint for pair in sim.joints for joint in pair]
+        # position of each drawn joint in the flattened sim.joints pairs
+        self.joint_ids = np.array([i for i, joint in enumerate(flat_joints) if id(joint.left_rect) in index],
+                                  dtype=np.intp)
+        joints = [flat_joints[i] for i in self.joint_ids]
+        self.constraints = [joint.joint for joint in joints]
+        self.joint_cells = np.array([index[id(joint.left_rect)] for joint in joints], dtype=np.intp)
+        self.joint_corners = np.array([joint.corner - 1 for joint in joints], dtype=np.intp)
+        self.locked = np.zeros(len(joints), dtype=bool)
+        self.hinge_changes = None
+
+        self.background = None
+        self.last_boxes = None
+        self.last_locked = None
+        self.full_redraw = True
+        self.cells_drawn = 0
+        # (positions, angles) of the previous substep and how far to blend
+        # from it towards the current one; None draws the current pose.
+        self.previous = None
+        self.alpha = 1.0
+
+    def to_screen(self, points):
+        return np.asarray(points, dtype=float) * self.scale + self.offset
+
+    def to_world(self, pos):
+        return tuple((np.asarray(pos, dtype=float) - self.offset) / self.scale)
+
+    def set_view(self, scale, offset):
+        self.scale = scale
+        self.offset = np.array(offset, dtype=float)
+        self.invalidate()
+
+    def fit(self, margin=20):
+        # Scale and centre the view so every cell is on screen.
+        corners = self.geometry.update().reshape(-1, 2)
+        if not len(corners):
+            return
+        lo, hi = corners.min(axis=0), corners.max(axis=0)
+        width, height = self.screen.get_size()
+        extent = np.maximum(hi - lo, 1)
+        scale = min((width - 2 * margin) / extent[0], (height - 2 * margin) / extent[1])
+        offset = np.array([width, height]) / 2 - (lo + hi) / 2 * scale
+        self.set_view(scale, offset)
+
+    def zoom(self, factor, center=None):
+        if center is None:
+            center = np.array(self.screen.get_size()) / 2
+        center = np.asarray(center, dtype=float)
+        self.set_view(self.scale * factor, center - (center - self.offset) * factor)
+
+    def invalidate(self):
+        self.background = None
+        self.full_redraw = True
+
+    def lod(self):
+        if not len(self.geometry.local_corners):
+            return 'full'
+        shortest = 2 * np.abs(self.geometry.local_corners[:, 0]).min() * self.scale
+        if shortest < LOD_POINTS:
+            return 'points'
+        if shortest < LOD_FILL:
+            return 'fill'
+        return 'full'
+
+    def render_background(self):
+        background = pygame.Surface(self.screen.get_size(), 0, self.screen)
+        background.fill(GRAY)
+        for shape in self.sim.space.shapes:
+            body = shape.body
+            if body.body_type != pymunk.Body.STATIC:
+                continue
+            if isinstance(shape, pymunk.Poly):
+                points = self.to_screen([tuple(body.local_to_world(v)) for v in shape.get_vertices()])
+                pygame.draw.polygon(background, STATIC, points)
+            elif isinstance(shape, pymunk.Segment):
+                a, b = self.to_screen([tuple(body.local_to_world(shape.a)), tuple(body.local_to_world(shape.b))])
+                pygame.draw.line(background, STATIC, a, b, max(int(2 * shape.radius * self.scale), 1))
+            elif isinstance(shape, pymunk.Circle):
+                center = self.to_screen([tuple(body.local_to_world(shape.offset))])[0]
+                pygame.draw.circle(background, STATIC, center, max(shape.radius * self.scale, 1))
+        self.background = background
+
+    def update_locked(self):
+        # Joint limits are only re-read after a hinge toggle.
+        if self.hinge_changes != self.sim.hinge_changes:
+            self.locked = np.array([c.max == 0 for c in self.constraints], dtype=bool)
+            self.hinge_changes = self.sim.hinge_changes
+        return self.locked
+
+    def draw(self, update_display=True):
+        # Returns the list of screen rectangles that changed.
+        if self.background is None:
+            self.render_background()
+        if self.previous is None:
+            corners = self.to_screen(self.geometry.update())
+        else:
+            corners = self.to_screen(self.geometry.blend(*self.previous, self.alpha))
+        locked = self.update_locked()
+        mode = self.lod()
+
+        pad = self.marker_radius * min(self.scale, 1) + 2
+        if len(corners):
+            boxes = np.concatenate([corners.min(axis=1) - pad, corners.max(axis=1) + pad], axis=1)
+        else:
+            boxes = np.zeros((0, 4))
+
+        dirty = None
+        if not self.full_redraw and mode != 'points' and self.last_boxes is not None:
+            dirty = self.dirty_rects(boxes, locked)
+        if dirty is None:
+            width, height = self.screen.get_size()
+            visible = (boxes[:, 2] > 0) & (boxes[:, 0] < width) & (boxes[:, 3] > 0) & (boxes[:, 1] < height)
+            self.screen.blit(self.background, (0, 0))
+            self.draw_cells(corners, np.flatnonzero(visible), mode)
+            self.draw_markers(corners, locked & visible[self.joint_cells], mode)
+            rects = [self.screen.get_rect()]
+        elif dirty:
+            for rect in dirty:
+                self.screen.blit(self.background, rect, rect)
+            # redraw every cell touching a patched area, not just the movers
+            x0, y0, x1, y1 = (np.array([[r.left, r.top, r.right, r.bottom] for r in dirty], dtype=float).T[:, None, :])
+            touching = ((boxes[:, 0:1] < x1) & (boxes[:, 2:3] > x0) & (boxes[:, 1:2] < y1) & (boxes[:, 3:4] > y0)).any(axis=1)
+            self.draw_cells(corners, np.flatnonzero(touching), mode)
+            self.draw_markers(corners, locked & touching[self.joint_cells], mode)
+            rects = dirty
+        else:
+            rects = []
+
+        self.last_boxes = boxes
+        self.last_locked = locked.copy()
+        self.full_redraw = False
+        if update_display and rects:
+            pygame.display.update(rects)
+        return rects
+
+    def dirty_rects(self, boxes, locked):
+        if len(boxes) != len(self.last_boxes):
+            return None
+        moved = np.abs(boxes - self.last_boxes).max(axis=1) > 0.25
+        changed_cells = np.zeros(len(boxes), dtype=bool)
+        changed_cells[self.joint_cells[locked != self.last_locked]] = True
+        moved |= changed_cells
+        ids = np.flatnonzero(moved)
+        if len(ids) > MAX_DIRTY_RECTS:
+            return None
+        rects = []
+        for i in ids:
+            old, new = self.last_boxes[i], boxes[i]
+            x0, y0 = min(old[0], new[0]), min(old[1], new[1])
+            x1, y1 = max(old[2], new[2]), max(old[3], new[3])
+            rects.append(pygame.Rect(int(x0), int(y0), int(x1 - x0) + 2, int(y1 - y0) + 2))
+        screen_rect = self.screen.get_rect()
+        return [rect.clip(screen_rect) for rect in rects if rect.colliderect(screen_rect)]
+
+    def draw_cells(self, corners, ids, mode):
+        self.cells_drawn = len(ids)
+        if mode == 'points':
+            self.draw_points(corners[ids].mean(axis=1))
+            return
+        # tolist allocates a few lists per cell; with a big lattice in memory
+        # letting the collector run here costs more than the drawing.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            polygons = corners[ids][:, POLYGON_ORDER].tolist()
+            draw_polygon = pygame.draw.polygon
+            screen = self.screen
+            for polygon in polygons:
+                draw_polygon(screen, CELL, polygon)
+            if mode == 'full':
+                for polygon in polygons:
+                    draw_polygon(screen, BLACK, polygon, 1)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def draw_points(self, points, color=CELL):
+        width, height = self.screen.get_size()
+        xy = np.rint(points).astype(np.intp)
+        inside = (xy[:, 0] >= 0) & (xy[:, 0] < width) & (xy[:, 1] >= 0) & (xy[:, 1] < height)
+        xy = xy[inside]
+        pixels = pygame.surfarray.pixels2d(self.screen)
+        pixels[xy[:, 0], xy[:, 1]] = self.screen.map_rgb(color)
+        del pixels
+
+    def draw_joint_values(self, values, radius=6):
+        # One dot per hinge over the last drawn pose, blue at 0 to red at 1;
+        # values are indexed like the flattened sim.joints pairs.
+        if not len(self.joint_cells):
+            return
+        values = np.clip(np.asarray(values, dtype=float)[self.joint_ids], 0, 1)
+        points = self.to_screen(self.geometry.corners[self.joint_cells, self.joint_corners])
+        colors = np.stack([255 * values, 40 * np.ones_like(values), 255 * (1 - values)], axis=1).astype(int)
+        radius = max(radius * min(self.scale, 1), 1)
+        for point, color in zip(points.tolist(), colors.tolist()):
+            pygame.draw.circle(self.screen, color, point, radius)
+
+    def draw_markers(self, corners, locked, mode):
+        if mode == 'points' or not len(self.joint_cells):
+            return
+        ids = np.flatnonzero(locked)
+        points = corners[self.joint_cells[ids], self.joint_corners[ids]]
+        if mode == 'fill':
+            self.draw_points(points, BLACK)
+            return
+        radius = max(self.marker_radius * min(self.scale, 1), 1)
+        for x, y in points.tolist():
+            pygame.draw.circle(self.screen, BLACK, (x, y), radius)
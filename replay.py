@@ -0,0 +1,171 @@
+import argparse
+
+import numpy as np
+
+import pygame
+from pygame.locals import *
+
+from lattice import size, fps
+from geometry import box_corners, local_box_corners
+from recorder import open_trajectory
+
+BLACK = (0, 0, 0)
+GRAY = (220, 220, 220)
+WHITE = (255, 255, 255)
+CELL = (70, 130, 180)
+BLOCK = (110, 110, 110)
+
+BAR_HEIGHT = 20
+SPEEDS = (0.125, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+
+# BOT_LEFT, BOT_RIGHT, TOP_RIGHT, TOP_LEFT: corner order for drawing polygons
+POLYGON_ORDER = [0, 1, 3, 2]
+
+
+class ReplayViewer:
+    # Draws a recorded trajectory straight from the stored poses; no pymunk
+    # Space is built. Fields are memmaps, so only the frames actually shown
+    # are read from disk, and the playhead is in simulated time so any speed
+    # simply skips the frames it doesn't need.
+    def __init__(self, trajectory, speed=1):
+        pygame.init()
+        self.clock = pygame.time.Clock()
+        self.screen = pygame.display.set_mode(size)
+        self.font = pygame.font.Font(None, 24)
+        self.running = True
+
+        self.trajectory = trajectory
+        layout = trajectory.layout
+        self.times = trajectory.time
+        self.local_corners = local_box_corners(layout['sizes'])
+        self.joint_cells = np.array([cells[0] for cells in layout['joint_cells']], dtype=np.intp)
+        self.joint_corners = np.array(layout['joint_corners'], dtype=np.intp) - 1
+        self.blocks = [box_corners(np.array([block['position']]), np.array([block['angle']]),
+                                   local_box_corners([block['size']]))[0][POLYGON_ORDER]
+                       for block in layout['blocks']]
+
+        self.speed_index = SPEEDS.index(speed) if speed in SPEEDS else SPEEDS.index(1)
+        self.paused = False
+        self.scrubbing = False
+        self.frame = 0
+        self.playhead = float(self.times[0]) if len(trajectory) else 0.0
+
+    @property
+    def speed(self):
+        return SPEEDS[self.speed_index]
+
+    def run(self):
+        while self.running:
+            for event in pygame.event.get():
+                self.do_event(event)
+
+            elapsed = self.clock.tick(fps) / 1000
+            if not self.paused and not self.scrubbing and len(self.trajectory):
+                self.playhead += elapsed * self.speed
+                if self.playhead >= self.times[-1]:
+                    self.playhead = float(self.times[-1])
+                    self.paused = True
+            self.seek_time(self.playhead)
+
+            self.draw()
+
+        pygame.quit()
+
+    def seek_time(self, t):
+        if not len(self.trajectory):
+            return
+        self.playhead = t
+        self.frame = int(min(np.searchsorted(self.times, t), len(self.trajectory) - 1))
+
+    def seek_frame(self, frame):
+        if not len(self.trajectory):
+            return
+        self.frame = max(0, min(frame, len(self.trajectory) - 1))
+        self.playhead = float(self.times[self.frame])
+
+    def scrub_to(self, x):
+        if not len(self.trajectory):
+            return
+        fraction = max(0.0, min(1.0, x / size[0]))
+        self.seek_time(float(self.times[0]) + fraction * float(self.times[-1] - self.times[0]))
+
+    def do_event(self, event):
+        if event.type == QUIT:
+            self.running = False
+
+        if event.type == KEYDOWN:
+            if event.key in (K_q, K_ESCAPE):
+                self.running = False
+
+            elif event.key == K_SPACE:
+                self.paused = not self.paused
+
+            elif event.key == K_RIGHT:
+                self.paused = True
+                self.seek_frame(self.frame + 1)
+
+            elif event.key == K_LEFT:
+                self.paused = True
+                self.seek_frame(self.frame - 1)
+
+            elif event.key == K_PAGEUP:
+                self.seek_time(self.playhead + 10)
+
+            elif event.key == K_PAGEDOWN:
+                self.seek_time(self.playhead - 10)
+
+            elif event.key == K_HOME:
+                self.seek_frame(0)
+
+            elif event.key == K_END:
+                self.seek_frame(len(self.trajectory) - 1)
+
+            elif event.key == K_UP:
+                self.speed_index = min(self.speed_index + 1, len(SPEEDS) - 1)
+
+            elif event.key == K_DOWN:
+                self.speed_index = max(self.speed_index - 1, 0)
+
+        if event.type == MOUSEBUTTONDOWN and event.pos[1] >= size[1] - BAR_HEIGHT:
+            self.scrubbing = True
+            self.scrub_to(event.pos[0])
+
+        if event.type == MOUSEMOTION and self.scrubbing:
+            self.scrub_to(event.pos[0])
+
+        if event.type == MOUSEBUTTONUP:
+            self.scrubbing = False
+
+    def draw(self):
+        self.screen.fill(GRAY)
+        for polygon in self.blocks:
+            pygame.draw.polygon(self.screen, BLOCK, polygon)
+
+        if len(self.trajectory):
+            t = self.trajectory
+            corners = box_corners(np.asarray(t.position[self.frame]), np.asarray(t.angle[self.frame]), self.local_corners)
+            for polygon in corners[:, POLYGON_ORDER]:
+                pygame.draw.polygon(self.screen, CELL, polygon)
+                pygame.draw.polygon(self.screen, BLACK, polygon, 1)
+
+            locked = np.flatnonzero(t.constrained[self.frame])
+            for x, y in corners[self.joint_cells[locked], self.joint_corners[locked]]:
+                pygame.draw.circle(self.screen, BLACK, (x, y), 10)
+
+            progress = self.frame / max(len(t) - 1, 1)
+            pygame.draw.rect(self.screen, WHITE, (0, size[1] - BAR_HEIGHT, size[0], BAR_HEIGHT))
+            pygame.draw.rect(self.screen, BLACK, (0, size[1] - BAR_HEIGHT, int(size[0] * progress), BAR_HEIGHT))
+
+        status = 't=%.2fs  frame %d/%d  x%g%s' % (self.playhead, self.frame + 1, len(self.trajectory), self.speed,
+                                                  '  paused' if self.paused else '')
+        self.screen.blit(self.font.render(status, True, BLACK), (10, 10))
+        pygame.display.update()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play back a recorded trajectory without running the physics.')
+    parser.add_argument('path', help='directory written by recorder.TrajectoryRecorder')
+    parser.add_argument('--speed', type=float, default=1)
+    args = parser.parse_args()
+
+    ReplayViewer(open_trajectory(args.path), speed=args.speed).run()
@@ -1,225 +1,199 @@
-import pymunk
+import argparse
+import json
 from pymunk.pygame_util import *
-from pymunk.vec2d import Vec2d
-import pymunk.constraints
-import math
+import queue
+import time
 
 import pygame
 from pygame.locals import *
 
-import math
-
-space = pymunk.Space()
-space.gravity = (0, 10)
-static_body = space.static_body
-
-size = screen_width, screen_height = 1500, 800
-fps = 30
-steps = 10
+from lattice import *
+from geometry import LatticeGeometry
+from picking import HingePicker
+from recorder import TrajectoryRecorder
+from checkpoint import Checkpoint
+from profiler import FrameProfiler
+from stepping import AdaptiveStepper
+from quiescence import QuiescenceMonitor
+from renderer import LatticeRenderer
+from capture import FrameCapture
+from actuation import ActuationProgram
+from equilibrium import relax
+from configurations import build_design, solver_by_name
+from optimise import write_target
+from telemetry import JointTelemetry
+from scene import load_scene, save_scene
+from session import SessionRecorder, FORCE, FORCE_RECT, TOGGLE, CHECKPOINT, RESTORE, WAKE, LEFT, RIGHT, apply_input
 
 BLACK = (0, 0, 0)
 GRAY = (220, 220, 220)
 WHITE = (255, 255, 255)
 
-BOT_LEFT = 1
-BOT_RIGHT = 2
-TOP_LEFT = 3
-TOP_RIGHT = 4
-
-class PinJoint:
-    def __init__(self, b, b2, a=(0, 0), a2=(0, 0)):
-        joint = pymunk.constraints.PinJoint(b, b2, a, a2)
-        space.add(joint)
-
-
-class SlideJoint:
-    def __init__(self, b, b2, a=(0, 0), a2=(0, 0), min=0, max=0, collide=True, left_rect = None, right_rect = None):
-        self.joint = pymunk.constraints.SlideJoint(b, b2, a, a2, min, max)
-        self.left_rect = left_rect
-        self.right_rect = right_rect
-        self.joint.collide_bodies = collide
-        self.max_force = 100000
-        space.add(self.joint)
-
-    def is_constrained(self):
-        return self.joint.max == 0
-    
-    def switch_constrain(self):
-        if self.is_constrained():
-            self.joint._set_max(50)
-        else:
-            self.joint._set_max(0)
-
-
-
-class GrooveJoint:
-    def __init__(self, a, b, groove_a, groove_b, anchor_b):
-        joint = pymunk.constraints.GrooveJoint(
-            a, b, groove_a, groove_b, anchor_b)
-        joint.collide_bodies = False
-        space.add(joint)
-
-
-class DampedRotarySpring:
-    def __init__(self, b, b2, angle, stiffness, damping):
-        joint = pymunk.constraints.DampedRotarySpring(
-            b, b2, angle, stiffness, damping)
-        space.add(joint)
-
-
-class RotaryLimitJoint:
-    def __init__(self, b, b2, min, max, collide=True):
-        joint = pymunk.constraints.RotaryLimitJoint(b, b2, min, max)
-        joint.collide_bodies = collide
-        space.add(joint)
-
-
-class RatchetJoint:
-    def __init__(self, b, b2, phase, ratchet):
-        joint = pymunk.constraints.GearJoint(b, b2, phase, ratchet)
-        space.add(joint)
-
-
-class SimpleMotor:
-    def __init__(self, b, b2, rate):
-        joint = pymunk.constraints.SimpleMotor(b, b2, rate)
-        space.add(joint)
-
-
-class GearJoint:
-    def __init__(self, b, b2, phase, ratio):
-        joint = pymunk.constraints.GearJoint(b, b2, phase, ratio)
-        space.add(joint)
-
-
-class Segment:
-    def __init__(self, p0, v, radius=10):
-        self.body = pymunk.Body()
-        self.body.position = p0
-        shape = pymunk.Segment(self.body, (0, 0), v, radius)
-        shape.density = 0.1
-        shape.elasticity = 0
-        shape.filter = pymunk.ShapeFilter(group=1)
-        shape.color = (0, 255, 0, 0)
-        space.add(self.body, shape)
-
-
-class Circle:
-    def __init__(self, pos, radius=20):
-        self.body = pymunk.Body()
-        self.body.position = pos
-        shape = pymunk.Circle(self.body, radius)
-        shape.density = 0.01
-        shape.friction = 0.5
-        shape.elasticity = 1
-        space.add(self.body, shape)
-
-
-class Box:
-    def __init__(self, p0=(0, 0), p1=(screen_width, screen_height), d=4):
-        x0, y0 = p0
-        x1, y1 = p1
-        pts = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
-        for i in range(4):
-            segment = pymunk.Segment(
-                space.static_body, pts[i], pts[(i+1) % 4], d)
-            segment.elasticity = 1
-            segment.friction = 0.5
-            space.add(segment)
-
-
-class Poly:
-    def __init__(self, pos, vertices):
-        self.body = pymunk.Body(1, 100)
-        self.body.position = pos
-
-        shape = pymunk.Poly(self.body, vertices)
-        shape.filter = pymunk.ShapeFilter(group=1)
-        shape.density = 0.01
-        shape.elasticity = 0.5
-        shape.color = (255, 0, 0, 0)
-        space.add(self.body, shape)
-
-
-class Rectangle:
-    def __init__(self, pos, size=(100, 50), density = 0.0001, body_static = False):
-        if body_static:
-            self.body = pymunk.Body(body_type = pymunk.Body.STATIC)
-        else:
-            self.body = pymunk.Body()
-        self.body.position = pos
-        self.width = size[0]
-        self.height = size[1]
-        self.forceFlag = 0
-        self.counter = 0
-        shape = pymunk.Poly.create_box(self.body, size)
-        shape.density = density
-        shape.elasticity = 0
-        shape.friction = 1
-        space.add(self.body, shape)
-
-
 class App:
-    def __init__(self):
+    def __init__(self, sim, render_fps=60, max_frame_time=0.25):
         pygame.init()
         self.clock = pygame.time.Clock()
         self.screen = pygame.display.set_mode(size)
         self.draw_options = DrawOptions(self.screen)
         self.running = True
         self.images = []
-        self.right_actuator = None
-        self.left_actuator = None
-        self.joints = []
+        self.drag_start = None
+        self.lasso = []
+        self.recorder = None
+        self.capture = None
+        self.program = None
+        self.session = None
+        self.telemetry = None
+        self.checkpoint = None
+        self.profiler = FrameProfiler()
+        self.show_hud = False
+        self.font = None
+        self.stepper = None
+        self.quiescence = None
+        self.renderer = None
+        self.load_sim(sim)
+        self.use_debug_draw = False
+        self.overlay = False
+        # Physics advances by real elapsed time in fixed 1/fps/steps substeps,
+        # independent of how long drawing takes. Frames longer than
+        # max_frame_time are clamped so a stall can't snowball into ever
+        # longer catch-up frames.
+        self.render_fps = render_fps
+        self.max_frame_time = max_frame_time
+        self.accumulator = 0.0
+        self.interpolate = True
+        self.commands = queue.Queue()
+
+    def load_sim(self, sim):
+        # Point the app at another Simulation. Recorders, captures, programs
+        # and sessions attached to the old one are closed.
+        for name in ('recorder', 'capture', 'program', 'session', 'telemetry'):
+            if getattr(self, name) is not None:
+                getattr(self, name).close()
+                setattr(self, name, None)
+        if self.quiescence is not None:
+            self.quiescence.close()
+        self.sim = sim
+        self.rectangles = sim.rectangles
+        self.right_actuator = sim.right_actuator
+        self.left_actuator = sim.left_actuator
+        self.joints = sim.joints
+        flat_joints = [joint for pair in sim.joints for joint in pair]
+        self.joint_index = {id(joint): i for i, joint in enumerate(flat_joints)}
+        self.geometry = LatticeGeometry(sim.rectangles)
+        self.picker = HingePicker(self.geometry, flat_joints)
+        self.quiescence = QuiescenceMonitor(sim)
+        self.quiescence.on_wake = self.log_wake
+        if self.stepper is not None:
+            self.stepper = AdaptiveStepper(sim)
+        view = None if self.renderer is None else (self.renderer.scale, self.renderer.offset)
+        self.renderer = LatticeRenderer(self.screen, sim, self.geometry)
+        if view is not None:
+            self.renderer.set_view(*view)
+        self.dirty = True
+
     def run(self):
+        profiler = self.profiler
+        last = time.perf_counter()
         while self.running:
-            for event in pygame.event.get():
-                self.do_event(event)
-
-            self.draw()
-            self.clock.tick(fps)
-
-            for i in range(steps):
-                # print(self.rectangles[-2].counter)
-                if self.rectangles[-2].forceFlag == 1:
-                    self.rectangles[-2].body.force += ( (0, self.rectangles[-2].counter * -50) )
-                if self.rectangles[-2].forceFlag == 2:
-                    self.rectangles[-2].body.force += ( (0,  (10 - self.rectangles[-2].counter) * 50) )
-                space.step(1/fps/steps)
-
+            profiler.begin('events')
+            waited = self.idle()
+            if waited:
+                # Nothing is moving and the screen is up to date: block until
+                # input arrives instead of spinning at fps.
+                events = [pygame.event.wait(500)] + pygame.event.get()
+            else:
+                events = pygame.event.get()
+            for event in events:
+                if event.type != NOEVENT:
+                    self.post(event)
+            profiler.end('events')
+
+            now = time.perf_counter()
+            if not waited:
+                self.accumulator += min(now - last, self.max_frame_time)
+            last = now
+
+            profiler.begin('step')
+            self.apply_commands()
+            substeps = 0
+            if self.quiescence.should_step() or (self.program is not None and not self.program.done):
+                if self.stepper is None:
+                    substeps = self.advance()
+                else:
+                    # whole fixed substeps only; the remainder waits for
+                    # the next frame like it does for fixed stepping
+                    due = int(self.accumulator * fps * steps) / fps / steps
+                    substeps = self.stepper.advance(due)
+                    self.accumulator -= due
+                    self.renderer.previous = None
+                self.dirty = True
+            else:
+                self.accumulator = 0.0
+                self.renderer.previous = None
+            profiler.end('step')
+
+            profiler.begin('draw')
+            if self.dirty or self.show_hud:
+                self.draw()
+                self.dirty = False
+            profiler.end('draw')
+
+            profiler.begin('tick')
+            self.clock.tick(self.render_fps)
+            profiler.end('tick')
+
+            profiler.end_frame(substeps)
+
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.capture is not None:
+            self.capture.close()
+        if self.session is not None:
+            self.toggle_session()
+        profiler.stop_csv()
         pygame.quit()
 
-    def corner_coord(self, rect, corner):
-        body = rect.body
-        center = body.position
-
-        width = rect.width
-        height = rect.height
-
-        a = width / 2
-        b = height / 2
-
-        angle = body.angle
-
-
-        if corner == BOT_LEFT:
-            x_change = -a * math.cos(angle) - b * math.sin(angle)
-            y_change = -a * math.sin(angle) + b * math.cos(angle)
-            return center + Vec2d(x_change, y_change)
-        elif corner == BOT_RIGHT:
-            x_change = a * math.cos(angle) - b * math.sin(angle)
-            y_change = a * math.sin(angle) + b * math.cos(angle)
-            return center + Vec2d(x_change, y_change)
-        elif corner == TOP_LEFT:
-            x_change = -a * math.cos(angle) + b * math.sin(angle)
-            y_change = -a * math.sin(angle) - b * math.cos(angle)
-            return center + Vec2d(x_change, y_change)
+    def post(self, command):
+        # Thread-safe way in for input: a pygame event or a callable taking
+        # the App. Commands run between substep batches, never mid-step.
+        self.commands.put(command)
+
+    def apply_commands(self):
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            self.dirty = True
+            if callable(command):
+                self.quiescence.wake()
+                command(self)
+                continue
+            if command.type in (KEYDOWN, MOUSEBUTTONUP):
+                self.quiescence.wake()
+            self.do_event(command)
+
+    def advance(self):
+        # Runs every whole substep in the accumulator. The remainder carries
+        # over to the next frame and sets how far the renderer blends from
+        # the pose before the last substep towards the current one.
+        dt = 1/fps/steps
+        n = int(self.accumulator / dt)
+        if n == 0:
+            self.renderer.alpha = self.accumulator / dt
+            return 0
+        for i in range(n - 1):
+            self.sim.step(dt)
+        if self.interpolate:
+            self.geometry.update()
+            self.renderer.previous = (self.geometry.positions.copy(), self.geometry.angles.copy())
         else:
-            x_change = a * math.cos(angle) + b * math.sin(angle)
-            y_change = a * math.sin(angle) - b * math.cos(angle)
-            return center + Vec2d(x_change, y_change)
-
-    def dist(self, p1, p2):
-        return math.sqrt( (p1.x - p2.x) ** 2 + (p1.y - p2.y) ** 2 )
+            self.renderer.previous = None
+        self.sim.step(dt)
+        self.accumulator -= n * dt
+        self.renderer.alpha = self.accumulator / dt
+        return n
 
     def do_event(self, event):
         
@@ -231,181 +205,343 @@ class App:
                 self.running = False
             
             elif event.key == K_RIGHT:
-                self.right_actuator.body.apply_force_at_local_point( (100000, 0) )
-                # orig_x, orig_y = self.right_actuator.body.position
-                # self.right_actuator.body.position = (orig_x + 10, orig_y)
-                # space.reindex_shapes_for_body(self.right_actuator.body)
-            
+                self.input(FORCE, RIGHT, 100000, 0)
+
             elif event.key == K_LEFT:
-                self.right_actuator.body.apply_force_at_local_point( (-100000, 0) )
-                # orig_x, orig_y = self.right_actuator.body.position
-                # self.right_actuator.body.position = (orig_x - 10, orig_y)
-                # space.reindex_shapes_for_body(self.right_actuator.body)
-            
+                self.input(FORCE, RIGHT, -100000, 0)
+
             elif event.key == K_d:
-                self.left_actuator.body.apply_force_at_local_point( (100000, 0) )
-                # orig_x, orig_y = self.right_actuator.body.position
-                # self.right_actuator.body.position = (orig_x + 10, orig_y)
-                # space.reindex_shapes_for_body(self.right_actuator.body)
-            
+                self.input(FORCE, LEFT, 100000, 0)
+
             elif event.key == K_a:
-                self.left_actuator.body.apply_force_at_local_point( (-100000, 0) )
-                # orig_x, orig_y = self.right_actuator.body.position
-                # self.right_actuator.body.position = (orig_x - 10, orig_y)
-                # space.reindex_shapes_for_body(self.right_actuator.body)
-            
-            elif event.key == K_b:
-                self.rectangles[-2].forceFlag = 0
+                self.input(FORCE, LEFT, -100000, 0)
 
-            elif event.key == K_UP:
-                # self.rectangles[-2].body.apply_force_at_local_point( (0, -100000) )
-                self.rectangles[-2].forceFlag = 1
-                if self.rectangles[-2].counter < 10:
-                    self.rectangles[-2].counter += 1
-            
-            elif event.key == K_DOWN:
-                # self.rectangles[-2].body.apply_force_at_local_point( (0, 100000) )
-                self.rectangles[-2].forceFlag = 2
-                if self.rectangles[-2].counter > 0:
-                    self.rectangles[-2].counter -= 1
-            
-            elif event.key == K_w:
-                # self.rectangles[-2].body.apply_force_at_local_point( (0, -100000) )
-                self.rectangles[-2].forceFlag = 1
-                if self.rectangles[-2].counter < 10:
-                    self.rectangles[-2].counter += 1
-            
-            elif event.key == K_s:
-                # self.rectangles[-2].body.apply_force_at_local_point( (0, 100000) )
-                self.rectangles[-2].forceFlag = 2
-                if self.rectangles[-2].counter > 0:
-                    self.rectangles[-2].counter -= 1
+            elif event.key == K_r:
+                self.toggle_recording()
 
-        if event.type == pygame.MOUSEBUTTONUP:
-            pos = pygame.mouse.get_pos()
-            print(pos, type(pos))
-
-            joint1, joint2 = self.joints[0]
-
-
-            for i in range(len(self.rectangles)):
-                for corner_option in [BOT_LEFT, BOT_RIGHT, TOP_LEFT, TOP_RIGHT]:
-                    corner = self.corner_coord(self.rectangles[i], corner_option)
-                    if (self.dist(corner, Vec2d(pos[0], pos[1])) < 20):
-                        
-                        if corner_option == BOT_LEFT:
-                            cur_joint = self.joints[i - 1][0]
-                            opposing_joint = self.joints[i - 1][1]
-                            # print("switched BOT_LEFT")
-                        elif corner_option == TOP_LEFT:
-                            cur_joint = self.joints[i - 1][1]
-                            opposing_joint = self.joints[i - 1][0]
-                            # print("switched TOP_LEFT")
-                        elif corner_option == BOT_RIGHT:
-                            cur_joint = self.joints[i][0]
-                            opposing_joint = self.joints[i][1]
-                            # print("switched BOT_RIGHT")
-                        else:
-                            cur_joint = self.joints[i][1]
-                            opposing_joint = self.joints[i][0]
-                            # print("switched TOP_RIGHT")
-                        
-                        cur_joint.switch_constrain()
-
-                        return
-            
+            elif event.key == K_p:
+                self.toggle_capture()
 
+            elif event.key == K_l:
+                self.toggle_session()
 
-    def draw(self):
-        self.screen.fill(GRAY)
-        space.debug_draw(self.draw_options)
-        for i in range(len(self.joints)):
-            joint1, joint2 = self.joints[i]
-            if (joint1.is_constrained()):
-                coord1 = self.corner_coord(joint1.left_rect, BOT_RIGHT)
-                pygame.draw.circle(self.screen, (0, 0, 0), coord1, 10)
+            elif event.key == K_e:
+                self.settle()
 
-            if (joint2.is_constrained()):
-                coord2 = self.corner_coord(joint2.left_rect, TOP_RIGHT)
-                pygame.draw.circle(self.screen, (0, 0, 0), coord2, 10)
-                
-        
-        pygame.display.update()
+            elif event.key == K_j:
+                self.toggle_telemetry()
 
-def horizontal_mode():
-    # Box()
-    a = App()
+            elif event.key == K_n:
+                path = time.strftime('scene_%Y%m%d_%H%M%S.json')
+                save_scene(self.sim, path)
+                print('scene saved to', path)
 
-    rectangles = []
-    joints = []
+            elif event.key == K_o:
+                path = time.strftime('target_%Y%m%d_%H%M%S.json')
+                write_target(self.sim, path)
+                print('cell positions saved to', path, 'as an optimise.py target')
 
-    actuator_width = 500
+            elif event.key == K_c:
+                self.checkpoint = Checkpoint.take(self.sim)
+                self.checkpoint.save('checkpoint.npz')
+                if self.session is not None:
+                    self.session.log(CHECKPOINT)
+                print('checkpoint at t=%.2fs saved to checkpoint.npz' % self.checkpoint.time)
 
-    # rectangle_widths = [50, 200, 50, 200]
-    # rectangle_widths = [200, 50, 200, 50]
-    rectangle_widths = [50 for i in range(14)]
-    rectangle_widths.append(actuator_width)
-    rectangle_widths.insert(0, actuator_width)
-    rectangle_height = 50
+            elif event.key == K_x:
+                if self.checkpoint is not None:
+                    if self.session is not None:
+                        self.session.log(RESTORE)
+                    self.checkpoint.restore(self.sim)
 
-    starting_x = 10
-    starting_y = 400
+            elif event.key == K_h:
+                self.show_hud = not self.show_hud
 
-    start_rect_center = Vec2d(starting_x, starting_y)
-    left_actuator = Rectangle(start_rect_center, size = (rectangle_widths[0], rectangle_height))
+            elif event.key == K_t:
+                if self.profiler.csv_file is None:
+                    path = time.strftime('timings_%Y%m%d_%H%M%S.csv')
+                    self.profiler.start_csv(path)
+                    print('writing frame timings to', path)
+                else:
+                    self.profiler.stop_csv()
 
-    up_block = Rectangle( left_actuator.body.position + (50, -(rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
-    down_block = Rectangle( left_actuator.body.position + (50, (rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
-    
-    
+            elif event.key == K_g:
+                if self.stepper is None:
+                    self.stepper = AdaptiveStepper(self.sim)
+                    print('adaptive stepping on')
+                else:
+                    print('adaptive stepping off', self.stepper.stats())
+                    self.stepper = None
 
-    # start_rect_bot_left = (-start_rect.width // 2, start_rect.height // 2 + 5)
-    # SlideJoint(start_rect.body, static_body, start_rect_bot_left, start_rect_center + start_rect_bot_left)
+            elif event.key == K_v:
+                self.use_debug_draw = not self.use_debug_draw
+                self.renderer.invalidate()
 
-    rectangles.append(left_actuator)
+            elif event.key == K_f:
+                self.renderer.fit()
 
-    left_rect = None
-    right_rect = None
-    left_rect_center = None
-    right_rect_center = None
+            elif event.key == K_i:
+                self.interpolate = not self.interpolate
 
+            elif event.key in (K_EQUALS, K_PLUS):
+                self.renderer.zoom(1.25)
 
-    for i in range(len(rectangle_widths) - 1):
-        left_rect = rectangles[-1]
-        left_rect_center = left_rect.body.position
-        left_rect_right_bot = (left_rect.width // 2, left_rect.height // 2 + 5)
+            elif event.key == K_MINUS:
+                self.renderer.zoom(0.8)
 
-        right_rect_center = left_rect_center + (left_rect.width // 2 + rectangle_widths[i + 1] // 2, 0)
-        right_rect = Rectangle(right_rect_center, size = (rectangle_widths[i + 1], rectangle_height))
-        right_rect_bot_left = Vec2d(-right_rect.width // 2, right_rect.height // 2 + 5)
+            elif event.key == K_b:
+                self.force_rect_input(0, 0)
 
+            elif event.key in (K_UP, K_w):
+                self.force_rect_input(1, 1)
 
-        valley = Vec2d(0, - rectangle_height - 10)
-        joint1 = SlideJoint(left_rect.body, right_rect.body, a = left_rect_right_bot, a2 = right_rect_bot_left, left_rect = left_rect, right_rect = right_rect)
-        joint2 = SlideJoint(left_rect.body, right_rect.body, a = left_rect_right_bot + valley, a2 = right_rect_bot_left + valley, min = 0, max = 50, left_rect = left_rect, right_rect = right_rect)
-        joints.append( (joint1, joint2) )
-        rectangles.append(right_rect)
+            elif event.key in (K_DOWN, K_s):
+                self.force_rect_input(2, -1)
 
-    
-    right_actuator = rectangles[-1]
+        if event.type == pygame.MOUSEBUTTONDOWN:
+            self.drag_start = pygame.mouse.get_pos()
+            self.lasso = [self.drag_start]
 
-    up_block = Rectangle( right_actuator.body.position + (50, -(rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
-    down_block = Rectangle( right_actuator.body.position + (50, (rectangle_height // 2 + 25)), size = (50, 50), body_static = True)
+        if event.type == pygame.MOUSEMOTION and self.drag_start is not None:
+            self.lasso.append(pygame.mouse.get_pos())
 
-    (right_actuator_left_joint, right_actuator_right_joint) =  joints[-1]
-    (left_actuator_left_joint, left_actuator_right_joint) = joints[0]
+        if event.type == pygame.MOUSEBUTTONUP:
+            pos = pygame.mouse.get_pos()
 
-    left_actuator_left_joint.switch_constrain()
-    left_actuator_right_joint.switch_constrain()
+            start = self.drag_start if self.drag_start is not None else pos
+            self.drag_start = None
+
+            self.geometry.update()
+            self.picker.update()
+            to_world = self.renderer.to_world
+
+            if abs(pos[0] - start[0]) + abs(pos[1] - start[1]) < 5:
+                cur_joint = self.picker.pick(to_world(pos), 20 / self.renderer.scale)
+                if cur_joint is not None:
+                    self.input(TOGGLE, self.joint_index[id(cur_joint)])
+                return
+
+            # dragging toggles every hinge in the box, or in the lasso with shift held
+            if pygame.key.get_mods() & KMOD_SHIFT:
+                selected = self.picker.in_lasso([to_world(p) for p in self.lasso + [pos]])
+            else:
+                selected = self.picker.in_box(to_world(start), to_world(pos))
+            for cur_joint in selected:
+                self.input(TOGGLE, self.joint_index[id(cur_joint)])
+
+    def input(self, action, target=0, x=0.0, y=0.0):
+        # Every input that changes the simulation goes through here so an
+        # active session can log it.
+        if not apply_input(self.sim, action, target, x, y):
+            print('input ignored: this lattice has no %s' % ('force rectangle' if action == FORCE_RECT else 'actuators'))
+            return
+        if self.session is not None:
+            self.session.log(action, target, x, y)
+
+    def force_rect_input(self, flag, change):
+        # B/W/S: set force_rect's forceFlag and step its counter within 0..10
+        rect = self.sim.force_rect
+        if rect is None:
+            print('input ignored: this lattice has no force rectangle')
+            return
+        self.input(FORCE_RECT, 0, flag, min(max(rect.counter + change, 0), 10))
+
+    def log_wake(self):
+        if self.session is not None:
+            self.session.log(WAKE)
+
+    def settle(self):
+        # Jump straight to the equilibrium of the current configuration.
+        if self.session is not None:
+            print('not settling while logging a session; the log could not replay it')
+            return
+        diagnostics = relax(self.sim)
+        self.renderer.previous = None
+        print('%s after %.2fs simulated in %.1f ms (last window drift %.2f px, joint error %.2f px)' % (
+            'settled' if diagnostics['converged'] else 'not settled', diagnostics['simulated_time'],
+            diagnostics['wall_time'] * 1e3, diagnostics['drift'], diagnostics['violation']))
+
+    def load_configuration(self, path):
+        # Start over from a configuration file such as optimise.py's best.json
+        # and jump to its equilibrium, found by the solver it names (the one
+        # the optimiser scored it with) or by relax() if it names none.
+        with open(path) as f:
+            configuration = json.load(f)
+        self.load_sim(build_design(configuration.get('design', {}), configuration['mask'],
+                                   configuration.get('actuation')))
+        print('loaded hinge mask', configuration['mask'], 'from', path)
+        if configuration.get('solver') is None:
+            self.settle()
+            return
+        limits = {} if configuration.get('max_time') is None else {'max_time': configuration['max_time']}
+        pose, metrics = solver_by_name(configuration['solver'])(self.sim, **limits)
+        self.renderer.previous = None
+        settled = metrics['converged'] if 'converged' in metrics else metrics['settled']
+        print('%s by %s after %.2fs simulated in %.1f ms' % ('settled' if settled else 'not settled',
+                                                            configuration['solver'], metrics['simulated_time'],
+                                                            metrics['wall_time'] * 1e3))
+
+    def toggle_session(self):
+        if self.session is None:
+            # Continue on a fresh copy made from the session's own blueprint,
+            # which is what the replay will start from too. That swaps the
+            # simulation, which would end whatever is attached to the old one,
+            # and actuation programs aren't logged, so neither is allowed.
+            if self.program is not None and self.program.done:
+                self.program.close()
+                self.program = None
+            running = [name for name, attached in (('trajectory recording', self.recorder),
+                                                   ('frame capture', self.capture),
+                                                   ('joint telemetry', self.telemetry),
+                                                   ('actuation program', self.program)) if attached is not None]
+            if running:
+                print('not logging a session while the %s is running; stop it first' % ' and '.join(running))
+                return
+            start = Checkpoint.take(self.sim)
+            self.load_sim(start.instantiate())
+            path = time.strftime('session_%Y%m%d_%H%M%S.npz')
+            self.session = SessionRecorder(self.sim, path, start, self.checkpoint)
+            print('logging inputs to', path)
+        else:
+            self.session.close()
+            print('logged', len(self.session.records), 'inputs to', self.session.path)
+            self.session = None
+
+    def idle(self):
+        return self.quiescence.settled and not self.dirty and not self.show_hud and self.drag_start is None
+
+    def toggle_telemetry(self):
+        # Joint load collection and its heat map; the summary is saved when
+        # it stops.
+        if self.telemetry is None:
+            self.telemetry = JointTelemetry(self.sim)
+            print('collecting joint loads')
+        else:
+            path = time.strftime('joint_loads_%Y%m%d_%H%M%S.json')
+            summary = self.telemetry.save(path)
+            self.telemetry.close()
+            self.telemetry = None
+            print('max joint force %.1f (joint %s), %d samples over the limit; summary saved to %s' % (
+                summary['max_force'], summary['max_joint'], summary['exceedances'], path))
+
+    def toggle_recording(self):
+        if self.recorder is None:
+            path = time.strftime('trajectory_%Y%m%d_%H%M%S')
+            self.recorder = TrajectoryRecorder(self.sim, path, every=steps)
+            print('recording to', path)
+        else:
+            self.recorder.close()
+            print('recorded', self.recorder.frames, 'frames to', self.recorder.path)
+            self.recorder = None
+
+    def run_program(self, program):
+        # Replaces any running program; schedule times count from now.
+        if self.session is not None:
+            print('not running an actuation program while logging a session; the log could not replay it')
+            return
+        if self.program is not None:
+            self.program.close()
+        self.program = program.compile(self.sim).attach()
+        self.quiescence.wake()
+        print('running actuation program for %.2fs' % program.duration)
+
+    def toggle_capture(self):
+        if self.capture is None:
+            path = time.strftime('frames_%Y%m%d_%H%M%S')
+            self.capture = FrameCapture(self.sim, path, every=steps, frame_size=self.screen.get_size(),
+                                        view=(self.renderer.scale, self.renderer.offset))
+            print('capturing frames to', path)
+        else:
+            self.capture.close()
+            print('captured', self.capture.frames, 'frames to', self.capture.path)
+            self.capture = None
 
-    right_actuator_left_joint.switch_constrain()
-    right_actuator_right_joint.switch_constrain()
-    
-    a.right_actuator = right_actuator
-    a.left_actuator = left_actuator
-    a.rectangles = rectangles
-    a.joints = joints
+    def draw(self):
+        if self.use_debug_draw:
+            self.debug_draw()
+            return
+
+        # The renderer only repaints what moved, so anything drawn over the
+        # lattice (drag outline, HUD, joint heat map) forces a full repaint, and so does the
+        # first frame after it goes away.
+        overlay = (self.show_hud or self.telemetry is not None
+                   or (self.drag_start is not None and len(self.lasso) > 1))
+        if overlay or self.overlay:
+            self.renderer.full_redraw = True
+        self.overlay = overlay
+        if not overlay:
+            self.renderer.draw()
+            return
+
+        self.renderer.draw(update_display=False)
+        self.draw_overlay()
+        pygame.display.update()
+
+    def debug_draw(self):
+        self.screen.fill(GRAY)
+        self.sim.space.debug_draw(self.draw_options)
+        self.geometry.update()
+        for i in range(len(self.joints)):
+            joint1, joint2 = self.joints[i]
+            if (joint1.is_constrained()):
+                coord1 = self.geometry.corner(joint1.left_rect, joint1.corner)
+                pygame.draw.circle(self.screen, (0, 0, 0), coord1, 10)
+
+            if (joint2.is_constrained()):
+                coord2 = self.geometry.corner(joint2.left_rect, joint2.corner)
+                pygame.draw.circle(self.screen, (0, 0, 0), coord2, 10)
+
+        self.draw_overlay()
+        pygame.display.update()
+
+    def draw_overlay(self):
+        if self.telemetry is not None:
+            self.renderer.draw_joint_values(self.telemetry.heat())
+
+        if self.drag_start is not None and len(self.lasso) > 1:
+            if pygame.key.get_mods() & KMOD_SHIFT:
+                pygame.draw.lines(self.screen, BLACK, True, self.lasso, 1)
+            else:
+                x0, y0 = self.drag_start
+                x1, y1 = self.lasso[-1]
+                pygame.draw.rect(self.screen, BLACK, (min(x0, x1), min(y0, y1), abs(x1 - x0), abs(y1 - y0)), 1)
+
+        if self.show_hud:
+            self.draw_hud()
+
+    def draw_hud(self):
+        if self.font is None:
+            self.font = pygame.font.Font(None, 22)
+        stats = self.profiler.summary()
+        lines = [
+            '%.1f fps   %.0f substeps/s   physics %.2fx realtime' % (stats['fps'], stats['substeps_per_sec'],
+                                                                 stats['substeps_per_sec'] / (fps * steps)),
+            '%d bodies   %d constraints' % (len(self.sim.space.bodies), len(self.sim.space.constraints)),
+            'render: %s' % ('debug_draw' if self.use_debug_draw else
+                            '%s lod, %d cells redrawn' % (self.renderer.lod(), self.renderer.cells_drawn)),
+        ]
+        for phase in self.profiler.phases:
+            lines.append('%-6s %6.2f ms  (p95 %6.2f)' % (phase, stats[phase + '_ms'], stats[phase + '_p95_ms']))
+        if self.profiler.csv_file is not None:
+            lines.append('writing ' + self.profiler.csv_file.name)
+        for i, line in enumerate(lines):
+            self.screen.blit(self.font.render(line, True, BLACK), (10, 10 + 18 * i))
+
+def horizontal_mode(program=None, configuration=None, scene=None):
+    # Box()
+    sim = build_horizontal_lattice() if scene is None else load_scene(scene)
+    a = App(sim)
+    if configuration is not None:
+        a.load_configuration(configuration)
+    if program is not None:
+        a.run_program(ActuationProgram.load(program))
     a.run()
 
 if __name__ == '__main__':
-    horizontal_mode()
+    parser = argparse.ArgumentParser(description='Interactive horizontal lattice.')
+    parser.add_argument('program', nargs='?', help='actuation program (JSON) to run from the start')
+    parser.add_argument('--scene', metavar='FILE', help='start from a scene file (see scene.py) instead')
+    parser.add_argument('--configuration', metavar='FILE',
+                        help='start from a hinge configuration such as the best.json written by optimise.py')
+    args = parser.parse_args()
+    horizontal_mode(args.program, args.configuration, args.scene)
\ No newline at end of file
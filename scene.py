@@ -0,0 +1,400 @@
+import argparse
+import collections
+import gc
+import hashlib
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from lattice import *
+
+# A scene file (JSON, or TOML with a .toml extension) describes a lattice
+# without code:
+#
+#   {"version": 1,
+#    "gravity": [0, 10],
+#    "defaults": {"size": [50, 50], "density": 0.0001, "free_max": 50},
+#    "cells": [{"position": [10, 400], "size": [500, 50]}, {"position": [285, 400]}, ...],
+#    "fixtures": [{"position": [60, 350], "size": [50, 50]}, ...],
+#    "pairs": [{"cells": [0, 1],
+#               "joints": [{"anchor_a": [250, 30], "anchor_b": [-25, 30], "corner": "BOT_RIGHT"},
+#                          {"anchor_a": [250, -30], "anchor_b": [-25, -30], "corner": "TOP_RIGHT",
+#                           "locked": false}]},
+#               ...],
+#    "actuators": {"left": 0, "right": 15, "force": 14, "force_flag": 0, "counter": 0}}
+#
+# Cells are the dynamic rectangles (sim.rectangles, in order), fixtures the
+# static blocks. A fixture is added to the space after the first `after`
+# cells (default: after all of them); Chipmunk's results depend on that
+# order, and matching it makes a scene step exactly like the code that
+# built it. Every pair links two cells with two SlideJoints, bottom
+# hinge first. A locked hinge has max 0, a free one max free_max, and
+# corner is where its marker is drawn on the first cell. Any cell or joint
+# field left out comes from "defaults", then from DEFAULTS.
+
+SCENE_VERSION = 1
+# part of the cache file name; bump it when the compiled arrays change
+COMPILED_VERSION = 1
+
+CORNERS = {'BOT_LEFT': BOT_LEFT, 'BOT_RIGHT': BOT_RIGHT, 'TOP_LEFT': TOP_LEFT, 'TOP_RIGHT': TOP_RIGHT}
+CORNER_NAMES = {value: name for name, value in CORNERS.items()}
+
+DEFAULTS = {'size': [50, 50], 'angle': 0, 'density': 0.0001, 'min': 0, 'free_max': 50, 'locked': True,
+            'corner': 'BOT_RIGHT'}
+CELL_FIELDS = ('position', 'size', 'angle', 'density')
+FIXTURE_FIELDS = ('position', 'size', 'angle', 'after')
+JOINT_FIELDS = ('anchor_a', 'anchor_b', 'min', 'free_max', 'locked', 'corner')
+ACTUATOR_FIELDS = ('left', 'right', 'force', 'force_flag', 'counter')
+
+
+# validation
+
+def _fields(item, where, allowed, defaults=None):
+    if not isinstance(item, dict):
+        raise ValueError('%s: expected an object, got %r' % (where, item))
+    unknown = set(item) - set(allowed)
+    if unknown:
+        raise ValueError('%s: unknown field(s) %s' % (where, ', '.join(sorted(unknown))))
+    merged = {name: defaults[name] for name in allowed if defaults and name in defaults}
+    merged.update(item)
+    return merged
+
+
+def _require(item, name, where):
+    if name not in item:
+        raise ValueError('%s: missing %r' % (where, name))
+    return item[name]
+
+
+def _number(value, where, positive=False, minimum=None):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not np.isfinite(value):
+        raise ValueError('%s: expected a number, got %r' % (where, value))
+    if positive and value <= 0:
+        raise ValueError('%s: must be positive, got %r' % (where, value))
+    if minimum is not None and value < minimum:
+        raise ValueError('%s: must be at least %r, got %r' % (where, minimum, value))
+    return float(value)
+
+
+def _vector(value, where, positive=False):
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError('%s: expected [x, y], got %r' % (where, value))
+    return [_number(v, where, positive) for v in value]
+
+
+def _index(value, where, count):
+    if isinstance(value, bool) or not isinstance(value, int) or not 0 <= value < count:
+        raise ValueError('%s: expected a cell index below %d, got %r' % (where, count, value))
+    return value
+
+
+def _list(scene, name, required=False):
+    items = scene.get(name, [])
+    if not isinstance(items, list) or (required and not items):
+        raise ValueError('%s: expected a %slist' % (name, 'non-empty ' if required else ''))
+    return items
+
+
+def compile_scene(scene):
+    # Validate a parsed scene -> dict of flat arrays for instantiate(). All
+    # errors are ValueErrors naming the offending entry, e.g.
+    # "pairs[3].joints[1].free_max: must be positive".
+    fields = _fields(scene, 'scene', ('version', 'gravity', 'defaults', 'cells', 'fixtures', 'pairs', 'actuators'))
+    if fields.get('version', SCENE_VERSION) != SCENE_VERSION:
+        raise ValueError('scene: unsupported version %r, expected %d' % (fields['version'], SCENE_VERSION))
+    defaults = dict(DEFAULTS)
+    defaults.update(_fields(fields.get('defaults', {}), 'defaults', tuple(DEFAULTS)))
+
+    cells = _list(fields, 'cells', required=True)
+    position, size, angle, density = [], [], [], []
+    for i, cell in enumerate(cells):
+        where = 'cells[%d]' % i
+        cell = _fields(cell, where, CELL_FIELDS, defaults)
+        position.append(_vector(_require(cell, 'position', where), where + '.position'))
+        size.append(_vector(cell['size'], where + '.size', positive=True))
+        angle.append(_number(cell['angle'], where + '.angle'))
+        density.append(_number(cell['density'], where + '.density', positive=True))
+
+    fixture_position, fixture_size, fixture_angle, fixture_after = [], [], [], []
+    for i, fixture in enumerate(_list(fields, 'fixtures')):
+        where = 'fixtures[%d]' % i
+        fixture = _fields(fixture, where, FIXTURE_FIELDS, defaults)
+        fixture_position.append(_vector(_require(fixture, 'position', where), where + '.position'))
+        fixture_size.append(_vector(fixture['size'], where + '.size', positive=True))
+        fixture_angle.append(_number(fixture['angle'], where + '.angle'))
+        after = fixture.get('after', len(cells))
+        if isinstance(after, bool) or not isinstance(after, int) or not 0 <= after <= len(cells):
+            raise ValueError('%s.after: expected a cell count up to %d, got %r' % (where, len(cells), after))
+        fixture_after.append(after)
+
+    pair_cells, anchor_a, anchor_b, joint_min, free_max, locked, corner = [], [], [], [], [], [], []
+    for i, pair in enumerate(_list(fields, 'pairs')):
+        where = 'pairs[%d]' % i
+        pair = _fields(pair, where, ('cells', 'joints'))
+        linked = _require(pair, 'cells', where)
+        if not isinstance(linked, list) or len(linked) != 2:
+            raise ValueError('%s.cells: expected [first, second], got %r' % (where, linked))
+        first, second = (_index(c, where + '.cells', len(cells)) for c in linked)
+        if first == second:
+            raise ValueError('%s.cells: a cell cannot be linked to itself' % where)
+        pair_cells.append((first, second))
+        joints = _require(pair, 'joints', where)
+        if not isinstance(joints, list) or len(joints) != 2:
+            raise ValueError('%s.joints: expected two joints (bottom, top)' % where)
+        for k, joint in enumerate(joints):
+            at = '%s.joints[%d]' % (where, k)
+            joint = _fields(joint, at, JOINT_FIELDS, defaults)
+            anchor_a.append(_vector(_require(joint, 'anchor_a', at), at + '.anchor_a'))
+            anchor_b.append(_vector(_require(joint, 'anchor_b', at), at + '.anchor_b'))
+            joint_min.append(_number(joint['min'], at + '.min', minimum=0))
+            free_max.append(_number(joint['free_max'], at + '.free_max', positive=True))
+            if not isinstance(joint['locked'], bool):
+                raise ValueError('%s.locked: expected true or false, got %r' % (at, joint['locked']))
+            locked.append(joint['locked'])
+            if joint['corner'] not in CORNERS:
+                raise ValueError('%s.corner: expected one of %s, got %r' % (at, ', '.join(CORNERS), joint['corner']))
+            corner.append(CORNERS[joint['corner']])
+            if joint_min[-1] > free_max[-1]:
+                raise ValueError('%s: min is larger than free_max' % at)
+
+    actuators = _fields(fields.get('actuators', {}), 'actuators', ACTUATOR_FIELDS)
+    roles = [_index(actuators[name], 'actuators.' + name, len(cells)) if name in actuators else -1
+             for name in ('left', 'right', 'force')]
+    actuation = []
+    for name in ('force_flag', 'counter'):
+        value = actuators.get(name, 0)
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError('actuators.%s: expected an integer, got %r' % (name, value))
+        actuation.append(value)
+
+    return {
+        'gravity': np.array(_vector(fields.get('gravity', [0, 10]), 'gravity'), dtype=float),
+        'cell_position': np.array(position, dtype=float).reshape(-1, 2),
+        'cell_size': np.array(size, dtype=float).reshape(-1, 2),
+        'cell_angle': np.array(angle, dtype=float),
+        'cell_density': np.array(density, dtype=float),
+        'fixture_position': np.array(fixture_position, dtype=float).reshape(-1, 2),
+        'fixture_size': np.array(fixture_size, dtype=float).reshape(-1, 2),
+        'fixture_angle': np.array(fixture_angle, dtype=float),
+        'fixture_after': np.array(fixture_after, dtype=np.int32),
+        'pair_cells': np.array(pair_cells, dtype=np.int32).reshape(-1, 2),
+        'joint_anchor_a': np.array(anchor_a, dtype=float).reshape(-1, 2),
+        'joint_anchor_b': np.array(anchor_b, dtype=float).reshape(-1, 2),
+        'joint_min': np.array(joint_min, dtype=float),
+        'joint_free_max': np.array(free_max, dtype=float),
+        'joint_locked': np.array(locked, dtype=bool),
+        'joint_corner': np.array(corner, dtype=np.int8),
+        'actuators': np.array(roles, dtype=np.int32),
+        'actuation': np.array(actuation, dtype=np.int64),
+    }
+
+
+# loading
+
+def parse_scene(data, path=''):
+    # bytes of a scene file -> the scene dict
+    if path.endswith('.toml'):
+        try:
+            import tomllib
+        except ImportError:
+            # Python < 3.11: the same parser is on PyPI as tomli
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ImportError('%s: TOML scenes need Python 3.11+ or the tomli package '
+                                  '(pip install tomli); JSON scenes work everywhere' % path) from None
+        return tomllib.loads(data.decode('utf-8'))
+    return json.loads(data)
+
+
+def compiled_scene(path, cache_dir=None):
+    # Compiled arrays for a scene file. They are cached as
+    # <cache_dir>/<sha1 of the file>-<COMPILED_VERSION>.npz (cache_dir
+    # defaults to .scene_cache next to the file), so an unchanged file is
+    # parsed and validated once, whichever process loads it first.
+    with open(path, 'rb') as f:
+        data = f.read()
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.scene_cache')
+    cached = os.path.join(cache_dir, '%s-%d.npz' % (hashlib.sha1(data).hexdigest(), COMPILED_VERSION))
+    if os.path.exists(cached):
+        with np.load(cached) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+    compiled = compile_scene(parse_scene(data, path))
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = '%s.%d.tmp.npz' % (cached[:-4], os.getpid())
+    np.savez(tmp, **compiled)
+    os.replace(tmp, cached)
+    return compiled
+
+
+def instantiate(compiled, sim=None):
+    # Build a Simulation from compiled arrays. As in generator.py, every body,
+    # shape and constraint is created detached and added in one space.add
+    # call, with the cyclic collector paused.
+    if sim is None:
+        sim = Simulation(gravity=tuple(compiled['gravity'].tolist()))
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        rectangles = [Rectangle(sim, tuple(position), size=tuple(size), density=density, add=False)
+                      for position, size, density in zip(compiled['cell_position'].tolist(),
+                                                         compiled['cell_size'].tolist(),
+                                                         compiled['cell_density'].tolist())]
+        blocks = [Rectangle(sim, tuple(position), size=tuple(size), body_static=True, add=False)
+                  for position, size in zip(compiled['fixture_position'].tolist(), compiled['fixture_size'].tolist())]
+        for rect, angle in zip(rectangles + blocks, compiled['cell_angle'].tolist() + compiled['fixture_angle'].tolist()):
+            if angle:
+                rect.body.angle = angle
+
+        joints = []
+        constraints = []
+        flat = zip(compiled['joint_anchor_a'].tolist(), compiled['joint_anchor_b'].tolist(),
+                   compiled['joint_min'].tolist(), compiled['joint_free_max'].tolist(),
+                   compiled['joint_locked'].tolist(), compiled['joint_corner'].tolist())
+        for i, j in compiled['pair_cells'].tolist():
+            left_rect, right_rect = rectangles[i], rectangles[j]
+            pair = []
+            for k in range(2):
+                a, a2, low, free_max, locked, corner = next(flat)
+                joint = SlideJoint(sim, left_rect.body, right_rect.body, a=tuple(a), a2=tuple(a2), min=low,
+                                   max=0 if locked else free_max, left_rect=left_rect, right_rect=right_rect,
+                                   free_max=free_max, corner=corner, add=False)
+                pair.append(joint)
+                constraints.append(joint.joint)
+            joints.append(tuple(pair))
+
+        slots = [[] for i in range(len(rectangles) + 1)]
+        for after, block in zip(compiled['fixture_after'].tolist(), blocks):
+            slots[after].append(block)
+        ordered = slots[0] + [rect for cell, slot in zip(rectangles, slots[1:]) for rect in [cell] + slot]
+        sim.space.add(*itertools.chain.from_iterable((rect.body, rect.shape) for rect in ordered), *constraints)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    sim.rectangles.extend(rectangles)
+    sim.blocks.extend(blocks)
+    sim.joints.extend(joints)
+    left, right, force = compiled['actuators'].tolist()
+    sim.left_actuator = rectangles[left] if left >= 0 else None
+    sim.right_actuator = rectangles[right] if right >= 0 else None
+    sim.force_rect = rectangles[force] if force >= 0 else None
+    if sim.force_rect is not None:
+        sim.force_rect.forceFlag, sim.force_rect.counter = compiled['actuation'].tolist()
+    return sim
+
+
+def load_scene(path, cache_dir=None, sim=None):
+    return instantiate(compiled_scene(path, cache_dir), sim)
+
+
+# exporting
+
+def _common(values):
+    return collections.Counter(json.dumps(value) for value in values).most_common(1)[0][0]
+
+
+def scene_from_sim(sim):
+    # The current pose, hinge states and actuation of a lattice as a scene
+    # dict. Values shared by most cells or joints go to "defaults" and are
+    # left out of the entries themselves.
+    index = {id(rect): i for i, rect in enumerate(sim.rectangles)}
+    cells = [{'position': list(rect.body.position), 'size': [rect.width, rect.height], 'angle': rect.body.angle,
+              'density': rect.shape.density} for rect in sim.rectangles]
+    fixtures = [{'position': list(rect.body.position), 'size': [rect.width, rect.height], 'angle': rect.body.angle}
+                for rect in sim.blocks]
+    # how many cells were added to the space before each fixture
+    cell_bodies = {id(rect.body) for rect in sim.rectangles}
+    cells_added = {}
+    count = 0
+    for body in sim.space.bodies:
+        cells_added[id(body)] = count
+        count += id(body) in cell_bodies
+    for fixture, rect in zip(fixtures, sim.blocks):
+        after = cells_added.get(id(rect.body), len(cells))
+        if after != len(cells):
+            fixture['after'] = after
+    pairs = []
+    for p, pair in enumerate(sim.joints):
+        if id(pair[0].left_rect) not in index or id(pair[0].right_rect) not in index:
+            raise ValueError('joint pair %d does not link two cells of sim.rectangles' % p)
+        pairs.append({
+            'cells': [index[id(pair[0].left_rect)], index[id(pair[0].right_rect)]],
+            'joints': [{'anchor_a': list(joint.joint.anchor_a), 'anchor_b': list(joint.joint.anchor_b),
+                        'min': joint.joint.min, 'free_max': joint.free_max, 'locked': joint.is_constrained(),
+                        'corner': CORNER_NAMES[joint.corner]} for joint in pair],
+        })
+
+    joints = [joint for pair in pairs for joint in pair['joints']]
+    defaults = {}
+    for name, items in (('size', cells + fixtures), ('angle', cells + fixtures), ('density', cells),
+                        ('min', joints), ('free_max', joints), ('locked', joints), ('corner', joints)):
+        if items:
+            defaults[name] = json.loads(_common(item[name] for item in items))
+            for item in items:
+                if item[name] == defaults[name]:
+                    del item[name]
+
+    actuators = {}
+    for name, rect in (('left', sim.left_actuator), ('right', sim.right_actuator), ('force', sim.force_rect)):
+        if rect is not None:
+            actuators[name] = index[id(rect)]
+    if sim.force_rect is not None:
+        actuators['force_flag'] = sim.force_rect.forceFlag
+        actuators['counter'] = sim.force_rect.counter
+    return {'version': SCENE_VERSION, 'gravity': list(sim.space.gravity), 'defaults': defaults, 'cells': cells,
+            'fixtures': fixtures, 'pairs': pairs, 'actuators': actuators}
+
+
+def _dump(scene):
+    # JSON with one cell, fixture or pair per line
+    lines = []
+    for key, value in scene.items():
+        if isinstance(value, list) and value and isinstance(value[0], dict):
+            items = ',\n  '.join(json.dumps(item) for item in value)
+            lines.append(' %s: [\n  %s\n ]' % (json.dumps(key), items))
+        else:
+            lines.append(' %s: %s' % (json.dumps(key), json.dumps(value)))
+    return '{\n%s\n}\n' % ',\n'.join(lines)
+
+
+def save_scene(sim, path):
+    scene = scene_from_sim(sim)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(_dump(scene))
+    os.replace(tmp, path)
+    return scene
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load a lattice scene file and time parsing, caching and building.')
+    parser.add_argument('scene', help='JSON or TOML scene file')
+    parser.add_argument('--write', choices=('horizontal', 'grid'),
+                        help='first write the file from horizontal_mode or a generator.py grid')
+    parser.add_argument('--grid', type=int, nargs=2, default=(10, 10), metavar=('ROWS', 'COLS'))
+    parser.add_argument('--cache-dir', help='where compiled scenes are cached (default: .scene_cache next to it)')
+    args = parser.parse_args()
+
+    if args.write == 'horizontal':
+        save_scene(build_horizontal_lattice(), args.scene)
+    elif args.write == 'grid':
+        from generator import build_grid_lattice
+        save_scene(build_grid_lattice(*args.grid), args.scene)
+
+    start = time.perf_counter()
+    compiled = compiled_scene(args.scene, args.cache_dir)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    compiled = compiled_scene(args.scene, args.cache_dir)
+    cached = time.perf_counter() - start
+    start = time.perf_counter()
+    sim = instantiate(compiled)
+    built = time.perf_counter() - start
+    print('%d cells, %d fixtures, %d joints' % (len(sim.rectangles), len(sim.blocks), 2 * len(sim.joints)))
+    print('load %.1f ms (parse and validate unless already cached), cached load %.1f ms, build %.1f ms' % (
+        first * 1e3, cached * 1e3, built * 1e3))
@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from lattice import fps, steps
+from checkpoint import Checkpoint, capture_state
+
+# Input actions, logged with the substep they were applied before.
+FORCE = 0        # target LEFT/RIGHT actuator, (x, y) force at its local origin
+FORCE_RECT = 1   # x = forceFlag, y = counter of sim.force_rect
+TOGGLE = 2       # target = hinge index in the flattened sim.joints pairs
+CHECKPOINT = 3   # take the in-memory checkpoint
+RESTORE = 4      # rewind to it
+WAKE = 5         # activate every sleeping lattice body
+DT = 6           # x = dt of the substeps from here on
+
+LEFT = 0
+RIGHT = 1
+
+RECORD = np.dtype([('substep', '<i8'), ('action', 'u1'), ('target', '<i4'), ('x', '<f8'), ('y', '<f8')])
+
+
+def apply_input(sim, action, target=0, x=0.0, y=0.0):
+    # The effect of one logged input on a simulation. CHECKPOINT, RESTORE and
+    # DT need state outside the simulation and are handled by the caller.
+    # Returns False, without touching the simulation, for an actuator input
+    # on a lattice that lacks that actuator: generated grids and scenes have
+    # no actuators or force_rect.
+    if action == FORCE:
+        rect = sim.left_actuator if target == LEFT else sim.right_actuator
+        if rect is None:
+            return False
+        rect.body.apply_force_at_local_point((x, y))
+    elif action == FORCE_RECT:
+        if sim.force_rect is None:
+            return False
+        sim.force_rect.forceFlag = int(x)
+        sim.force_rect.counter = int(y)
+    elif action == TOGGLE:
+        pairs = sim.joints
+        pairs[target // 2][target % 2].switch_constrain()
+    elif action == WAKE:
+        for rect in sim.rectangles:
+            if rect.body.is_sleeping:
+                rect.body.activate()
+    return True
+
+
+def state_digest(sim):
+    # Fingerprint of the full lattice state, to check a replay bit for bit.
+    digest = hashlib.sha1()
+    for name, value in sorted(capture_state(sim).items()):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    return digest.hexdigest()
+
+
+class SessionRecorder:
+    # Logs the inputs of an interactive session with the substep they were
+    # applied before. The session starts from `start`, a Checkpoint, and the
+    # simulation being recorded has to be start.instantiate(): pymunk's solver
+    # caches don't survive pickling, so only copies made from the same
+    # blueprint step identically. The log is written as one .npz on close.
+    def __init__(self, sim, path, start, checkpoint=None):
+        self.sim = sim
+        self.path = path
+        self.start = start
+        # a checkpoint taken before the session, in case it gets restored
+        self.checkpoint = checkpoint
+        self.records = []
+        self.dt = 1/fps/steps
+        sim.observers.append(self)
+
+    def log(self, action, target=0, x=0.0, y=0.0):
+        self.records.append((self.sim.substep, action, target, x, y))
+
+    def before_step(self, sim):
+        if sim.dt != self.dt:
+            self.dt = sim.dt
+            self.log(DT, x=sim.dt)
+
+    def after_step(self, sim):
+        pass
+
+    def close(self):
+        if self in self.sim.observers:
+            self.sim.observers.remove(self)
+        arrays = {
+            'records': np.array(self.records, dtype=RECORD),
+            'end_substep': np.array(self.sim.substep, dtype=np.int64),
+            'digest': np.array(state_digest(self.sim)),
+        }
+        _store_checkpoint(arrays, 'start_', self.start)
+        if self.checkpoint is not None:
+            _store_checkpoint(arrays, 'checkpoint_', self.checkpoint)
+        tmp = self.path + '.tmp.npz'
+        np.savez_compressed(tmp, **arrays)
+        os.replace(tmp, self.path)
+
+
+def _store_checkpoint(arrays, prefix, checkpoint):
+    arrays[prefix + 'blueprint'] = np.frombuffer(checkpoint.blueprint, dtype=np.uint8)
+    arrays.update({prefix + name: value for name, value in checkpoint.state.items()})
+
+
+def _load_checkpoint(data, prefix):
+    state = {name[len(prefix):]: data[name] for name in data.files
+             if name.startswith(prefix) and name != prefix + 'blueprint'}
+    return Checkpoint(state, data[prefix + 'blueprint'].tobytes())
+
+
+class Session:
+    def __init__(self, records, start, end_substep, digest=None, checkpoint=None):
+        self.records = records
+        self.start = start
+        self.end_substep = end_substep
+        self.digest = digest
+        self.checkpoint = checkpoint
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            saved = _load_checkpoint(data, 'checkpoint_') if 'checkpoint_blueprint' in data.files else None
+            return cls(data['records'], _load_checkpoint(data, 'start_'), int(data['end_substep']),
+                       str(data['digest']), saved)
+
+
+def replay(session, callback=None, on_start=None):
+    # Re-run a session headless, back to back: step to each logged substep,
+    # apply its inputs, carry on to where the session ended. on_start(sim)
+    # runs once before the first substep (to attach observers), callback(sim)
+    # after every substep. Returns the simulation.
+    sim = session.start.instantiate()
+    if on_start is not None:
+        on_start(sim)
+    checkpoint = session.checkpoint
+    dt = 1/fps/steps
+    records = session.records
+    i = 0
+    while True:
+        while i < len(records) and records[i]['substep'] <= sim.substep:
+            action, target, x, y = (int(records[i]['action']), int(records[i]['target']),
+                                    float(records[i]['x']), float(records[i]['y']))
+            if action == DT:
+                dt = x
+            elif action == CHECKPOINT:
+                checkpoint = Checkpoint.take(sim)
+            elif action == RESTORE:
+                checkpoint.restore(sim)
+            else:
+                apply_input(sim, action, target, x, y)
+            i += 1
+        if sim.substep >= session.end_substep:
+            return sim
+        sim.step(dt)
+        if callback is not None:
+            callback(sim)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded input session headlessly.')
+    parser.add_argument('session', help='session .npz written by the app (L key)')
+    parser.add_argument('--record', metavar='DIR', help='stream the replayed trajectory to DIR')
+    parser.add_argument('--every', type=int, default=steps, help='record every N substeps')
+    args = parser.parse_args()
+
+    session = Session.load(args.session)
+    recorders = []
+
+    def start_recording(sim):
+        from recorder import TrajectoryRecorder
+        recorders.append(TrajectoryRecorder(sim, args.record, every=args.every))
+
+    start = time.perf_counter()
+    sim = replay(session, on_start=start_recording if args.record else None)
+    wall_time = time.perf_counter() - start
+    for recorder in recorders:
+        recorder.close()
+    print('inputs', len(session.records))
+    print('substeps', sim.substep - session.start.substep)
+    print('simulated_time', sim.time - session.start.time)
+    print('wall_time', wall_time)
+    print('identical', state_digest(sim) == session.digest)
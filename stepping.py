@@ -0,0 +1,215 @@
+import time
+
+import numpy as np
+
+from actuation import CompiledProgram
+from lattice import fps, steps
+from geometry import LatticeGeometry
+
+
+class JointErrorProbe:
+    # Vectorized SlideJoint violation and body motion for a lattice: the
+    # poses come from one LatticeGeometry read and the joint limits are only
+    # re-read when sim.hinge_changes moves.
+    def __init__(self, sim):
+        self.sim = sim
+        self.geometry = LatticeGeometry(sim.rectangles)
+        index = {id(body): i for i, body in enumerate(self.geometry.bodies)}
+        joints = [joint for pair in sim.joints for joint in pair
+                  if id(joint.joint.a) in index and id(joint.joint.b) in index]
+        self.constraints = [joint.joint for joint in joints]
+        self.body_a = np.array([index[id(c.a)] for c in self.constraints], dtype=np.intp)
+        self.body_b = np.array([index[id(c.b)] for c in self.constraints], dtype=np.intp)
+        self.anchor_a = np.array([tuple(c.anchor_a) for c in self.constraints], dtype=float).reshape(-1, 2)
+        self.anchor_b = np.array([tuple(c.anchor_b) for c in self.constraints], dtype=float).reshape(-1, 2)
+        self.hinge_changes = None
+        self.refresh_limits()
+        self.geometry.read_poses()
+        self.last_positions = self.geometry.positions.copy()
+        self.last_angles = self.geometry.angles.copy()
+
+    def refresh_limits(self):
+        self.min = np.array([c.min for c in self.constraints], dtype=float)
+        self.max = np.array([c.max for c in self.constraints], dtype=float)
+        changed = self.hinge_changes is not None and self.hinge_changes != self.sim.hinge_changes
+        self.hinge_changes = self.sim.hinge_changes
+        return changed
+
+    def hinges_changed(self):
+        return self.sim.hinge_changes != self.hinge_changes
+
+    def _world(self, body, anchor):
+        g = self.geometry
+        angle = g.angles[body]
+        cos = np.cos(angle)
+        sin = np.sin(angle)
+        x = g.positions[body, 0] + anchor[:, 0] * cos - anchor[:, 1] * sin
+        y = g.positions[body, 1] + anchor[:, 0] * sin + anchor[:, 1] * cos
+        return x, y
+
+    def measure(self):
+        # -> (max joint violation in px, max body displacement in px, max
+        # body rotation in rad), the motion being since the previous measure.
+        # Motion comes from pose deltas so velocities never need reading.
+        g = self.geometry
+        g.read_poses()
+        if not g.bodies:
+            return 0.0, 0.0, 0.0
+        displacement = np.hypot(*(g.positions - self.last_positions).T).max()
+        rotation = np.abs(g.angles - self.last_angles).max()
+        self.last_positions[:] = g.positions
+        self.last_angles[:] = g.angles
+        if not self.constraints:
+            return 0.0, float(displacement), float(rotation)
+        ax, ay = self._world(self.body_a, self.anchor_a)
+        bx, by = self._world(self.body_b, self.anchor_b)
+        distance = np.hypot(ax - bx, ay - by)
+        violation = np.maximum(distance - self.max, self.min - distance).max()
+        return max(float(violation), 0.0), float(displacement), float(rotation)
+
+
+class AdaptiveStepper:
+    # Picks each substep's dt from the previous substep's joint violation and
+    # body motion: quiet lattices take few large steps, impacts and hinge
+    # toggles drop straight to min_dt and grow back as things settle.
+    # Chipmunk can't rewind a step, so there is no step rejection; a step
+    # that overshoots the tolerance only shrinks the following ones. Apart
+    # from the step right after a disturbance, the error is only sampled
+    # every check_interval steps, since reading every pose back out of
+    # pymunk costs about as much as a step. Substeps are never cut short to
+    # land exactly on the requested duration: time not yet covered by a whole
+    # substep carries over to the next advance() as self.lag, so every
+    # substep is at least min_dt. max_dt is 4x the fixed step; the horizontal
+    # lattice still settles cleanly at 6x but its joints tear apart at 8x,
+    # and the error estimate only sees that after the fact. While an
+    # attached actuation program still has rows to play, every substep is
+    # the program's own dt, as with fixed stepping, and while force_rect is
+    # pushing no substep is longer than the fixed one.
+    def __init__(self, sim, violation_tol=0.5, displacement_tol=1.0, rotation_tol=0.02,
+                 min_dt=1/fps/steps/4, max_dt=4/fps/steps, check_interval=4, force_threshold=1000):
+        self.sim = sim
+        self.probe = JointErrorProbe(sim)
+        self.violation_tol = violation_tol
+        self.displacement_tol = displacement_tol
+        self.rotation_tol = rotation_tol
+        self.min_dt = min_dt
+        self.max_dt = max_dt
+        self.check_interval = check_interval
+        self.force_threshold = force_threshold
+        # An external force lasts exactly one space.step, so its impulse is
+        # force * dt. That step always uses the fixed-stepping dt to deliver
+        # the same impulse App.run would. Only forces applied between
+        # substeps, like the actuator keys, show up in body.force here:
+        # force_rect and programs add theirs inside sim.step, so those are
+        # read from their own state instead.
+        self.impulse_dt = 1/fps/steps
+        self.since_check = 0
+        self.actuator_bodies = [rect.body for rect in (sim.left_actuator, sim.right_actuator) if rect is not None]
+        self.dt = min_dt
+        self.lag = 0.0
+        self.drive = self.drive_state()
+
+        self.steps_taken = 0
+        self.simulated_time = 0.0
+        self.wall_time = 0.0
+        self.min_dt_used = float('inf')
+        self.max_dt_used = 0.0
+        self.max_error = 0.0
+        self.disturbances = 0
+
+    def disturb(self):
+        self.dt = self.min_dt
+        self.disturbances += 1
+        self.since_check = self.check_interval - 1
+
+    def error(self, n_steps):
+        # displacement and rotation tolerances are per substep
+        violation, displacement, rotation = self.probe.measure()
+        return max(violation / self.violation_tol,
+                   displacement / n_steps / self.displacement_tol,
+                   rotation / n_steps / self.rotation_tol)
+
+    def drive_state(self):
+        # force_rect's (forceFlag, counter), or None without one
+        rect = self.sim.force_rect
+        return None if rect is None else (rect.forceFlag, rect.counter)
+
+    def program_dt(self):
+        # dt of an attached actuation program that isn't done yet, or None
+        for observer in self.sim.observers:
+            if isinstance(observer, CompiledProgram) and not observer.done:
+                return observer.dt
+        return None
+
+    def advance(self, duration):
+        # Step the simulation forward by `duration` seconds plus whatever the
+        # previous call left over, in whole substeps; returns the number of
+        # substeps it took.
+        start = time.perf_counter()
+        self.lag += duration
+        taken = 0
+        while True:
+            drive = self.drive_state()
+            changed = self.probe.hinges_changed() or drive != self.drive
+            # programs and a pushing force_rect add their forces inside every
+            # sim.step, so they get fixed substeps, and the error checks
+            # wait until they stop
+            fixed_dt = self.program_dt()
+            if fixed_dt is None and drive is not None and drive[0] != 0:
+                fixed_dt = self.impulse_dt
+            forced = fixed_dt is None and not changed and any(body.force.length > self.force_threshold
+                                                              for body in self.actuator_bodies)
+            if fixed_dt is not None:
+                # and grow back from there once they're done
+                dt = self.dt = fixed_dt
+            elif changed:
+                dt = self.min_dt
+            elif forced:
+                dt = self.impulse_dt
+            else:
+                dt = self.dt
+            if dt > self.lag + 1e-12:
+                break
+            if changed:
+                self.probe.refresh_limits()
+                self.drive = drive
+            if changed or forced:
+                self.disturb()
+
+            self.sim.step(dt)
+            self.lag -= dt
+            self.simulated_time += dt
+            taken += 1
+            self.min_dt_used = min(self.min_dt_used, dt)
+            self.max_dt_used = max(self.max_dt_used, dt)
+
+            self.since_check += 1
+            if fixed_dt is None and self.since_check >= self.check_interval:
+                err = self.error(self.since_check)
+                self.since_check = 0
+                self.max_error = max(self.max_error, err)
+                if err > 1:
+                    factor = max(0.25, 0.9 / err)
+                elif err < 0.5:
+                    factor = min(2.0, 0.9 / err) if err > 0 else 2.0
+                else:
+                    factor = 1.0
+                self.dt = min(max(self.dt * factor, self.min_dt), self.max_dt)
+
+        self.steps_taken += taken
+        self.wall_time += time.perf_counter() - start
+        return taken
+
+    def stats(self):
+        fixed_steps = self.simulated_time * fps * steps
+        return {
+            'adaptive_steps': self.steps_taken,
+            'fixed_steps_equivalent': fixed_steps,
+            'step_ratio': self.steps_taken / fixed_steps if fixed_steps else 0.0,
+            'min_dt': self.min_dt_used if self.steps_taken else 0.0,
+            'max_dt': self.max_dt_used,
+            'mean_dt': self.simulated_time / self.steps_taken if self.steps_taken else 0.0,
+            'max_error': self.max_error,
+            'disturbances': self.disturbances,
+            'wall_time': self.wall_time,
+        }
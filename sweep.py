@@ -0,0 +1,126 @@
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+
+from lattice import *
+from headless import run_headless
+from actuation import ActuationProgram
+
+DESIGN_PARAMS = ('rectangle_widths', 'rectangle_height', 'actuator_width', 'density', 'joint_max')
+RUN_PARAMS = ('duration', 'fps', 'steps', 'force_flag', 'counter', 'program')
+
+RESULT_COLUMNS = ['key', 'design', 'wall_time', 'substeps', 'peak_joint_impulse',
+                  'left_actuator_travel', 'right_actuator_travel', 'final_positions']
+
+
+def design_grid(**params):
+    # design_grid(density=[1e-4, 1e-3], joint_max=[25, 50]) -> 4 designs
+    names = sorted(params)
+    return [dict(zip(names, values)) for values in itertools.product(*(params[name] for name in names))]
+
+
+def design_key(design):
+    encoded = json.dumps(design, sort_keys=True).encode()
+    return hashlib.sha1(encoded).hexdigest()[:16]
+
+
+def run_design(design):
+    unknown = set(design) - set(DESIGN_PARAMS) - set(RUN_PARAMS)
+    if unknown:
+        raise ValueError('unknown design parameters: ' + ', '.join(sorted(unknown)))
+
+    sim = build_horizontal_lattice(**{k: design[k] for k in DESIGN_PARAMS if k in design})
+    sim.force_rect.forceFlag = design.get('force_flag', 0)
+    sim.force_rect.counter = design.get('counter', 0)
+    if 'program' in design:
+        # an ActuationProgram.to_dict(), part of the design key like any other parameter
+        dt = 1 / design.get('fps', fps) / design.get('steps', steps)
+        ActuationProgram.from_dict(design['program']).compile(sim, dt).attach()
+
+    left_start = Vec2d(*sim.left_actuator.body.position)
+    right_start = Vec2d(*sim.right_actuator.body.position)
+    constraints = [joint.joint for pair in sim.joints for joint in pair]
+    peak = [0.0]
+
+    def track_impulse(sim):
+        for c in constraints:
+            impulse = abs(c.impulse)
+            if impulse > peak[0]:
+                peak[0] = impulse
+
+    state, stats = run_headless(design.get('duration', 10), design.get('fps', fps), design.get('steps', steps),
+                                sim=sim, callback=track_impulse)
+
+    return {
+        'key': design_key(design),
+        'design': design,
+        'wall_time': stats['wall_time'],
+        'substeps': stats['substeps'],
+        'peak_joint_impulse': peak[0],
+        'left_actuator_travel': (sim.left_actuator.body.position - left_start).length,
+        'right_actuator_travel': (sim.right_actuator.body.position - right_start).length,
+        'final_positions': [cell['position'] + (cell['angle'],) for cell in state['cells']],
+    }
+
+
+def _write_json(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def run_sweep(designs, out_dir, workers=None):
+    # Each finished run is written to out_dir/runs/<key>.json as soon as it
+    # arrives, so a crashed or interrupted sweep picks up where it stopped.
+    run_dir = os.path.join(out_dir, 'runs')
+    os.makedirs(run_dir, exist_ok=True)
+
+    keyed = {design_key(d): d for d in designs}
+    pending = [d for key, d in keyed.items() if not os.path.exists(os.path.join(run_dir, key + '.json'))]
+
+    if pending:
+        with multiprocessing.Pool(workers or os.cpu_count()) as pool:
+            for result in pool.imap_unordered(run_design, pending):
+                _write_json(os.path.join(run_dir, result['key'] + '.json'), result)
+                print('finished', result['key'], '%.2fs' % result['wall_time'])
+
+    results = []
+    for key in keyed:
+        with open(os.path.join(run_dir, key + '.json')) as f:
+            results.append(json.load(f))
+
+    with open(os.path.join(out_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        for result in results:
+            row = dict(result)
+            row['design'] = json.dumps(result['design'], sort_keys=True)
+            row['final_positions'] = json.dumps(result['final_positions'])
+            writer.writerow(row)
+
+    return results
+
+
+def load_designs(path):
+    # Either a list of design dicts or a dict of parameter -> list of values.
+    with open(path) as f:
+        spec = json.load(f)
+    if isinstance(spec, dict):
+        return design_grid(**spec)
+    return spec
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a grid or list of lattice designs headlessly.')
+    parser.add_argument('designs', help='JSON file with a list of designs or a parameter grid')
+    parser.add_argument('out_dir')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    results = run_sweep(load_designs(args.designs), args.out_dir, args.workers)
+    print(len(results), 'designs in', os.path.join(args.out_dir, 'results.csv'))
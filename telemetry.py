@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import pymunk
+
+from lattice import *
+
+
+class JointTelemetry:
+    # Simulation observer that reads the impulse of every SlideJoint in
+    # sim.joints after every `every`-th substep and converts it to a force
+    # (|impulse| / dt). The newest `capacity` samples stay in a ring buffer
+    # for the heat map and plots. The whole run keeps only streaming
+    # aggregates per joint: the peak and its time, the RMS, and how many
+    # samples went over the limit. The limit defaults to the joint's
+    # max_force rating, which Chipmunk itself does not enforce. Impulses are
+    # read through the raw Chipmunk getter instead of pymunk's property,
+    # which halves the cost, and the aggregates are updated a ring buffer
+    # at a time. A sample costs about 13% of a step on grid lattices, and
+    # less on chains; every=N divides that by N.
+    def __init__(self, sim, capacity=256, every=1, limit=None):
+        self.sim = sim
+        self.joints = [joint for pair in sim.joints for joint in pair]
+        self._constraints = [joint.joint._constraint for joint in self.joints]
+        self._impulse = pymunk.cp.cpConstraintGetImpulse
+        n = len(self.joints)
+        if limit is None:
+            self.limit = np.array([joint.max_force for joint in self.joints], dtype=float)
+        else:
+            self.limit = np.broadcast_to(np.asarray(limit, dtype=float), (n,)).copy()
+        self.capacity = capacity
+        self.every = every
+        self.forces = np.zeros((capacity, n), dtype=np.float32)
+        self.times = np.zeros(capacity)
+        self.dts = np.ones(capacity)
+        # next ring buffer row to write; rows from _folded up to it still
+        # hold raw impulses that flush() has not folded in yet
+        self.head = 0
+        self._folded = 0
+        self.samples = 0
+        self.peak = np.zeros(n)
+        self.peak_time = np.full(n, np.nan)
+        self.sum_squares = np.zeros(n)
+        self.exceedances = np.zeros(n, dtype=np.int64)
+        self._since_sample = 0
+        sim.observers.append(self)
+
+    def before_step(self, sim):
+        pass
+
+    def after_step(self, sim):
+        self._since_sample += 1
+        if self._since_sample >= self.every:
+            self._since_sample = 0
+            self.sample()
+
+    def sample(self):
+        # Only copies the impulses into the ring buffer; converting them and
+        # updating the aggregates is done a block at a time by flush(),
+        # which keeps the per-substep cost to one read of the joints.
+        self.forces[self.head] = list(map(self._impulse, self._constraints))
+        self.times[self.head] = self.sim.time
+        self.dts[self.head] = self.sim.dt
+        self.head += 1
+        self.samples += 1
+        if self.head == self.capacity:
+            self.flush()
+            self.head = self._folded = 0
+
+    def flush(self):
+        # Turn the pending rows into forces and fold them into the peak,
+        # RMS and exceedance aggregates.
+        start, stop = self._folded, self.head
+        if stop == start:
+            return
+        block = self.forces[start:stop]
+        np.abs(block, out=block)
+        block /= self.dts[start:stop, None]
+        top = block.argmax(axis=0)
+        values = block[top, np.arange(block.shape[1])]
+        higher = values > self.peak
+        self.peak[higher] = values[higher]
+        self.peak_time[higher] = self.times[start + top[higher]]
+        self.sum_squares += np.einsum('ij,ij->j', block, block, dtype=float)
+        self.exceedances += (block > self.limit).sum(axis=0)
+        self._folded = stop
+
+    def window(self):
+        # -> (times, forces) of the samples still in the ring buffer, oldest
+        # first; forces is (samples, joints)
+        self.flush()
+        count = min(self.samples, self.capacity)
+        rows = np.arange(self.head - count, self.head) % self.capacity
+        return self.times[rows], self.forces[rows]
+
+    def rms(self):
+        self.flush()
+        return np.sqrt(self.sum_squares / self.samples) if self.samples else np.zeros(len(self.joints))
+
+    def heat(self):
+        # Per joint load over the ring buffer window, 0..1 relative to the
+        # most loaded joint, for the heat map.
+        times, forces = self.window()
+        if not len(forces):
+            return np.zeros(len(self.joints))
+        recent = forces.max(axis=0)
+        top = recent.max()
+        return recent / top if top > 0 else recent
+
+    def summary(self):
+        rms = self.rms()
+        worst = int(np.argmax(self.peak)) if len(self.joints) else None
+        return {
+            'samples': self.samples,
+            'every': self.every,
+            'simulated_time': self.sim.time,
+            'max_force': float(self.peak.max()) if len(self.joints) else 0.0,
+            'max_joint': worst,
+            'max_rms': float(rms.max()) if len(self.joints) else 0.0,
+            'exceedances': int(self.exceedances.sum()),
+            'joints_exceeded': int((self.exceedances > 0).sum()),
+            # per joint, indexed like the flattened sim.joints pairs
+            'joints': {
+                'limit': self.limit.tolist(),
+                'peak': self.peak.tolist(),
+                'peak_time': [None if np.isnan(t) else t for t in self.peak_time.tolist()],
+                'rms': rms.tolist(),
+                'exceedances': self.exceedances.tolist(),
+            },
+        }
+
+    def save(self, path):
+        summary = self.summary()
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(summary, f)
+        os.replace(tmp, path)
+        return summary
+
+    def close(self):
+        if self in self.sim.observers:
+            self.sim.observers.remove(self)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the horizontal lattice headless and report joint loads.')
+    parser.add_argument('duration', type=float, nargs='?', default=10, help='simulated seconds')
+    parser.add_argument('--out', metavar='FILE', help='write the summary as JSON')
+    parser.add_argument('--every', type=int, default=1, help='sample every N substeps')
+    parser.add_argument('--capacity', type=int, default=256, help='samples kept in the ring buffer')
+    parser.add_argument('--limit', type=float, default=None, help='force counted as an exceedance; default max_force')
+    parser.add_argument('--force-flag', type=int, default=0)
+    parser.add_argument('--counter', type=int, default=0)
+    parser.add_argument('--grid', type=int, nargs=2, metavar=('ROWS', 'COLS'),
+                        help='use a generator.py grid instead, to measure the collection overhead')
+    parser.add_argument('--top', type=int, default=5, help='print the N most loaded joints')
+    args = parser.parse_args()
+
+    from headless import run_headless
+
+    def build():
+        if args.grid:
+            from generator import build_grid_lattice
+            return build_grid_lattice(*args.grid)
+        sim = build_horizontal_lattice()
+        sim.force_rect.forceFlag = args.force_flag
+        sim.force_rect.counter = args.counter
+        return sim
+
+    # the same run without telemetry first, for the overhead
+    baseline = run_headless(args.duration, sim=build())[1]['substeps_per_sec']
+    sim = build()
+    telemetry = JointTelemetry(sim, capacity=args.capacity, every=args.every, limit=args.limit)
+    state, stats = run_headless(args.duration, sim=sim)
+    summary = telemetry.save(args.out) if args.out else telemetry.summary()
+    telemetry.close()
+
+    print('%d samples of %d joints over %.2fs' % (summary['samples'], len(telemetry.joints), stats['simulated_time']))
+    print('collection overhead %.1f%% (%.0f substeps/s without, %.0f with)' % (
+        100 * (baseline / stats['substeps_per_sec'] - 1), baseline, stats['substeps_per_sec']))
+    print('max force %.1f on joint %s, max rms %.1f, %d exceedances on %d joints' % (
+        summary['max_force'], summary['max_joint'], summary['max_rms'], summary['exceedances'],
+        summary['joints_exceeded']))
+    for i in np.argsort(telemetry.peak)[::-1][:args.top]:
+        pair, side = divmod(int(i), 2)
+        print('  joint %d (pair %d %s): peak %.1f at t=%.2fs, rms %.1f' % (
+            i, pair, 'top' if side else 'bottom', telemetry.peak[i], telemetry.peak_time[i], telemetry.rms()[i]))
@@ -0,0 +1,32 @@
+from actuation import ActuationProgram
+from lattice import build_horizontal_lattice, fps, steps
+from stepping import AdaptiveStepper
+
+# Three single-substep pushes on the right actuator, like holding the right
+# arrow key for three substeps.
+PULSES = (1.0, 1.0 + 1/fps/steps, 1.0 + 2/fps/steps)
+
+
+def pulse_program():
+    program = ActuationProgram()
+    for t in PULSES:
+        program.pulse('right', t, (100000, 0))
+    return program
+
+
+def test_pulses_survive_adaptive_stepping():
+    fixed = build_horizontal_lattice()
+    compiled = pulse_program().compile(fixed).attach()
+    for i in range(compiled.n_steps):
+        fixed.step(compiled.dt)
+
+    sim = build_horizontal_lattice()
+    compiled = pulse_program().compile(sim).attach()
+    stepper = AdaptiveStepper(sim)
+    stepper.advance(compiled.n_steps * compiled.dt)
+
+    assert compiled.done
+    assert stepper.stats()['max_dt'] <= compiled.dt
+    x = sim.right_actuator.body.position.x
+    assert x - 1210 > 1
+    assert abs(x - fixed.right_actuator.body.position.x) < 1e-6
@@ -0,0 +1,29 @@
+import numpy as np
+
+from equilibrium import relax
+from lattice import build_horizontal_lattice
+
+# A lattice that is already at rest should cost a few hundred substeps, not
+# the tens of seconds of simulated time a pushed lattice needs.
+AT_REST_SIMULATED_TIME = 2.0
+AT_REST_WALL_TIME = 0.05
+
+
+def test_relax_is_quick_at_rest():
+    sim = build_horizontal_lattice()
+    before = np.array([tuple(rect.body.position) for rect in sim.rectangles])
+    diagnostics = relax(sim)
+    after = np.array([tuple(rect.body.position) for rect in sim.rectangles])
+    assert diagnostics['converged']
+    assert diagnostics['simulated_time'] < AT_REST_SIMULATED_TIME
+    assert diagnostics['wall_time'] < AT_REST_WALL_TIME
+    assert np.abs(after - before).max() < 0.5
+
+
+def test_relax_waits_for_a_pushed_lattice():
+    sim = build_horizontal_lattice()
+    sim.force_rect.forceFlag = 1
+    sim.force_rect.counter = 10
+    diagnostics = relax(sim)
+    assert diagnostics['converged']
+    assert diagnostics['simulated_time'] > 10
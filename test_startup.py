@@ -0,0 +1,21 @@
+import multiprocessing
+
+import pytest
+
+from benchmark import CORE_MODULES, IMPORT_BUDGET, WORKER_BUDGETS, cold_import, worker_startup
+
+# Headless runs and pool workers must start without pygame and quickly; see
+# the --startup section of benchmark.py for the same checks as a report.
+
+
+@pytest.mark.parametrize('module', CORE_MODULES)
+def test_core_module_imports_without_pygame(module):
+    seconds, pygame_loaded = cold_import(module)
+    assert not pygame_loaded, '%s imports pygame' % module
+    assert seconds * 1e3 < IMPORT_BUDGET, '%s takes %.0f ms to import' % (module, seconds * 1e3)
+
+
+@pytest.mark.parametrize('method', multiprocessing.get_all_start_methods())
+def test_sweep_worker_starts_within_budget(method):
+    seconds = worker_startup(method, 'sweep')
+    assert seconds * 1e3 < WORKER_BUDGETS[method], 'a %s worker takes %.0f ms to start' % (method, seconds * 1e3)